@@ -0,0 +1,227 @@
+from asyncio import Future, TimeoutError, get_event_loop, wait_for
+from collections import Counter, deque
+from typing import Any, Deque, Dict, List, NamedTuple, Optional
+
+from kh_common.auth import AuthToken, retrieveAuthToken
+from kh_common.exceptions import jsonErrorHandler
+from kh_common.exceptions.http_error import ServiceUnavailable
+from kh_common.models.auth import Scope
+from kh_common.server.middleware.cors import KhCorsMiddleware
+from starlette.requests import Request
+from starlette.responses import Response
+from starlette.types import ASGIApp, Receive
+from starlette.types import Scope as request_scope
+from starlette.types import Send
+
+
+class RouteClass(NamedTuple) :
+	name: str
+	# the number of requests of this class that may run at once
+	limit: int
+	# the number of requests of this class that may wait for a slot, requests beyond this are shed immediately
+	queue: int
+	# the longest, in seconds, a request may wait for a slot before it's shed
+	deadline: float
+	# lower values are admitted first when slots free up
+	priority: int
+	retry_after: int = 1
+
+
+Internal: RouteClass = RouteClass('internal', limit=64, queue=256, deadline=5, priority=0)
+SinglePost: RouteClass = RouteClass('single_post', limit=128, queue=256, deadline=1, priority=1)
+Vote: RouteClass = RouteClass('vote', limit=32, queue=128, deadline=1, priority=2)
+Listing: RouteClass = RouteClass('listing', limit=48, queue=128, deadline=2, priority=3)
+Search: RouteClass = RouteClass('search', limit=32, queue=64, deadline=2, priority=4)
+Rss: RouteClass = RouteClass('rss', limit=8, queue=16, deadline=2, priority=5, retry_after=30)
+# internal routes requested without an internal token, they're rejected by auth once admitted, so they're admitted last
+Unverified: RouteClass = RouteClass('unverified', limit=8, queue=16, deadline=1, priority=6)
+
+
+def route_class(path: str) -> RouteClass :
+	if path.startswith('/i1/') :
+		return Internal
+
+	if path.startswith('/v1/post/') :
+		# related posts are a listing, hydrated the same way as a page of search results
+		return Listing if path.endswith('/related') else SinglePost
+
+	if path == '/v1/vote' :
+		return Vote
+
+	if path in { '/v1/fetch_posts', '/v1/posts' } :
+		return Search
+
+	if path == '/v1/feed.rss' :
+		return Rss
+
+	return Listing
+
+
+class Shed(Exception) :
+	pass
+
+
+class AdmissionController :
+	"""
+	limits the number of requests of each route class that run at once, as well as the total across all classes.
+	requests that can't run immediately wait in their class's queue until a slot frees up, the queues of higher
+	priority classes are always drained first.
+	"""
+
+	TotalLimit: int = 192
+
+	def __init__(self, classes: List[RouteClass]) -> None :
+		self._classes: List[RouteClass] = sorted(classes, key=lambda x : x.priority)
+		self._active: Counter = Counter()
+		self._total: int = 0
+		self._waiters: Dict[str, Deque[Future]] = { c.name: deque() for c in classes }
+		self._shed: Counter = Counter()
+
+
+	def _available(self, route: RouteClass) -> bool :
+		return self._active[route.name] < route.limit and self._total < AdmissionController.TotalLimit
+
+
+	def _take(self, route: RouteClass) -> None :
+		self._active[route.name] += 1
+		self._total += 1
+
+
+	def _waiting_on_total(self, route: RouteClass) -> bool :
+		# a class with waiters that isn't at its own limit is waiting on the shared total, which higher priority classes get first
+		return bool(self._waiters[route.name]) and self._active[route.name] < route.limit
+
+
+	def _higher_priority_waiting(self, route: RouteClass) -> bool :
+		return any(map(self._waiting_on_total, filter(lambda x : x.priority < route.priority, self._classes)))
+
+
+	async def acquire(self, route: RouteClass) -> None :
+		"""
+		waits for a slot for the given class, raises Shed if the request should be rejected instead
+		"""
+		waiters: Deque[Future] = self._waiters[route.name]
+
+		if not waiters and self._available(route) and not self._higher_priority_waiting(route) :
+			self._take(route)
+			return
+
+		if len(waiters) >= route.queue :
+			self._shed[route.name] += 1
+			raise Shed()
+
+		future: Future = get_event_loop().create_future()
+		waiters.append(future)
+
+		try :
+			await wait_for(future, route.deadline)
+
+		except TimeoutError :
+			self._shed[route.name] += 1
+			raise Shed()
+
+		except BaseException :
+			# the request was cancelled, but it may have already been given a slot
+			if future.done() and not future.cancelled() :
+				self.release(route)
+
+			raise
+
+		finally :
+			if future.cancelled() and future in waiters :
+				waiters.remove(future)
+
+
+	def release(self, route: RouteClass) -> None :
+		self._active[route.name] -= 1
+		self._total -= 1
+		self._wake()
+
+
+	def _wake(self) -> None :
+		for route in self._classes :
+			waiters: Deque[Future] = self._waiters[route.name]
+
+			while waiters and self._available(route) :
+				future: Future = waiters.popleft()
+
+				if future.done() :
+					# the waiter already timed out
+					continue
+
+				self._take(route)
+				future.set_result(None)
+
+			if self._waiting_on_total(route) :
+				# the total is exhausted, lower priority classes have to wait until this class's queue is drained
+				return
+
+
+	def stats(self) -> Dict[str, Dict[str, int]] :
+		return {
+			route.name: {
+				'active': self._active[route.name],
+				'queued': len(self._waiters[route.name]),
+				'shed': self._shed[route.name],
+				'limit': route.limit,
+			}
+			for route in self._classes
+		}
+
+
+controller: AdmissionController = AdmissionController([Internal, SinglePost, Vote, Listing, Search, Rss, Unverified])
+
+
+class AdmissionMiddleware :
+	"""
+	sheds requests before any other middleware runs. since that includes cors, shed responses are sent through a
+	KhCorsMiddleware configured with the given cors options, so browsers can still read them.
+	"""
+
+	def __init__(self, app: ASGIApp, admission: Optional[AdmissionController] = None, cors: Optional[Dict[str, Any]] = None) -> None :
+		self.app: ASGIApp = app
+		self.admission: AdmissionController = admission or controller
+		self.cors: Optional[Dict[str, Any]] = cors
+
+
+	async def _authorized(self, request: Request) -> bool :
+		# this middleware sits outside of the auth middleware, so the token has to be checked here
+		try :
+			token: AuthToken = await retrieveAuthToken(request)
+
+		except Exception :
+			return False
+
+		return Scope.internal.name in token.data.get('scope', [])
+
+
+	async def __call__(self, scope: request_scope, receive: Receive, send: Send) -> None :
+		if scope['type'] != 'http' :
+			return await self.app(scope, receive, send)
+
+		route: RouteClass = route_class(scope['path'])
+
+		if route is Internal and not await self._authorized(Request(scope, receive)) :
+			# internal requests have first claim on the total, so only those from other services are given it
+			route = Unverified
+
+		try :
+			await self.admission.acquire(route)
+
+		except Shed :
+			response: Response = jsonErrorHandler(
+				Request(scope, receive),
+				ServiceUnavailable(f'the server is currently too busy to handle {route.name} requests, try again later.'),
+			)
+			response.headers['retry-after'] = str(route.retry_after)
+
+			if self.cors is not None :
+				return await KhCorsMiddleware(response, **self.cors)(scope, receive, send)
+
+			return await response(scope, receive, send)
+
+		try :
+			await self.app(scope, receive, send)
+
+		finally :
+			self.admission.release(route)
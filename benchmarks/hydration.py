@@ -0,0 +1,49 @@
+from asyncio import gather, run
+
+from benchmarks import standins
+from kh_common.auth import KhUser
+
+import fuzzly.models.internal
+import posts
+from fuzzly.models.internal import InternalPosts
+
+
+"""
+counts the client and cache calls needed to hydrate a single page of posts,
+comparing per-post hydration (InternalPost.post) with the batched Posts.hydrate stage.
+
+usage: python -m benchmarks.hydration
+"""
+
+
+async def per_post(iposts: InternalPosts, user: KhUser) -> int :
+	client: standins.Client = standins.Client()
+	db: standins.DB = standins.DB()
+	fuzzly.models.internal.DB = db
+
+	await gather(*[post.post(client, user) for post in iposts.post_list])
+	return sum(client.calls.values()) + sum(db.calls.values())
+
+
+async def batched(iposts: InternalPosts, user: KhUser) -> int :
+	client: standins.Client = standins.Client()
+	posts.client = client
+
+	# hydrate doesn't touch the database, so the connection setup in __init__ can be skipped
+	await posts.Posts.__new__(posts.Posts).hydrate(user, iposts)
+	return sum(client.calls.values())
+
+
+async def main() -> None :
+	user: KhUser = standins.user()
+	print(f'{"page size":>10} {"per post":>10} {"batched":>10}')
+
+	for count in [1, 64, 1000] :
+		iposts: InternalPosts = standins.internal_posts(count)
+		before: int = await per_post(iposts, user)
+		after: int = await batched(iposts, user)
+		print(f'{count:>10} {before:>10} {after:>10}')
+
+
+if __name__ == '__main__' :
+	run(main())
@@ -0,0 +1,299 @@
+from argparse import ArgumentParser
+from asyncio import Future, gather, run, sleep
+from collections import defaultdict
+from datetime import datetime as dt
+from json import dumps, loads
+from random import choice, choices, randint
+from time import perf_counter
+from typing import Any, Callable, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+import admission
+import fuzzly.models.internal
+import kh_common.server.middleware.auth
+import posts
+import profiling
+import server
+from aiohttp import ClientSession
+from benchmarks import standins
+from kh_common.caching.key_value_store import KeyValueStore
+from kh_common.datetime import datetime
+from starlette.types import ASGIApp, Message
+
+from fuzzly.models.post import PostId
+
+
+"""
+drives the whole http api, either in-process or over a local socket, with every database, cache, and service call
+answered by local stand-ins. requests are either generated from a weighted mix of routes or replayed from a trace
+of the structured query logs written by Posts._fetch_posts. reports throughput and latency percentiles per route.
+
+usage:
+	python -m benchmarks.load --mix search=50,post=25,vote=10,timeline=5,comments=5,rss=5 --concurrency 64 --duration 10
+	python -m benchmarks.load --trace queries.ndjson --speed 2
+	python -m benchmarks.load --serve --port 5003                         serve the api with stand-ins installed
+	python -m benchmarks.load --url http://localhost:5003                 drive a server started with --serve
+"""
+
+
+Tags: List[str] = ['tag', 'another_tag', 'blue', 'red', 'green', 'cat', 'dog', 'fox', 'wolf', 'sketch', 'digital', 'traditional']
+Sorts: List[str] = ['hot', 'new', 'top', 'best', 'controversial']
+Posts: int = 100000
+Percentiles: Tuple[float, ...] = (0.5, 0.99, 0.999)
+
+
+class HttpRequest(NamedTuple) :
+	route: str
+	method: str
+	path: str
+	body: Optional[Dict[str, Any]] = None
+	# seconds since the start of the run at which this request should be sent, None to send immediately
+	at: Optional[float] = None
+
+
+def post_id() -> str :
+	return PostId(randint(1, Posts))
+
+
+def search(sort: Optional[str] = None, tags: Optional[List[str]] = None, count: int = 64, page: int = 1) -> HttpRequest :
+	if tags is None :
+		tags = list({ choice(Tags) for _ in range(randint(0, 3)) })
+
+	return HttpRequest('search', 'POST', '/v1/posts', { 'sort': sort or choice(Sorts), 'tags': tags, 'count': count, 'page': page })
+
+
+Routes: Dict[str, Callable[[], HttpRequest]] = {
+	'search': search,
+	'post': lambda : HttpRequest('post', 'GET', f'/v1/post/{post_id()}'),
+	'vote': lambda : HttpRequest('vote', 'POST', '/v1/vote', { 'post_id': post_id(), 'vote': choice([1, -1, None]) }),
+	'timeline': lambda : HttpRequest('timeline', 'POST', '/v1/timeline', { 'count': 64, 'page': 1 }),
+	'comments': lambda : HttpRequest('comments', 'POST', '/v1/comments', { 'post_id': post_id(), 'sort': choice(Sorts), 'count': 64, 'page': 1 }),
+	'rss': lambda : HttpRequest('rss', 'GET', '/v1/feed.rss'),
+}
+
+
+def mix(weights: Dict[str, float]) -> Iterator[HttpRequest] :
+	routes: List[str] = list(weights.keys())
+	w: List[float] = list(weights.values())
+
+	while True :
+		yield Routes[choices(routes, w)[0]]()
+
+
+def trace(filename: str, speed: float) -> Iterator[HttpRequest] :
+	"""
+	replays the structured query logs written by Posts._fetch_posts, one json object per line.
+	records exported from a log aggregator with the record nested under jsonPayload are also accepted.
+	if records have a timestamp, their original spacing is kept, sped up by speed.
+	"""
+	first: Optional[float] = None
+
+	with open(filename) as file :
+		for line in file :
+			if not line.strip() :
+				continue
+
+			record: Dict[str, Any] = loads(line)
+			timestamp: Optional[str] = record.get('timestamp')
+			record = record.get('jsonPayload', record)
+
+			if 'sort' not in record :
+				# not a _fetch_posts record
+				continue
+
+			at: Optional[float] = None
+
+			if timestamp :
+				t: float = dt.fromisoformat(timestamp.replace('Z', '+00:00')).timestamp()
+				first = t if first is None else first
+				at = (t - first) / speed
+
+			yield search(record['sort'], record.get('tags', []), record.get('count', 64), record.get('page', 1))._replace(at=at)
+
+
+def result(sql: str, params: Tuple[Any, ...]) -> Any :
+	if 'FROM kheina.public.ratings' in sql :
+		return standins.RatingRows
+
+	if 'FROM kheina.public.privacy' in sql :
+		return standins.PrivacyRows
+
+	if 'FROM kheina.public.media_type' in sql :
+		return standins.MediaTypeRows
+
+	if 'FROM kheina.public.users' in sql :
+		# every searched handle exists
+		return [(handle, i) for i, handle in enumerate(params[0])]
+
+	if 'COUNT(1)' in sql :
+		return [(Posts,)]
+
+	if 'GROUP BY posts.post_id' in sql and 'COUNT(post_votes.upvote)' in sql :
+		return [(100, 80, datetime.now())]
+
+	if 'WITH previous' in sql :
+		return [(None,)]
+
+	return standins.rows(64)
+
+
+def install(latency: float) -> None :
+	"""
+	replaces every external dependency of the server with local stand-ins
+	"""
+	KeyValueStore._client = standins.Aerospike()
+	kh_common.server.middleware.auth.retrieveAuthToken = standins.auth_token
+	profiling.retrieveAuthToken = standins.auth_token
+	admission.retrieveAuthToken = standins.auth_token
+	fuzzly.models.internal.DB = standins.DB()
+
+	posts.client = standins.Client()
+	server.posts = standins.posts_service(result, latency)
+	server.b2 = standins.B2()
+	server.UsersService = standins.UsersService()
+
+	# the startup hook would replace the stand-ins with real clients
+	server.app.router.on_startup.clear()
+	server.app.router.on_shutdown.clear()
+
+
+async def asgi(app: ASGIApp, request: HttpRequest) -> int :
+	body: bytes = dumps(request.body).encode() if request.body is not None else b''
+	status: int = 0
+	received: bool = False
+
+	async def receive() -> Message :
+		nonlocal received
+
+		if received :
+			# the client never disconnects, wait until the request is finished
+			await Future()
+
+		received = True
+		return { 'type': 'http.request', 'body': body, 'more_body': False }
+
+	async def send(message: Message) -> None :
+		nonlocal status
+
+		if message['type'] == 'http.response.start' :
+			status = message['status']
+
+	await app({
+		'type': 'http',
+		'asgi': { 'version': '3.0' },
+		'http_version': '1.1',
+		'method': request.method,
+		'scheme': 'http',
+		'path': request.path,
+		'raw_path': request.path.encode(),
+		'query_string': b'',
+		'root_path': '',
+		'headers': [
+			(b'host', b'localhost'),
+			(b'authorization', b'Bearer stand-in'),
+			(b'content-type', b'application/json'),
+			(b'content-length', str(len(body)).encode()),
+		],
+		'client': ('127.0.0.1', 0),
+		'server': ('localhost', 80),
+	}, receive, send)
+
+	return status
+
+
+async def drive(requests: Iterator[HttpRequest], send: Callable[[HttpRequest], Any], concurrency: int, duration: float) -> Tuple[Dict[str, List[float]], Dict[str, Dict[int, int]], float] :
+	latencies: Dict[str, List[float]] = defaultdict(list)
+	statuses: Dict[str, Dict[int, int]] = defaultdict(lambda : defaultdict(int))
+	begin: float = perf_counter()
+
+	async def worker() -> None :
+		while perf_counter() - begin < duration :
+			try :
+				request: HttpRequest = next(requests)
+
+			except StopIteration :
+				return
+
+			if request.at is not None :
+				await sleep(max(request.at - (perf_counter() - begin), 0))
+
+			start: float = perf_counter()
+
+			try :
+				status: int = await send(request)
+
+			except Exception :
+				status = 0
+
+			latencies[request.route].append(perf_counter() - start)
+			statuses[request.route][status] += 1
+
+	await gather(*[worker() for _ in range(concurrency)])
+	return latencies, statuses, perf_counter() - begin
+
+
+def percentile(values: List[float], p: float) -> float :
+	return values[min(int(len(values) * p), len(values) - 1)]
+
+
+def report(latencies: Dict[str, List[float]], statuses: Dict[str, Dict[int, int]], elapsed: float) -> None :
+	print(f'{"route":>10} {"requests":>10} {"req/s":>10} ' + ' '.join([f'{"p" + str(p * 100).rstrip("0").rstrip(".").replace(".", ""):>9}' for p in Percentiles]) + '  statuses')
+
+	for route, values in sorted(latencies.items()) :
+		values = sorted(values)
+		print(
+			f'{route:>10} {len(values):>10} {len(values) / elapsed:>10.1f} ' +
+			' '.join([f'{percentile(values, p) * 1000:>7.1f}ms' for p in Percentiles]) +
+			'  ' + ', '.join([f'{status}: {count}' for status, count in sorted(statuses[route].items())])
+		)
+
+
+async def main() -> None :
+	parser: ArgumentParser = ArgumentParser()
+	parser.add_argument('--mix', default='search=50,post=25,vote=10,timeline=5,comments=5,rss=5', help='weighted route mix, as route=weight pairs')
+	parser.add_argument('--trace', help='replay searches from a file of structured _fetch_posts query logs instead of the mix')
+	parser.add_argument('--speed', type=float, default=1, help='replay speed multiplier for traces with timestamps')
+	parser.add_argument('--concurrency', type=int, default=64)
+	parser.add_argument('--duration', type=float, default=10, help='seconds')
+	parser.add_argument('--latency', type=float, default=0.002, help='simulated database latency per query, in seconds')
+	parser.add_argument('--url', help='drive a server over a socket instead of in-process')
+	args = parser.parse_args()
+
+	requests: Iterator[HttpRequest] = (
+		trace(args.trace, args.speed) if args.trace
+		else mix({ route: float(weight) for route, weight in map(lambda x : x.split('='), args.mix.split(',')) })
+	)
+
+	if args.url :
+		async with ClientSession(headers={ 'authorization': 'Bearer stand-in' }) as session :
+			async def send(request: HttpRequest) -> int :
+				async with session.request(request.method, args.url + request.path, json=request.body) as response :
+					await response.read()
+					return response.status
+
+			report(*await drive(requests, send, args.concurrency, args.duration))
+
+	else :
+		install(args.latency)
+		report(*await drive(requests, lambda request : asgi(server.app, request), args.concurrency, args.duration))
+
+
+def serve() -> None :
+	parser: ArgumentParser = ArgumentParser()
+	parser.add_argument('--serve', action='store_true')
+	parser.add_argument('--port', type=int, default=5003)
+	parser.add_argument('--latency', type=float, default=0.002)
+	args, _ = parser.parse_known_args()
+
+	from uvicorn.main import run as uvicorn
+	install(args.latency)
+	uvicorn(server.app, host='127.0.0.1', port=args.port)
+
+
+if __name__ == '__main__' :
+	from sys import argv
+
+	if '--serve' in argv :
+		serve()
+
+	else :
+		run(main())
@@ -0,0 +1,53 @@
+from time import perf_counter
+from typing import Callable, List
+
+from benchmarks import standins
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from models import SearchResults
+from serialization import ListingResponse
+
+from fuzzly.models.post import Post
+
+
+"""
+compares serialization throughput of listing responses between fastapi's default path
+(jsonable_encoder + JSONResponse) and ListingResponse.
+
+usage: python -m benchmarks.serialization
+"""
+
+
+def default(results: SearchResults) -> bytes :
+	return JSONResponse(jsonable_encoder(results)).body
+
+
+def listing(results: SearchResults) -> bytes :
+	return ListingResponse(results).body
+
+
+def throughput(func: Callable[[SearchResults], bytes], results: SearchResults, seconds: float = 2) -> float :
+	total: int = 0
+	start: float = perf_counter()
+	elapsed: float = 0
+
+	while elapsed < seconds :
+		total += len(func(results))
+		elapsed = perf_counter() - start
+
+	return total / elapsed
+
+
+def main() -> None :
+	print(f'{"count":>6} {"default MB/s":>14} {"listing MB/s":>14}')
+
+	for count in [64, 1000] :
+		posts: List[Post] = standins.posts(count)
+		results: SearchResults = SearchResults(posts=posts, count=count, page=1, total=count)
+		before: float = throughput(default, results) / 2**20
+		after: float = throughput(listing, results) / 2**20
+		print(f'{count:>6} {before:>14.2f} {after:>14.2f}')
+
+
+if __name__ == '__main__' :
+	main()
@@ -0,0 +1,439 @@
+from asyncio import Lock, sleep
+from collections import Counter, defaultdict
+from datetime import datetime
+from uuid import uuid4
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Optional, Tuple, Union
+
+from aerospike.exception import RecordNotFound
+from kh_common.auth import KhUser
+from kh_common.models.auth import AuthToken, Scope
+from kh_common.models.user import User
+from kh_common.sql.query import Query
+
+from fuzzly.models._database import InternalScore, InternalUser
+from fuzzly.models.config import UserConfig
+from fuzzly.models.internal import InternalPost, InternalPosts
+from fuzzly.models.post import Post, PostId, Privacy, Rating, Score
+from fuzzly.models.user import UserPortable, UserPrivacy
+
+
+"""
+local stand-ins for the services and caches the posts service talks to. every stand-in
+records how many times each of its methods was called in its `calls` counter.
+"""
+
+
+class AuthenticatedUser(KhUser) :
+
+	async def authenticated(self, raise_error: bool = True) :
+		return True
+
+
+def user(user_id: int = 1) -> KhUser :
+	return AuthenticatedUser(user_id=user_id, token=None, scope={ Scope.user })
+
+
+def internal_user(user_id: int) -> InternalUser :
+	return InternalUser(
+		user_id=user_id,
+		name=f'user {user_id}',
+		handle=f'user{user_id}',
+		privacy=UserPrivacy.public,
+		icon=None,
+		banner=None,
+		website=None,
+		created=datetime.now(),
+		description=None,
+		verified=None,
+		badges=[],
+	)
+
+
+def internal_posts(count: int, uploaders: int = 16) -> InternalPosts :
+	now: datetime = datetime.now()
+	return InternalPosts(post_list=[
+		InternalPost(
+			post_id=i + 1,
+			title=f'post {i}',
+			description='a post description that is about as long as most of them are.',
+			user_id=i % uploaders + 1,
+			rating=Rating.general,
+			parent=None,
+			privacy=Privacy.public,
+			created=now,
+			updated=now,
+			filename=f'{i}.png',
+			media_type=None,
+			size=None,
+		)
+		for i in range(count)
+	])
+
+
+# the reference tables, as stored in the database
+RatingRows: List[Tuple[int, str]] = [(1, 'general'), (2, 'mature'), (3, 'explicit')]
+PrivacyRows: List[Tuple[int, str]] = [(1, 'public'), (2, 'unlisted'), (3, 'private'), (4, 'unpublished'), (5, 'draft')]
+MediaTypeRows: List[Tuple[int, str, str]] = [(1, 'png', 'image/png'), (2, 'jpg', 'image/jpeg'), (3, 'gif', 'image/gif'), (4, 'webp', 'image/webp')]
+
+
+def rows(count: int, uploaders: int = 16) -> List[Tuple[Any, ...]] :
+	"""
+	rows in the shape returned by Posts.internal_select
+	"""
+	now: datetime = datetime.now()
+	return [
+		(
+			i + 1,
+			f'post {i}',
+			'a post description that is about as long as most of them are.',
+			i % 3 + 1,
+			None,
+			now,
+			now,
+			f'{i}.png',
+			1,
+			1920,
+			1080,
+			i % uploaders + 1,
+			1,
+			None,
+		)
+		for i in range(count)
+	]
+
+
+def posts(count: int, uploaders: int = 16) -> List[Post] :
+	now: datetime = datetime.now()
+	return [
+		Post(
+			post_id=PostId(i + 1),
+			title=f'post {i}',
+			description='a post description that is about as long as most of them are.',
+			user=UserPortable(
+				name=f'user {i % uploaders + 1}',
+				handle=f'user{i % uploaders + 1}',
+				privacy=UserPrivacy.public,
+				icon=None,
+				verified=None,
+				following=False,
+			),
+			score=Score(up=10, down=2, total=12, user_vote=1),
+			rating=Rating.general,
+			parent=None,
+			privacy=Privacy.public,
+			created=now,
+			updated=now,
+			filename=f'{i}.png',
+			media_type=None,
+			size=None,
+			blocked=False,
+		)
+		for i in range(count)
+	]
+
+
+class Client :
+	"""
+	stand-in for fuzzly.internal.InternalClient
+	"""
+
+	def __init__(self) -> None :
+		self.calls: Counter = Counter()
+
+
+	def __hash__(self) -> int :
+		return 0
+
+
+	async def user_config(self, user_id: int) -> UserConfig :
+		self.calls['user_config'] += 1
+		return UserConfig()
+
+
+	async def user(self, user_id: int) -> InternalUser :
+		self.calls['user'] += 1
+		return internal_user(user_id)
+
+
+	async def post_tags(self, post_id: PostId) -> Dict[str, List[str]] :
+		self.calls['post_tags'] += 1
+		return { 'misc': ['tag', 'another_tag'] }
+
+
+	async def users_many(self, user_ids: List[int]) -> Dict[int, InternalUser] :
+		self.calls['users_many'] += 1
+		return { user_id: internal_user(user_id) for user_id in user_ids }
+
+
+	async def following_many(self, user: KhUser, targets: List[int]) -> Dict[int, bool] :
+		self.calls['following_many'] += 1
+		return { target: False for target in targets }
+
+
+	async def scores_many(self, post_ids: List[PostId]) -> Dict[PostId, Optional[InternalScore]] :
+		self.calls['scores_many'] += 1
+		return { post_id: InternalScore(up=10, down=2, total=12) for post_id in post_ids }
+
+
+	async def votes_many(self, user: KhUser, post_ids: List[PostId]) -> Dict[PostId, int] :
+		self.calls['votes_many'] += 1
+		return { post_id: 1 for post_id in post_ids }
+
+
+	async def tags_many(self, post_ids: List[PostId]) -> Dict[PostId, List[str]] :
+		self.calls['tags_many'] += 1
+		return { post_id: ['tag', 'another_tag'] for post_id in post_ids }
+
+
+	async def user_handle_to_id(self, handle: str) -> int :
+		self.calls['user_handle_to_id'] += 1
+		return int(handle[4:]) if handle[4:].isdigit() else 1
+
+
+class DB :
+	"""
+	stand-in for the module level fuzzly.models.internal.DB used by single post hydration
+	"""
+
+	def __init__(self) -> None :
+		self.calls: Counter = Counter()
+
+
+	async def following(self, user_id: int, target: int) -> bool :
+		self.calls['following'] += 1
+		return False
+
+
+	async def getScore(self, user: KhUser, post_id: PostId) -> Optional[Score] :
+		self.calls['getScore'] += 1
+		return Score(up=10, down=2, total=12, user_vote=1)
+
+
+class Postgres :
+	"""
+	stand-in for a postgres connection that only models latency and row locks. every statement takes Latency seconds,
+	and the rows it writes, given by locks(sql, params), stay locked until its transaction commits, like concurrent upserts
+	do in postgres. results are given by result(sql, params).
+	"""
+
+	Latency: float = 0.002
+
+	def __init__(self, locks: Callable[[str, Tuple[Any, ...]], Iterable[Hashable]], result: Callable[[str, Tuple[Any, ...]], Any], latency: Optional[float] = None) -> None :
+		self.calls: Counter = Counter()
+		self.latency: float = Postgres.Latency if latency is None else latency
+		self._locks: Callable[[str, Tuple[Any, ...]], Iterable[Hashable]] = locks
+		self._result: Callable[[str, Tuple[Any, ...]], Any] = result
+		self._rows: Dict[Hashable, Lock] = defaultdict(Lock)
+
+
+	async def query_async(self, sql: Union[str, Query], params: Tuple[Any, ...] = (), fetch_one: bool = False, fetch_all: bool = False) -> Any :
+		self.calls['query'] += 1
+
+		if isinstance(sql, Query) :
+			sql, params = sql.build()
+
+		if self.latency :
+			await sleep(self.latency)
+
+		return self._fetch(sql, params, fetch_one)
+
+
+	def _fetch(self, sql: str, params: Tuple[Any, ...], fetch_one: bool) -> Any :
+		result: Any = self._result(sql, params)
+
+		# results given as a list of rows are treated as a full result set
+		if fetch_one and isinstance(result, list) :
+			return result[0] if result else None
+
+		return result
+
+
+	def query(self, sql: Union[str, Query], params: Tuple[Any, ...] = (), fetch_one: bool = False, fetch_all: bool = False) -> Any :
+		self.calls['query'] += 1
+
+		if isinstance(sql, Query) :
+			sql, params = sql.build()
+
+		return self._fetch(sql, params, fetch_one)
+
+
+	def transaction(self) -> 'PostgresTransaction' :
+		return PostgresTransaction(self)
+
+
+class PostgresTransaction :
+
+	def __init__(self, db: Postgres) -> None :
+		self._db: Postgres = db
+		self._held: List[Lock] = []
+
+
+	def __enter__(self) -> 'PostgresTransaction' :
+		return self
+
+
+	def __exit__(self, *args: Any) -> None :
+		self._release()
+
+
+	def _release(self) -> None :
+		for lock in self._held :
+			lock.release()
+
+		self._held = []
+
+
+	async def query_async(self, sql: str, params: Tuple[Any, ...] = (), fetch_one: bool = False, fetch_all: bool = False) -> Any :
+		for row in self._db._locks(sql, params) :
+			lock: Lock = self._db._rows[row]
+
+			if lock not in self._held :
+				self._db.calls['lock wait'] += lock.locked()
+				await lock.acquire()
+				self._held.append(lock)
+
+		return await self._db.query_async(sql, params, fetch_one, fetch_all)
+
+
+	def commit(self) -> None :
+		self._db.calls['commit'] += 1
+		self._release()
+
+
+class KVS :
+	"""
+	stand-in for kh_common.caching.key_value_store.KeyValueStore
+	"""
+
+	def __init__(self) -> None :
+		self.calls: Counter = Counter()
+		self._store: Dict[str, Any] = { }
+
+
+	async def get_async(self, key: str) -> Any :
+		self.calls['get'] += 1
+		return self._store[key]
+
+
+	async def get_many_async(self, keys: Iterable[str]) -> Dict[str, Any] :
+		self.calls['get_many'] += 1
+		return { key: self._store.get(key) for key in keys }
+
+
+	async def put_async(self, key: str, value: Any, TTL: int = 0) -> None :
+		self.calls['put'] += 1
+		self._store[key] = value
+
+
+class Aerospike :
+	"""
+	stand-in for the aerospike client used by kh_common.caching.key_value_store.KeyValueStore
+	"""
+
+	def __init__(self) -> None :
+		self.calls: Counter = Counter()
+		self._store: Dict[Tuple[str, str, str], Dict[str, Any]] = { }
+
+
+	def get(self, key: Tuple[str, str, str]) -> Tuple[Tuple[str, str, str], Dict[str, Any], Dict[str, Any]] :
+		self.calls['get'] += 1
+
+		if key not in self._store :
+			raise RecordNotFound()
+
+		return key, { 'ttl': 0 }, self._store[key]
+
+
+	def get_many(self, keys: List[Tuple[str, str, str]]) -> List[Tuple[Tuple[str, str, str], Optional[Dict[str, Any]], Optional[Dict[str, Any]]]] :
+		self.calls['get_many'] += 1
+		return [
+			(key, { 'ttl': 0 }, self._store[key]) if key in self._store else (key, None, None)
+			for key in keys
+		]
+
+
+	def put(self, key: Tuple[str, str, str], bins: Dict[str, Any], meta: Optional[Dict[str, Any]] = None, policy: Optional[Dict[str, Any]] = None) -> None :
+		self.calls['put'] += 1
+		self._store[key] = bins
+
+
+	def remove(self, key: Tuple[str, str, str], policy: Optional[Dict[str, Any]] = None) -> None :
+		self.calls['remove'] += 1
+
+		if key not in self._store :
+			raise RecordNotFound()
+
+		del self._store[key]
+
+
+	def exists(self, key: Tuple[str, str, str], policy: Optional[Dict[str, Any]] = None) -> Tuple[Tuple[str, str, str], Optional[Dict[str, Any]]] :
+		self.calls['exists'] += 1
+		return key, ({ 'ttl': 0 } if key in self._store else None)
+
+
+class B2 :
+	"""
+	stand-in for kh_common.backblaze.B2Interface
+	"""
+
+	def __init__(self) -> None :
+		self.calls: Counter = Counter()
+
+
+	async def b2_get_file_info(self, filename: str) -> Dict[str, Any] :
+		self.calls['b2_get_file_info'] += 1
+		return { 'contentType': 'image/png', 'contentLength': 100000 }
+
+
+class UsersService :
+	"""
+	stand-in for the users service gateway
+	"""
+
+	def __init__(self) -> None :
+		self.calls: Counter = Counter()
+
+
+	async def __call__(self, auth: Optional[str] = None) -> User :
+		self.calls['fetch_self'] += 1
+		return User(
+			name='user 1',
+			handle='user1',
+			privacy='public',
+			icon=None,
+			banner=None,
+			website=None,
+			created=datetime.now(),
+			description=None,
+			verified=None,
+			following=False,
+		)
+
+
+async def auth_token(request: Any) -> AuthToken :
+	"""
+	stand-in for kh_common.auth.retrieveAuthToken, every request is authenticated as user 1 with internal scope
+	"""
+	return AuthToken(
+		user_id=1,
+		expires=datetime.now(),
+		guid=uuid4(),
+		data={ 'scope': ['internal'] },
+		token_string='stand-in',
+	)
+
+
+def posts_service(result: Callable[[str, Tuple[Any, ...]], Any], latency: float = 0) -> Any :
+	"""
+	a posts.Posts instance whose queries are answered by result(sql, params)
+	"""
+	import posts
+
+	db: Postgres = Postgres(lambda *_ : (), result, latency=latency)
+
+	# the stand-in replaces the connection entirely, so the connection setup in __init__ can be skipped
+	instance: posts.Posts = posts.Posts.__new__(posts.Posts)
+	instance.query = db.query
+	instance.query_async = db.query_async
+	instance.transaction = db.transaction
+	return instance
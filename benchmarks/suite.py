@@ -0,0 +1,209 @@
+from argparse import ArgumentParser
+from asyncio import run
+from inspect import isawaitable, unwrap
+from json import dumps, loads
+from os import path
+from sys import exit
+from time import perf_counter
+from tracemalloc import get_traced_memory, reset_peak, start, stop
+from typing import Any, Awaitable, Callable, Dict, List, Tuple, Union
+
+import posts
+import server
+from benchmarks import standins
+from kh_common.auth import KhUser
+from kh_common.datetime import datetime
+from scoring import best, confidence, controversial, hot
+from search import SearchQuery
+
+from fuzzly.models.post import Post, PostSort
+
+
+"""
+measures the throughput and peak memory per operation of the service's hot paths at page sizes of 1, 64, and 1000,
+with every database, cache, and client call answered by local stand-ins. results are compared to a stored baseline
+and the process exits non-zero if any benchmark regressed by more than the threshold.
+
+usage:
+	python -m benchmarks.suite                 compare against benchmarks/baseline.json
+	python -m benchmarks.suite --save          record a new baseline, run this on the reference machine
+"""
+
+
+PageSizes: Tuple[int, ...] = (1, 64, 1000)
+Baseline: str = path.join(path.dirname(__file__), 'baseline.json')
+# the fraction ops/sec may drop, or peak memory may grow, before a benchmark is considered regressed
+Threshold: float = 0.2
+
+Operation = Callable[[], Union[Any, Awaitable[Any]]]
+
+
+def service(count: int) -> posts.Posts :
+	"""
+	a Posts instance, connected to stand-ins, whose queries return count rows
+	"""
+	def result(sql: str, params: Tuple[Any, ...]) -> Any :
+		if 'FROM kheina.public.ratings' in sql :
+			return standins.RatingRows
+
+		if 'FROM kheina.public.privacy' in sql :
+			return standins.PrivacyRows
+
+		if 'FROM kheina.public.media_type' in sql :
+			return standins.MediaTypeRows
+
+		return standins.rows(count)
+
+	posts.PostKVS = standins.KVS()
+	return standins.posts_service(result)
+
+
+def parse_response(count: int) -> Operation :
+	instance: posts.Posts = service(count)
+	rows: List[Tuple[Any, ...]] = standins.rows(count)
+	return lambda : instance.parse_response(rows)
+
+
+def fetch_posts(count: int) -> Operation :
+	instance: posts.Posts = service(count)
+	# bypass every cache layer, only the query building and parsing are measured
+	fetch: Callable = unwrap(posts.Posts._fetch_posts)
+	search: SearchQuery = SearchQuery.parse(PostSort.hot, ['tag', 'another_tag', '-excluded', 'general'])
+	return lambda : fetch(instance, search, count, 1)
+
+
+def total_results(count: int) -> Operation :
+	instance: posts.Posts = service(count)
+
+	async def post_count(tag: str) -> int :
+		return 100000 if tag == '_' else 1000
+
+	instance.post_count = post_count
+	tags: List[str] = [f'tag_{i}' if i % 2 else f'-tag_{i}' for i in range(min(count, 64))]
+	return lambda : instance.total_results(tags)
+
+
+def hydrate(count: int) -> Operation :
+	posts.client = standins.Client()
+	instance: posts.Posts = service(count)
+	user: KhUser = standins.user()
+	iposts = standins.internal_posts(count)
+	return lambda : instance.hydrate(user, iposts)
+
+
+def scores(count: int) -> Operation :
+	now: float = datetime.now().timestamp()
+	votes: List[Tuple[int, int]] = [(i * 7 % 500, i * 3 % 100) for i in range(count)]
+
+	def func() -> None :
+		for up, down in votes :
+			hot(up, down, now)
+			controversial(up, down)
+			confidence(up, up + down)
+			best(up, up + down)
+
+	return func
+
+
+def rss(count: int) -> Operation :
+	timeline: List[Post] = standins.posts(count)
+	media: Dict[str, str] = { post.post_id: '\n<enclosure url="https://cdn.fuzz.ly/0.png" length="100000" type="image/png"/>' for post in timeline }
+	now: datetime = datetime.now()
+	return lambda : server.rss_feed('user', now, timeline, media)
+
+
+Benchmarks: Dict[str, Callable[[int], Operation]] = {
+	'parse_response': parse_response,
+	'_fetch_posts': fetch_posts,
+	'total_results': total_results,
+	'hydrate': hydrate,
+	'scoring': scores,
+	'rss': rss,
+}
+
+
+async def call(func: Operation) -> None :
+	result: Any = func()
+
+	if isawaitable(result) :
+		await result
+
+
+async def measure(func: Operation, seconds: float) -> Dict[str, float] :
+	# warm up any lazily populated caches first
+	await call(func)
+
+	start()
+	reset_peak()
+	await call(func)
+	_, peak = get_traced_memory()
+	stop()
+
+	ops: int = 0
+	begin: float = perf_counter()
+	elapsed: float = 0
+
+	while elapsed < seconds :
+		await call(func)
+		ops += 1
+		elapsed = perf_counter() - begin
+
+	return { 'ops': ops / elapsed, 'peak_bytes': peak }
+
+
+def regressions(results: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]]) -> List[str] :
+	regressed: List[str] = []
+
+	for name, result in results.items() :
+		if name not in baseline :
+			continue
+
+		if result['ops'] < baseline[name]['ops'] * (1 - Threshold) :
+			regressed.append(f'{name}: {result["ops"]:.0f} ops/s, baseline {baseline[name]["ops"]:.0f} ops/s')
+
+		if result['peak_bytes'] > baseline[name]['peak_bytes'] * (1 + Threshold) :
+			regressed.append(f'{name}: {result["peak_bytes"] / 1024:.0f} KiB peak, baseline {baseline[name]["peak_bytes"] / 1024:.0f} KiB peak')
+
+	return regressed
+
+
+async def main() -> None :
+	parser: ArgumentParser = ArgumentParser()
+	parser.add_argument('--save', action='store_true', help='store the results as the new baseline')
+	parser.add_argument('--seconds', type=float, default=1, help='how long to run each benchmark for')
+	args = parser.parse_args()
+
+	baseline: Dict[str, Dict[str, float]] = { }
+
+	if path.isfile(Baseline) :
+		with open(Baseline) as file :
+			baseline = loads(file.read())
+
+	results: Dict[str, Dict[str, float]] = { }
+	print(f'{"benchmark":>24} {"ops/s":>12} {"peak KiB":>10} {"vs baseline":>12}')
+
+	for name, benchmark in Benchmarks.items() :
+		for count in PageSizes :
+			key: str = f'{name}[{count}]'
+			result: Dict[str, float] = await measure(benchmark(count), args.seconds)
+			results[key] = result
+			change: str = f'{result["ops"] / baseline[key]["ops"] - 1:+.1%}' if key in baseline else '-'
+			print(f'{key:>24} {result["ops"]:>12.0f} {result["peak_bytes"] / 1024:>10.1f} {change:>12}')
+
+	if args.save :
+		with open(Baseline, 'w') as file :
+			file.write(dumps(results, indent='\t'))
+
+		print('saved baseline to', Baseline)
+		return
+
+	regressed: List[str] = regressions(results, baseline)
+
+	if regressed :
+		print('\nregressions:')
+		print('\n'.join(regressed))
+		exit(1)
+
+
+if __name__ == '__main__' :
+	run(main())
@@ -0,0 +1,68 @@
+from asyncio import gather, run
+from datetime import datetime
+from time import perf_counter
+from typing import Any, Hashable, Iterable, Tuple
+
+import scoring
+from benchmarks import standins
+from scoring import Scoring
+
+from fuzzly.models.post import PostId
+
+
+"""
+measures vote throughput when many users vote on the same post at once, comparing votes written directly
+to the post's post_scores row with votes spread across sharded counters.
+
+usage: python -m benchmarks.votes
+"""
+
+
+def locks(sql: str, params: Tuple[Any, ...]) -> Iterable[Hashable] :
+	# the only rows concurrent voters on a single post can contend over
+	if 'INSERT INTO kheina.public.post_scores' in sql :
+		yield ('post_scores', params[0])
+
+	elif 'INSERT INTO kheina.public.post_score_shards' in sql :
+		yield ('post_score_shards', params[0], params[1])
+
+
+def result(sql: str, params: Tuple[Any, ...]) -> Any :
+	if 'GROUP BY posts.post_id' in sql :
+		return (100, 80, datetime.now())
+
+	if 'WITH previous' in sql :
+		return (None,)
+
+	return (80, 20)
+
+
+async def votes_per_second(shards: int, voters: int) -> float :
+	Scoring.ScoreShards = shards
+	db: standins.Postgres = standins.Postgres(locks, result)
+
+	# transaction and query_async are all the vote path needs from the database, so the connection setup in __init__ can be skipped
+	service: Scoring = Scoring.__new__(Scoring)
+	service.transaction = db.transaction
+	service.query_async = db.query_async
+
+	post_id: PostId = PostId(1)
+	start: float = perf_counter()
+	await gather(*[service._vote(standins.user(user_id), post_id, True) for user_id in range(1, voters + 1)])
+	return voters / (perf_counter() - start)
+
+
+async def main() -> None :
+	scoring.ScoreCache = standins.KVS()
+	scoring.VoteCache = standins.KVS()
+	voters: int = 256
+
+	print(f'{voters} concurrent voters on a single post, {standins.Postgres.Latency * 1000:.0f}ms per statement')
+	print(f'{"shards":>10} {"votes/s":>10}')
+
+	for shards in [0, 4, 16, 64] :
+		print(f'{shards or "direct":>10} {await votes_per_second(shards, voters):>10.0f}')
+
+
+if __name__ == '__main__' :
+	run(main())
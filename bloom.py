@@ -0,0 +1,187 @@
+from collections import OrderedDict
+from hashlib import blake2b
+from math import ceil, log
+from os import replace
+from struct import Struct
+from time import time
+from typing import Iterable, Iterator, Optional, Tuple
+
+
+# snapshot files hold the time the filter was current as of, its size in bits and number of hashes, followed by the bits
+SnapshotHeader: Struct = Struct('<dQQ')
+
+
+class BloomFilter :
+	"""
+	set membership in fixed memory. a key that was added is always reported as present, a key that wasn't is
+	reported as present with probability error_rate, as long as no more than capacity keys have been added.
+	"""
+
+	def __init__(self: 'BloomFilter', capacity: int, error_rate: float) -> None :
+		assert capacity > 0 and 0 < error_rate < 1
+		bits: int = ceil(-capacity * log(error_rate) / log(2) ** 2)
+		self._bits: bytearray = bytearray((bits + 7) // 8)
+		self._size: int = len(self._bits) * 8
+		self._hashes: int = max(round(self._size / capacity * log(2)), 1)
+
+
+	def _positions(self: 'BloomFilter', key: int) -> Iterator[int] :
+		# double hashing, every position is derived from a single digest
+		digest: bytes = blake2b(key.to_bytes(8, 'big'), digest_size=16).digest()
+		h1: int = int.from_bytes(digest[:8], 'big')
+		h2: int = int.from_bytes(digest[8:], 'big') | 1
+
+		for i in range(self._hashes) :
+			yield (h1 + i * h2) % self._size
+
+
+	def add(self: 'BloomFilter', key: int) -> None :
+		for position in self._positions(key) :
+			self._bits[position >> 3] |= 1 << (position & 7)
+
+
+	def __contains__(self: 'BloomFilter', key: int) -> bool :
+		for position in self._positions(key) :
+			if not self._bits[position >> 3] & 1 << (position & 7) :
+				return False
+
+		return True
+
+
+	def save(self: 'BloomFilter', path: str, since: float) -> None :
+		"""
+		writes the filter to the given file, along with the time it's current as of, replacing it atomically
+		"""
+		with open(path + '.tmp', 'wb') as file :
+			file.write(SnapshotHeader.pack(since, self._size, self._hashes))
+			file.write(self._bits)
+
+		replace(path + '.tmp', path)
+
+
+	@staticmethod
+	def load(path: str) -> Tuple['BloomFilter', float] :
+		"""
+		reads a filter written by save, and returns it along with the time it's current as of
+		"""
+		with open(path, 'rb') as file :
+			data: bytes = file.read()
+
+		since, size, hashes = SnapshotHeader.unpack_from(data, 0)
+		assert len(data) == SnapshotHeader.size + size // 8
+
+		bloom: BloomFilter = BloomFilter.__new__(BloomFilter)
+		bloom._bits = bytearray(data[SnapshotHeader.size:])
+		bloom._size = size
+		bloom._hashes = hashes
+		return bloom, since
+
+
+class KnownPosts :
+	"""
+	tracks which post ids exist, to avoid database round trips. every existing post id is kept in a bloom filter,
+	and ids that were looked up and not found are kept in a short lived negative cache.
+	new posts reach the filter through their invalidation events, and through polling, which catches any post created
+	without one. a miss is only trusted while the filter is synced, within SyncedTTL seconds of the last successful poll
+	and with no invalidation events missed since. otherwise, an id the filter doesn't contain has to be confirmed with
+	the database, see unconfirmed.
+	"""
+
+	ErrorRate: float = 0.001
+	# the filter is sized for this many times the number of posts when it's built, leaving room for new posts
+	Headroom: float = 2
+	MinCapacity: int = 1000000
+	NegativeTTL: float = 30
+	NegativeSize: int = 65536
+	# longer than Posts.KnownPostsInterval, so that misses stay trusted from one successful poll to the next
+	SyncedTTL: float = 15
+
+	def __init__(self: 'KnownPosts') -> None :
+		self._filter: Optional[BloomFilter] = None
+		self._building: Optional[BloomFilter] = None
+		self._negative: OrderedDict[int, float] = OrderedDict()
+		self._synced: Optional[float] = None
+
+
+	def build(self: 'KnownPosts', count: int) -> BloomFilter :
+		"""
+		starts a new filter sized for count posts. ids added from now on go into both filters, until finish is called.
+		"""
+		self._building = BloomFilter(max(ceil(count * KnownPosts.Headroom), KnownPosts.MinCapacity), KnownPosts.ErrorRate)
+		return self._building
+
+
+	def load(self: 'KnownPosts', bloom: BloomFilter) -> None :
+		"""
+		same as build, but starts from a filter that was already built, see BloomFilter.load
+		"""
+		self._building = bloom
+
+
+	def finish(self: 'KnownPosts') -> None :
+		self._filter, self._building = self._building, None
+
+
+	def synced(self: 'KnownPosts') -> None :
+		"""
+		called once the filter contains every post created up to now
+		"""
+		self._synced = time()
+
+
+	def desynced(self: 'KnownPosts') -> None :
+		"""
+		called when invalidation events may have been missed, misses aren't trusted again until the next poll
+		"""
+		self._synced = None
+
+
+	def _trusted(self: 'KnownPosts') -> bool :
+		return self._filter is not None and self._synced is not None and time() - self._synced <= KnownPosts.SyncedTTL
+
+
+	def add(self: 'KnownPosts', post_ids: Iterable[int]) -> None :
+		for post_id in post_ids :
+			self._negative.pop(post_id, None)
+
+			if self._filter is not None :
+				self._filter.add(post_id)
+
+			if self._building is not None :
+				self._building.add(post_id)
+
+
+	def not_found(self: 'KnownPosts', post_id: int) -> None :
+		self._negative[post_id] = time() + KnownPosts.NegativeTTL
+		self._negative.move_to_end(post_id)
+
+		while len(self._negative) > KnownPosts.NegativeSize :
+			self._negative.popitem(last=False)
+
+
+	def unconfirmed(self: 'KnownPosts', post_id: int) -> bool :
+		"""
+		true when the post may not exist, and has to be looked up before it's trusted. false means it either almost
+		certainly does, or is missing. until the first filter has been built, every post is assumed to exist.
+		"""
+		return self._filter is not None and not self._trusted() and post_id not in self._filter
+
+
+	def missing(self: 'KnownPosts', post_id: int) -> bool :
+		"""
+		true when the filter is synced and doesn't contain the post, or when the post was looked up within the last
+		NegativeTTL seconds and didn't exist
+		"""
+		if self._trusted() and post_id not in self._filter :
+			return True
+
+		expires: Optional[float] = self._negative.get(post_id)
+
+		if expires is None :
+			return False
+
+		if expires < time() :
+			del self._negative[post_id]
+			return False
+
+		return True
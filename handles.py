@@ -0,0 +1,117 @@
+from asyncio import ensure_future, gather
+from collections import OrderedDict
+from time import time
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+from aerospike.exception import RecordNotFound
+from kh_common.caching.key_value_store import KeyValueStore
+
+
+class HandleResolver :
+	"""
+	maps lowercase user handles to user ids. each batch of handles is looked up in an in-process LRU, then in a single
+	aerospike batch read, and finally by the loader, in a single call. handles that don't exist are never cached,
+	since they can be claimed at any time.
+	"""
+
+	CacheSize: int = 65536
+	# invalidation events reach every worker, this only bounds how long a worker that missed one can resolve a stale handle.
+	# aerospike holds the longer lived copy, so a short TTL costs a batch read per few seconds, not a database query
+	CacheTTL: float = 5
+	# aerospike entries are removed when a handle changes, the TTL only bounds how long handles nobody uses are kept
+	KvsTTL: int = 7 * 86400
+
+	def __init__(self: 'HandleResolver', kvs: KeyValueStore) -> None :
+		self._kvs: KeyValueStore = kvs
+		self._cache: OrderedDict[str, Tuple[float, int]] = OrderedDict()
+		self._generation: int = 0
+
+
+	def _cache_get(self: 'HandleResolver', handle: str, now: float) -> Optional[int] :
+		entry: Optional[Tuple[float, int]] = self._cache.get(handle)
+
+		if not entry :
+			return None
+
+		if entry[0] < now :
+			del self._cache[handle]
+			return None
+
+		self._cache.move_to_end(handle)
+		return entry[1]
+
+
+	def _cache_put(self: 'HandleResolver', handle: str, user_id: int) -> None :
+		self._cache[handle] = (time() + HandleResolver.CacheTTL, user_id)
+		self._cache.move_to_end(handle)
+
+		while len(self._cache) > HandleResolver.CacheSize :
+			self._cache.popitem(last=False)
+
+
+	async def resolve(self: 'HandleResolver', handles: Iterable[str], loader: Callable[[List[str]], Awaitable[Dict[str, int]]]) -> Dict[str, int] :
+		"""
+		returns the user id of every given handle that exists. loader receives the handles found in neither cache tier
+		and returns the user ids of those that exist.
+		"""
+		now: float = time()
+		generation: int = self._generation
+		user_ids: Dict[str, int] = { }
+		misses: List[str] = []
+
+		for handle in dict.fromkeys(handles) :
+			user_id: Optional[int] = self._cache_get(handle, now)
+
+			if user_id is None :
+				misses.append(handle)
+
+			else :
+				user_ids[handle] = user_id
+
+		if not misses :
+			return user_ids
+
+		stored: Dict[str, Optional[int]] = await self._kvs.get_many_async(misses)
+		loaded: Dict[str, int] = { }
+		misses = [handle for handle in misses if stored.get(handle) is None]
+
+		if misses :
+			loaded = await loader(misses)
+
+		found: Dict[str, int] = { handle: user_id for handle, user_id in stored.items() if user_id is not None }
+		found.update(loaded)
+		user_ids.update(found)
+
+		# a handle changed while these were being looked up, so they may already be stale
+		if generation != self._generation :
+			return user_ids
+
+		for handle, user_id in found.items() :
+			self._cache_put(handle, user_id)
+
+		for handle, user_id in loaded.items() :
+			ensure_future(self._kvs.put_async(handle, user_id, HandleResolver.KvsTTL))
+
+		return user_ids
+
+
+	async def _remove(self: 'HandleResolver', handle: str) -> None :
+		try :
+			await self._kvs.remove_async(handle)
+
+		except RecordNotFound :
+			pass
+
+
+	async def invalidate(self: 'HandleResolver', handles: Iterable[str]) -> None :
+		"""
+		forgets the given handles, in this process and in aerospike. called with both the old and new handle when a
+		user's handle changes.
+		"""
+		self._generation += 1
+		handles = list(handles)
+
+		for handle in handles :
+			self._cache.pop(handle, None)
+
+		await gather(*map(self._remove, handles))
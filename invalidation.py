@@ -0,0 +1,393 @@
+from asyncio import Lock, Task, ensure_future, get_event_loop, sleep
+from collections import OrderedDict, defaultdict
+from copy import copy
+from functools import wraps
+from threading import Lock as ThreadLock
+from time import time
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterable, List, Optional, Set, Tuple
+
+from kh_common.config.constants import environment
+from kh_common.logging import Logger, getLogger
+from models import InvalidationEvent
+from ujson import loads as json_loads
+
+
+# every IndexedCache, so that they can all be cleared at once, see clear_all
+_caches: List[Callable] = []
+
+
+def clear_all() -> None :
+	for cache in _caches :
+		cache.clear()
+
+
+def IndexedCache(TTL_seconds:float=0, TTL_minutes:float=0, TTL_hours:float=0, TTL_days:float=0, index:Callable[..., Iterable[Hashable]]=lambda *_ : (), maxsize:int=0) -> Callable :
+	"""
+	stores results for every argument used to call, in the same way as kh_common.caching.ArgsCache.
+	additionally, every result is indexed under the dependency keys returned by index(*args, result) so that it can be evicted before its TTL via wrapper.invalidate(*keys).
+	if maxsize is set, the oldest results are evicted once more than maxsize results are cached.
+	wrapper.refresh(*args) recomputes and replaces a cached result without waiting for it to expire.
+	requires all arguments to be hashable, keywords are not included in the cache key.
+	"""
+	TTL: float = TTL_seconds + TTL_minutes * 60 + TTL_hours * 3600 + TTL_days * 86400
+	del TTL_seconds, TTL_minutes, TTL_hours, TTL_days
+
+	def decorator(func: Callable) -> Callable :
+
+		def evict(key: Tuple[Any]) -> None :
+			_, _, dependencies = decorator.cache.pop(key, (None, None, ()))
+
+			for dependency in dependencies :
+				keys: Optional[Set[Tuple[Any]]] = decorator.index.get(dependency)
+
+				if keys is None :
+					continue
+
+				keys.discard(key)
+
+				if not keys :
+					del decorator.index[dependency]
+
+
+		def clear_expired() -> None :
+			now: float = time()
+
+			while decorator.cache :
+				key: Tuple[Any] = next(iter(decorator.cache))
+
+				if decorator.cache[key][0] >= now :
+					break
+
+				evict(key)
+
+
+		def store(key: Tuple[Any], data: Any) -> None :
+			dependencies: Tuple[Hashable] = tuple(index(*key, data))
+			decorator.cache[key] = (time() + TTL, data, dependencies)
+
+			for dependency in dependencies :
+				decorator.index[dependency].add(key)
+
+			while maxsize and len(decorator.cache) > maxsize :
+				evict(next(iter(decorator.cache)))
+
+
+		@wraps(func)
+		async def wrapper(*key: Tuple[Any], **kwargs:Dict[str, Any]) -> Any :
+			async with decorator.lock :
+				clear_expired()
+
+			if key in decorator.cache :
+				return copy(decorator.cache[key][1])
+
+			generation: int = decorator.generation
+			data: Any = await func(*key, **kwargs)
+
+			# an invalidation arrived while the function was running, so this result may already be stale
+			if generation != decorator.generation :
+				return copy(data)
+
+			store(key, data)
+			return copy(data)
+
+
+		async def refresh(*key: Tuple[Any], **kwargs:Dict[str, Any]) -> Any :
+			"""
+			recomputes the result for the given arguments, replacing the cached result if one exists.
+			"""
+			generation: int = decorator.generation
+
+			# refresh through the wrapped function's own cache, if it has one, so that every tier is updated
+			data: Any = await getattr(func, 'refresh', func)(*key, **kwargs)
+
+			if generation == decorator.generation :
+				evict(key)
+				store(key, data)
+
+			return copy(data)
+
+
+		def invalidate(*dependencies: Tuple[Hashable]) -> int :
+			"""
+			evicts every cached result indexed under any of the given dependency keys.
+			returns the number of results evicted.
+			"""
+			decorator.generation += 1
+			keys: Set[Tuple[Any]] = set()
+
+			for dependency in dependencies :
+				keys.update(decorator.index.get(dependency, ()))
+
+			for key in keys :
+				evict(key)
+
+			return len(keys)
+
+
+		def clear() -> None :
+			decorator.generation += 1
+			decorator.cache.clear()
+			decorator.index.clear()
+
+
+		wrapper.invalidate = invalidate
+		wrapper.refresh = refresh
+		wrapper.clear = clear
+		wrapper.cache = decorator.cache
+		_caches.append(wrapper)
+		return wrapper
+
+	decorator.cache = OrderedDict()
+	decorator.index = defaultdict(set)
+	decorator.generation = 0
+	decorator.lock = Lock()
+	return decorator
+
+
+class LocalEventSource :
+	"""
+	in-process stand-in for the invalidation message queue. used in local and test environments,
+	mirrors the receiveAll and publish interface of FanoutEventSource.
+	"""
+
+	def __init__(self: 'LocalEventSource') -> None :
+		self._messages: List[bytes] = []
+		self.gaps: int = 0
+
+
+	def publish(self: 'LocalEventSource', events: Iterable[InvalidationEvent]) -> None :
+		self._messages += [event.json().encode() for event in events]
+
+
+	def receiveAll(self: 'LocalEventSource') -> List[bytes] :
+		messages: List[bytes] = self._messages
+		self._messages = []
+		return messages
+
+
+	def close(self: 'LocalEventSource') -> None :
+		pass
+
+
+class FanoutEventSource :
+	"""
+	delivers every invalidation event to every process. each process consumes its own exclusive, auto-delete queue,
+	bound to a fanout exchange, rather than competing with other workers for messages on a single shared queue.
+	when the queue configured for kh_common.message_queue is published through an exchange, the queue is bound to that
+	exchange as well, so that events from services publishing there reach every process too.
+	the queue only exists while its connection is open, so any events published while reconnecting are missed.
+	gaps counts those reconnections, so that the listener can drop everything it may have missed an event for.
+	"""
+
+	Exchange: str = 'posts.invalidation'
+
+	def __init__(self: 'FanoutEventSource', config: Dict[str, Any]) -> None :
+		self._connection_info: Dict[str, Any] = config['connection_info']
+		self._route: Optional[str] = config.get('routing_key')
+		self._exchange_info: Optional[Dict[str, Any]] = config.get('exchange_info')
+		self._connection: Any = None
+		self._channel: Any = None
+		self._publisher: Any = None
+		self._publish_channel: Any = None
+		self._publish_lock: ThreadLock = ThreadLock()
+		self._queue: Optional[str] = None
+		self._connected: bool = False
+		self.gaps: int = 0
+
+
+	def _connect(self: 'FanoutEventSource') -> None :
+		from pika import BlockingConnection, ConnectionParameters
+
+		self._connection = BlockingConnection(ConnectionParameters(**self._connection_info))
+		self._channel = self._connection.channel()
+		self._channel.exchange_declare(exchange=FanoutEventSource.Exchange, exchange_type='fanout', durable=True)
+		self._queue = self._channel.queue_declare('', exclusive=True, auto_delete=True).method.queue
+		self._channel.queue_bind(queue=self._queue, exchange=FanoutEventSource.Exchange)
+
+		if self._exchange_info and self._route :
+			self._channel.exchange_declare(**self._exchange_info)
+			self._channel.queue_bind(queue=self._queue, exchange=self._exchange_info['exchange'], routing_key=self._route)
+
+		if self._connected :
+			self.gaps += 1
+
+		self._connected = True
+
+
+	def _close(self: 'FanoutEventSource', connection: Any) -> None :
+		try :
+			if connection and connection.is_open :
+				connection.close()
+
+		except Exception :
+			pass
+
+
+	def close(self: 'FanoutEventSource') -> None :
+		connection, self._connection, self._channel = self._connection, None, None
+		self._close(connection)
+
+		with self._publish_lock :
+			publisher, self._publisher, self._publish_channel = self._publisher, None, None
+			self._close(publisher)
+
+
+	def receiveAll(self: 'FanoutEventSource') -> List[bytes] :
+		if not self._connection or not self._connection.is_open :
+			self._connect()
+
+		messages: List[bytes] = []
+
+		try :
+			while True :
+				method, _, body = self._channel.basic_get(self._queue, auto_ack=True)
+
+				if method is None :
+					return messages
+
+				messages.append(body)
+
+		except Exception :
+			# the queue is gone along with the connection, a new one is declared on the next call
+			connection, self._connection, self._channel = self._connection, None, None
+			self._close(connection)
+			raise
+
+
+	def publish(self: 'FanoutEventSource', events: Iterable[InvalidationEvent]) -> None :
+		# publishing uses its own connection, since the consuming connection is used from the listener's thread. it's kept
+		# open between publishes, and the lock keeps publishes from different executor threads from sharing it at once
+		from pika import BlockingConnection, ConnectionParameters
+
+		bodies: List[bytes] = [event.json().encode() for event in events]
+
+		with self._publish_lock :
+			for attempt in range(2) :
+				try :
+					if not self._publisher or not self._publisher.is_open :
+						self._publisher = BlockingConnection(ConnectionParameters(**self._connection_info))
+						self._publish_channel = self._publisher.channel()
+						self._publish_channel.exchange_declare(exchange=FanoutEventSource.Exchange, exchange_type='fanout', durable=True)
+
+					for body in bodies :
+						self._publish_channel.basic_publish(exchange=FanoutEventSource.Exchange, routing_key='', body=body)
+
+					return
+
+				except Exception :
+					# the broker may have closed the connection while it sat idle, so it's retried once on a new connection.
+					# events may be sent twice, which is harmless since invalidating is idempotent
+					publisher, self._publisher, self._publish_channel = self._publisher, None, None
+					self._close(publisher)
+
+					if attempt :
+						raise
+
+
+def event_source() -> Any :
+	"""
+	returns the source the invalidation listener should read from.
+	outside of local and test environments, every worker relies on it to receive changes made through other workers, so
+	startup fails if the message queue isn't available rather than running with caches no other worker can invalidate.
+	"""
+	if environment.is_local() or environment.is_test() :
+		return LocalEventSource()
+
+	# imported here so that a missing dependency fails startup, rather than every receive
+	import pika
+
+	try :
+		from kh_common.config.credentials import message_queue
+
+	except ImportError as e :
+		raise ImportError('message_queue credentials are required to deliver invalidation events to every worker.') from e
+
+	return FanoutEventSource(message_queue)
+
+
+class InvalidationListener :
+
+	Interval: float = 1
+
+	def __init__(self: 'InvalidationListener', handler: Callable[[List[InvalidationEvent]], Awaitable[Any]], source: Any, missed: Callable[[], Any] = lambda : None) -> None :
+		self.logger: Logger = getLogger()
+		self._handler: Callable[[List[InvalidationEvent]], Awaitable[Any]] = handler
+		# called along with clear_all, whenever events may have been missed
+		self._missed: Callable[[], Any] = missed
+		self._source: Any = source
+		self._task: Optional[Task] = None
+		self._gaps: int = source.gaps
+
+
+	def start(self: 'InvalidationListener') -> None :
+		if not self._task :
+			self._task = ensure_future(self._listen())
+
+
+	def stop(self: 'InvalidationListener') -> None :
+		if self._task :
+			self._task.cancel()
+			self._task = None
+
+		self._source.close()
+
+
+	async def publish(self: 'InvalidationListener', events: List[InvalidationEvent]) -> None :
+		"""
+		sends the given events to every process, including this one
+		"""
+		await get_event_loop().run_in_executor(None, self._source.publish, events)
+
+
+	def announce(self: 'InvalidationListener', events: List[InvalidationEvent]) -> None :
+		"""
+		same as publish, but in the background. failures are logged rather than raised
+		"""
+		ensure_future(self._announce(events))
+
+
+	async def _announce(self: 'InvalidationListener', events: List[InvalidationEvent]) -> None :
+		try :
+			await self.publish(events)
+
+		except Exception as e :
+			self.logger.warning('failed to publish invalidation events.', exc_info=e)
+
+
+	def _parse(self: 'InvalidationListener', messages: List[bytes]) -> List[InvalidationEvent] :
+		events: List[InvalidationEvent] = []
+
+		for message in messages :
+			try :
+				events.append(InvalidationEvent.parse_obj(json_loads(message)))
+
+			except Exception as e :
+				self.logger.warning({
+					'message': 'failed to parse invalidation event.',
+					'event': message,
+				}, exc_info=e)
+
+		return events
+
+
+	async def _listen(self: 'InvalidationListener') -> None :
+		while True :
+			try :
+				messages: List[bytes] = await get_event_loop().run_in_executor(None, self._source.receiveAll)
+
+				if self._source.gaps != self._gaps :
+					# events may have been missed while reconnecting, so nothing cached can be trusted
+					self._gaps = self._source.gaps
+					clear_all()
+					self._missed()
+					self.logger.warning('invalidation events may have been missed, cleared every indexed cache.')
+
+				events: List[InvalidationEvent] = self._parse(messages)
+
+				if events :
+					await self._handler(events)
+
+			except Exception as e :
+				self.logger.warning('invalidation listener encountered an unexpected error.', exc_info=e)
+
+			await sleep(self.Interval)
@@ -1,15 +1,42 @@
-from typing import List, Optional, Union
+from datetime import datetime
+from enum import Enum, unique
+from typing import Any, Dict, List, Optional, Union
 
 from kh_common.config.constants import Environment, environment
 from kh_common.config.repo import short_hash
-from pydantic import BaseModel, validator
+from pydantic import BaseModel, root_validator, validator
+from search import SearchSort
 
-from fuzzly.models.post import Post, PostId, PostSort
+from fuzzly.models._database import InternalScore
+from fuzzly.models.internal import InternalPost
+from fuzzly.models.post import Post, PostId, PostSort, Privacy, Rating
+from fuzzly.models.set import SetId
 
 
 PostIdValidator = validator('post_id', pre=True, always=True, allow_reuse=True)(PostId)
 
 
+def _optional_post_id(value: Union[str, bytes, int, None]) -> Optional[PostId] :
+	return None if value is None else PostId(value)
+
+
+OptionalPostIdValidator = validator('post_id', pre=True, always=True, allow_reuse=True)(_optional_post_id)
+
+
+def _optional_set_id(value: Union[str, int, None]) -> Optional[SetId] :
+	return None if value is None else SetId(value)
+
+
+OptionalSetIdValidator = validator('set_id', pre=True, always=True, allow_reuse=True)(_optional_set_id)
+
+
+def _post_ids(value: List[Union[str, bytes, int]]) -> List[PostId] :
+	return list(map(PostId, value))
+
+
+PostIdsValidator = validator('post_ids', pre=True, always=True, allow_reuse=True)(_post_ids)
+
+
 class VoteRequest(BaseModel) :
 	_post_id_validator = PostIdValidator
 
@@ -22,12 +49,30 @@ class TimelineRequest(BaseModel) :
 	page: Optional[int] = 1
 
 
+class TimelineSinceRequest(BaseModel) :
+	_post_id_validator = PostIdValidator
+
+	# the newest timeline post the client has, as returned by the timeline
+	post_id: PostId
+	created: datetime
+	count: Optional[int] = 64
+
+
+class TimelineCount(BaseModel) :
+	count: int
+	# true when there are more new posts than count
+	more: bool
+
+
 class BaseFetchRequest(TimelineRequest) :
 	sort: PostSort
 
 
 class FetchPostsRequest(BaseFetchRequest) :
+	sort: SearchSort
 	tags: Optional[List[str]]
+	# only used by the rising sort, see SearchResults.cursor
+	cursor: Optional[str] = None
 
 
 class FetchCommentsRequest(BaseFetchRequest) :
@@ -42,11 +87,103 @@ class GetUserPostsRequest(BaseModel) :
 	page: Optional[int] = 1
 
 
+class ScoresRequest(BaseModel) :
+	_post_ids_validator = PostIdsValidator
+
+	post_ids: List[PostId]
+
+
+class VotesRequest(ScoresRequest) :
+	user_id: int
+
+
+class PostScore(BaseModel) :
+	post_id: PostId
+	score: Optional[InternalScore]
+
+
+class PostVote(BaseModel) :
+	post_id: PostId
+	vote: int
+
+
 class SearchResults(BaseModel) :
 	posts: List[Post]
 	count: int
 	page: int
 	total: int
+	# set by the rising sort, whose ranking changes from one request to the next. passing it back with the next page
+	# pages through the same ranking, regardless of which worker serves it
+	cursor: Optional[str] = None
+
+
+class TrendingTag(BaseModel) :
+	tag: str
+	count: int
+
+
+class TrendingTags(BaseModel) :
+	# tags in searches, and tags on newly published posts, over the last hour.
+	# searched tags are counted by each worker from the searches it serves, so they differ depending on the worker that
+	# responds. posted tags are counted from the database, and are the same from every worker
+	searched: List[TrendingTag]
+	posted: List[TrendingTag]
+
+
+class PostExport(BaseModel) :
+	post: InternalPost
+	score: Optional[InternalScore]
+
+
+@unique
+class InvalidationEventType(Enum) :
+	post: str = 'post'
+	tag: str = 'tag'
+	privacy: str = 'privacy'
+	vote: str = 'vote'
+	handle: str = 'handle'
+	set: str = 'set'
+
+
+# the field each type of invalidation event can't be handled without
+InvalidationEventFields: Dict[InvalidationEventType, str] = {
+	InvalidationEventType.post: 'post_id',
+	InvalidationEventType.tag: 'post_id',
+	InvalidationEventType.privacy: 'post_id',
+	InvalidationEventType.vote: 'post_id',
+	InvalidationEventType.handle: 'handles',
+	InvalidationEventType.set: 'set_id',
+}
+
+
+class InvalidationEvent(BaseModel) :
+	_post_id_validator = OptionalPostIdValidator
+	_set_id_validator = OptionalSetIdValidator
+
+	event: InvalidationEventType
+	# every event is about a post, except handle and set events
+	post_id: Optional[PostId]
+	user_id: Optional[int]
+	tags: Optional[List[str]]
+	rating: Optional[Rating]
+	privacy: Optional[Privacy]
+	# for handle events, the user's previous and new handles
+	handles: Optional[List[str]]
+	# for set events, the set whose posts were added, removed, or reordered
+	set_id: Optional[SetId]
+
+	@root_validator(skip_on_failure=True)
+	def _required_field(cls, values: Dict[str, Any]) -> Dict[str, Any] :
+		field: str = InvalidationEventFields[values['event']]
+
+		if values.get(field) is None :
+			raise ValueError(f'{values["event"].value} events require {field}.')
+
+		return values
+
+
+class InvalidationRequest(BaseModel) :
+	events: List[InvalidationEvent]
 
 
 RssFeed = f"""<rss version="2.0">
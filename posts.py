@@ -1,35 +1,151 @@
-from asyncio import Task, ensure_future
+from asyncio import AbstractEventLoop, CancelledError, Task, ensure_future, gather, get_event_loop, sleep
 from collections import defaultdict
-from datetime import timedelta
+from datetime import timedelta, timezone
+from fcntl import LOCK_EX, flock
+from functools import partial
+from gzip import compress
 from math import ceil
-from typing import Any, Callable, Dict, List, Optional, Tuple, Union
-
+from os import O_CREAT, O_RDWR, close, stat
+from os import open as os_open
+from random import random
+from secrets import token_urlsafe
+from time import time
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Hashable, Iterable, List, Optional, Set, Tuple, Union
+
+from aerospike.exception import RecordNotFound
+from bloom import BloomFilter, KnownPosts
+from handles import HandleResolver
+from invalidation import IndexedCache
 from kh_common.auth import KhUser
 from kh_common.caching import AerospikeCache, ArgsCache, SimpleCache
-from kh_common.config.credentials import fuzzly_client_token
+from kh_common.caching.key_value_store import KeyValueStore
+from kh_common.config.credentials import db, fuzzly_client_token
 from kh_common.datetime import datetime
 from kh_common.exceptions.http_error import BadRequest, HttpErrorHandler, NotFound
 from kh_common.sql.query import Field, Join, JoinType, Operator, Order, Query, Table, Value, Where
-from models import SearchResults
-from scoring import Scoring
+from models import InvalidationEvent, InvalidationEventType, PostExport, PostScore, PostVote, SearchResults, TimelineCount, TrendingTag, TrendingTags
+from precompute import Precompute
+from psycopg2 import connect as dbConnect
+from psycopg2.extensions import connection as Connection
+from psycopg2.extensions import cursor as Cursor
+from related import RelatedIndex
+from replica import primary, reads_as_user, replica_fill
+from scoring import Scoring, rising
+from search import SearchQuery, SearchSort, VelocitySort, normalize_tag
+from search_sql import search_filter, search_order
+from serialization import CompressionLevel, RenderedPage, serialize
+from shared_cache import SharedCache
+from trending import Trending
 
 from fuzzly.internal import InternalClient
-from fuzzly.models.internal import InternalPost, InternalPosts, InternalSet, PostKVS
+from fuzzly.models._database import InternalScore, InternalUser, ScoreCache, VoteCache
+from fuzzly.models.config import UserConfig
+from fuzzly.models.internal import BlockTree, InternalPost, InternalPosts, InternalSet, PostKVS, TagKVS, fetch_block_tree
 from fuzzly.models.post import MediaType, Post, PostId, PostSize, PostSort, Privacy, Rating, Score
 from fuzzly.models.set import SetId
+from fuzzly.models.user import UserPortable
 
 
 client: InternalClient = InternalClient(fuzzly_client_token)
 
+# the front page, for every sort and rating, and the total post count are always kept warm, other queries are refreshed once they're hot
+hot_queries: Precompute = Precompute(pinned=[('count', '_')] + [
+	('search', SearchQuery(sort=sort, include_rating=rating), 64, 1)
+	for sort in PostSort
+	for rating in [()] + [(r,) for r in Rating.__members__]
+])
 
-class Posts(Scoring) :
+# the tags people are searching for, per process
+searched_tags: Trending = Trending()
+
+# the tags on newly published posts, with their counts, shared by every worker through trending_tags, see trackPostedTags
+posted_tags: List[Tuple[str, int]] = []
+
+# the latest count of posted tags, made by whichever worker first found the previous count expired
+trending_tags: KeyValueStore = KeyValueStore('kheina', 'trending_tags')
+
+# the tag sets of every public post, for related post lookups
+related_posts: RelatedIndex = RelatedIndex()
+
+# lets requests for post ids that don't exist be rejected without touching the database
+known_posts: KnownPosts = KnownPosts()
+
+# post counts, by tag, read through post_count. kept here so that precompute can replace a count with its recount
+CountCache: KeyValueStore = KeyValueStore('kheina', 'tag_count', local_TTL=600)
+
+# resolves the handles in user filters, for both searches and their totals
+user_ids: HandleResolver = HandleResolver(KeyValueStore('kheina', 'user_handles'))
+
+# rising rankings, stored under the cursor returned with their first page so that every worker pages through the same one
+rising_rankings: KeyValueStore = KeyValueStore('kheina', 'rising_rankings')
+
+
+def _query_dependencies(search: SearchQuery, post_ids: Iterable[PostId]) -> Iterable[Hashable] :
+	# a post can only enter a search's results if it matches every positive filter, so index by those.
+	# searches without positive filters (front page, exclusion only) can be entered by any post.
+	for tag in search.filters() or [None] :
+		yield ('search', tag)
+
+	# posts that are already in the results can leave them, or change, for any reason
+	for post_id in post_ids :
+		yield ('post', PostId(post_id))
+
+
+def _search_dependencies(self: 'Posts', search: SearchQuery, count: int, page: int, iposts: InternalPosts) -> Iterable[Hashable] :
+	return _query_dependencies(search, map(lambda x : x.post_id, iposts.post_list))
 
-	def _normalize_tag(tag: str) :
-		if tag.startswith('set:') :
-			return tag
 
-		return tag.lower()
+def _rendered_dependencies(self: 'Posts', search: SearchQuery, count: int, page: int, rendered: RenderedPage) -> Iterable[Hashable] :
+	return _query_dependencies(search, rendered.post_ids)
+
+
+def _comment_dependencies(self: 'Posts', post_id: PostId, sort: PostSort, count: int, page: int, iposts: InternalPosts) -> Iterable[Hashable] :
+	yield ('parent', PostId(post_id))
+
+	for post in iposts.post_list :
+		yield ('post', PostId(post.post_id))
+
+
+def _set_dependencies(self: 'Posts', set_id: SetId, post_ids: Tuple[int, ...]) -> Iterable[Hashable] :
+	yield ('set', set_id)
+
+
+def _set_page_dependencies(self: 'Posts', set_id: SetId, sort: PostSort, count: int, page: int, iposts: InternalPosts) -> Iterable[Hashable] :
+	yield ('set', set_id)
+
+	for post in iposts.post_list :
+		yield ('post', PostId(post.post_id))
+
+
+def _user_dependencies(self: 'Posts', user: KhUser, *args: Tuple[Any]) -> Iterable[Hashable] :
+	yield ('user', user.user_id)
+
+
+class Posts(Scoring) :
 
+	ExportBatchSize: int = 1000
+	# listings select only post ids, and read the posts themselves from PostKVS, see listing_select
+	IdFirstListings: bool = True
+	RelatedBatchSize: int = 10000
+	# the related posts index is built once per host, and loaded by the other workers from here, see buildRelatedIndex
+	RelatedSnapshot: str = '/dev/shm/fuzzly-posts-related'
+	RelatedSnapshotTTL: float = 600
+	KnownPostsBatchSize: int = 10000
+	# the known posts filter is built once per host, and loaded by the other workers from here, see trackKnownPosts
+	KnownPostsSnapshot: str = '/dev/shm/fuzzly-posts-known'
+	# loaded snapshots are caught up by polling from the time they were saved, so they can be much older than the interval
+	KnownPostsSnapshotTTL: float = 3600
+	# posts created without an invalidation event being sent are picked up within this many seconds
+	KnownPostsInterval: float = 10
+	# seconds between recounts of the tags on newly published posts, see trackPostedTags
+	PostedTagsInterval: float = 60
+	# new timeline posts are counted up to this many, see timelineNewCount
+	NewPostsLimit: int = 100
+	# seconds a rising ranking can be paged through after its first page was served, see _rising_ranking
+	RisingCursorTTL: int = 600
+
+	# the cursor and ranking of the last rising page served by this worker
+	_rising_cursor: Optional[Tuple[str, List[int]]] = None
 
 	def _validatePageNumber(self, page_number: int) :
 		if page_number < 1 :
@@ -41,18 +157,37 @@ class Posts(Scoring) :
 			raise BadRequest(f'the given count is invalid: {count}. count must be between 1 and 1000.', count=count)
 
 
+	def _validateBatch(self, post_ids: List[PostId]) :
+		if not 1 <= len(post_ids) <= 1000 :
+			raise BadRequest(f'the given number of post ids is invalid: {len(post_ids)}. must provide between 1 and 1000 post ids.', count=len(post_ids))
+
+
 	@HttpErrorHandler('processing vote')
 	async def vote(self, user: KhUser, post_id: str, upvote: Optional[bool]) -> Score :
+		post_id = PostId(post_id)
+
+		if known_posts.missing(post_id.int()) :
+			raise NotFound(f'no data was found for the provided post id: {post_id}.')
+
+		if known_posts.unconfirmed(post_id.int()) :
+			# while the filter isn't synced it may not have caught up with a new post yet, only the database can say it doesn't exist
+			await self._get_post(post_id)
+
 		return await self._vote(user, post_id, upvote)
 
 
-	@AerospikeCache('kheina', 'tag_count', '{tag}', TTL_seconds=-1, local_TTL=600)
+	@SharedCache('post_count', '{tag}', TTL_seconds=600, slots=4096, slot_size=64)
+	@AerospikeCache('kheina', 'tag_count', '{tag}', TTL_seconds=-1, _kvs=CountCache)
 	async def post_count(self, tag: str) -> int :
 		"""
 		use '_' to indicate total public posts.
 		use the format '@{user_id}' to get the count of posts uploaded by a user
 		"""
+		return await self._count_posts(tag)
+
 
+	@replica_fill
+	async def _count_posts(self, tag: str) -> int :
 		count: float = 0
 
 		if tag == '_' :
@@ -125,6 +260,7 @@ class Posts(Scoring) :
 		factor: float = 1.1
 
 		counts: List[Dict[str, Union[bool, int]]] = []
+		uploaders: Dict[str, int] = await self._user_ids([tag.lstrip('-')[1:] for tag in tags if tag.lstrip('-').startswith('@')])
 
 		for tag in tags :
 			invert: bool = False
@@ -141,8 +277,15 @@ class Posts(Scoring) :
 
 			if tag.startswith('@') :
 				handle: str = tag[1:]
-				user_id: int = await client.user_handle_to_id(handle)
-				tag = f'@{user_id}'
+
+				if handle not in uploaders :
+					if invert :
+						# excluding a user that doesn't exist doesn't remove anything
+						continue
+
+					return 0
+
+				tag = f'@{uploaders[handle]}'
 
 			counts.append((await self.post_count(tag), invert))
 
@@ -162,27 +305,32 @@ class Posts(Scoring) :
 		return ceil(count)
 
 
+	def _parse_row(self, row: List[Any]) -> InternalPost :
+		return InternalPost(
+			post_id=row[0],
+			title=row[1],
+			description=row[2],
+			rating=self._get_rating_map()[row[3]],
+			parent=row[4],
+			created=row[5],
+			updated=row[6],
+			filename=row[7],
+			media_type=self._get_media_type_map()[row[8]],
+			size=PostSize(width=row[9], height=row[10]) if row[9] and row[10] else None,
+			user_id=row[11],
+			privacy=self._get_privacy_map()[row[12]],
+			thumbhash=row[13],
+		)
+
+
 	def parse_response(self, data: List[List[Any]]) -> List[InternalPost] :
 			posts: List[InternalPost] = []
 
 			for row in data :
-				post = InternalPost(
-					post_id=row[0],
-					title=row[1],
-					description=row[2],
-					rating=self._get_rating_map()[row[3]],
-					parent=row[4],
-					created=row[5],
-					updated=row[6],
-					filename=row[7],
-					media_type=self._get_media_type_map()[row[8]],
-					size=PostSize(width=row[9], height=row[10]) if row[9] and row[10] else None,
-					user_id=row[11],
-					privacy=self._get_privacy_map()[row[12]],
-					thumbhash=row[13],
-				)
+				post = self._parse_row(row)
 				posts.append(post)
-				ensure_future(PostKVS.put_async(post.post_id, post))
+				# keyed the same way as _get_post, so that either can read what the other cached
+				ensure_future(PostKVS.put_async(PostId(post.post_id), post))
 
 			return posts
 
@@ -208,345 +356,207 @@ class Posts(Scoring) :
 		return self.parse_response
 
 
-	@ArgsCache(60)
-	async def _fetch_posts(self, sort: PostSort, tags: Tuple[str], count: int, page: int) -> InternalPosts :
-		idk = { }
-
-		if tags :
-			include_tags = []
-			exclude_tags = []
-
-			include_users = []
-			exclude_users = []
-
-			include_rating = []
-			exclude_rating = []
-
-			include_sets = []
-			exclude_sets = []
-
-			for tag in tags :
-				exclude = tag.startswith('-')
-
-				if exclude :
-					tag = tag[1:]
-
-				if tag.startswith('@') :
-					tag = tag[1:]
-					(exclude_users if exclude else include_users).append(tag)
-					continue
-
-				if tag in { 'general', 'mature', 'explicit' } :
-					(exclude_rating if exclude else include_rating).append(tag)
-					continue
-
-				if tag.startswith('set:') :
-					(exclude_sets if exclude else include_sets).append(SetId(tag[4:]))
-					continue
-
-				if tag.startswith('sort:') :
-					try :
-						sort = PostSort[tag[5:]]
-
-					except KeyError :
-						raise BadRequest(f'{tag[5:]} is not a valid sort method. valid methods: {list(PostSort.__members__.keys())}')
-
-					continue
-
-				(exclude_tags if exclude else include_tags).append(tag)
-
-			if len(include_users) > 1 :
-				raise BadRequest('can only search for posts from, at most, one user at a time.')
-
-			if len(include_rating) > 1 :
-				raise BadRequest('can only search for posts from, at most, one rating at a time.')
-
-			query: Query
-
-			if include_tags or exclude_tags :
-				query = Query(
-					Table('kheina.public.tags')
-				).join(
-					Join(
-						JoinType.inner,
-						Table('kheina.public.tag_post'),
-					).where(
-						Where(
-							Field('tag_post', 'tag_id'),
-							Operator.equal,
-							Field('tags', 'tag_id'),
-						),
-					),
-					Join(
-						JoinType.inner,
-						Table('kheina.public.posts'),
-					).where(
-						Where(
-							Field('posts', 'post_id'),
-							Operator.equal,
-							Field('tag_post', 'post_id'),
-						),
-						Where(
-							Field('posts', 'privacy_id'),
-							Operator.equal,
-							"privacy_to_id('public')",
-						),
-					),
-					Join(
-						JoinType.inner,
-						Table('kheina.public.users'),
-					).where(
-						Where(
-							Field('users', 'user_id'),
-							Operator.equal,
-							Field('posts', 'uploader'),
-						),
-					),
-				).having(
-					Where(
-						Value(1, 'count'),
-						Operator.equal,
-						Value(len(include_tags)),
-					),
-				)
-
-			elif include_users :
-				query = Query(
-					Table('kheina.public.users')
-				).join(
-					Join(
-						JoinType.inner,
-						Table('kheina.public.posts'),
-					).where(
-						Where(
-							Field('posts', 'uploader'),
-							Operator.equal,
-							Field('users', 'user_id'),
-						),
-						Where(
-							Field('posts', 'privacy_id'),
-							Operator.equal,
-							"privacy_to_id('public')",
-						),
-					),
-				)
-
-			else :
-				query = Query(
-					Table('kheina.public.posts')
-				).join(
-					Join(
-						JoinType.inner,
-						Table('kheina.public.users'),
-					).where(
-						Where(
-							Field('users', 'user_id'),
-							Operator.equal,
-							Field('posts', 'uploader'),
-						),
-					),
-				).where(
-					Where(
-						Field('posts', 'privacy_id'),
-						Operator.equal,
-						"privacy_to_id('public')",
-					),
-				)
-
-			if include_tags :
-				query.where(
-					Where(
-						Field('tags', 'deprecated'),
-						Operator.equal,
-						False,
-					),
-					Where(
-						Field('tags', 'tag'),
-						Operator.equal,
-						Value(include_tags, 'any'),
-					),
-				)
-
-			if exclude_tags :
-				query.where(
-					Where(
-						Field('posts', 'post_id'),
-						Operator.not_in,
-						Query(
-							Table('kheina.public.tags')
-						).select(
-							Field('tag_post', 'post_id'),
-						).join(
-							Join(
-								JoinType.inner,
-								Table('kheina.public.tag_post'),
-							).where(
-								Where(
-									Field('tag_post', 'tag_id'),
-									Operator.equal,
-									Field('tags', 'tag_id'),
-								),
-							),
-						).where(
-							Where(
-								Field('tags', 'tag'),
-								Operator.equal,
-								Value(exclude_tags, 'any'),
-							),
-						),
-					),
-				)
+	def listing_select(self, query: Query) -> Callable[[List[List[Any]]], Awaitable[List[InternalPost]]] :
+		"""
+		used in place of internal_select for listings. when IdFirstListings is set, only ordered post ids are selected,
+		and the posts themselves are read through posts_many.
+		"""
+		if not Posts.IdFirstListings :
+			parser: Callable[[List[List[Any]]], List[InternalPost]] = self.internal_select(query)
 
-			if include_users :
-				query.where(
-					Where(
-						Field('lower(users', 'handle)'),
-						Operator.equal,
-						Value(include_users[0], 'lower'),
-					),
-				)
+			async def parse(data: List[List[Any]]) -> List[InternalPost] :
+				return parser(data)
 
-			if exclude_users :
-				query.where(
-					Where(
-						Field('lower(users', 'handle)'),
-						Operator.not_equal,
-						Value(exclude_users, 'any'),  # TODO: add lower + any
-					),
-				)
+			return parse
 
-			if include_rating :
-				query.where(
-					Where(
-						Field('posts', 'rating'),
-						Operator.equal,
-						Value(self._rating_to_id()[include_rating[0]]),
-					),
-				)
+		query.select(
+			Field('posts', 'post_id'),
+		)
 
-			if exclude_rating :
-				query.where(
-					Where(
-						Field('posts', 'rating'),
-						Operator.not_equal,
-						Value(list(map(lambda x : self._rating_to_id()[x], exclude_rating)), 'all'),
-					),
-				)
+		return lambda data : self.posts_many([row[0] for row in data])
 
-			if include_sets or exclude_sets :
-				join_sets: Join = Join(
-					JoinType.inner,
-					Table('kheina.public.set_post'),
-				).where(
-					Where(
-						Field('set_post', 'post_id'),
-						Operator.equal,
-						Field('posts', 'post_id'),
-					),
-				)
 
-				if include_sets :
-					join_sets.where(
-						Where(
-							Field('set_post', 'set_id'),
-							Operator.equal,
-							Value(list(map(int, include_sets)), 'all'),
-						),
-					)
-
-				if exclude_sets :
-					join_sets.where(
-						Where(
-							Field('set_post', 'set_id'),
-							Operator.not_equal,
-							Value(list(map(int, exclude_sets)), 'any'),
-						),
-					)
-
-				query.join(join_sets)
+	async def posts_many(self, post_ids: List[int]) -> List[InternalPost] :
+		"""
+		returns the posts for the given ids, in the order given. posts are read from PostKVS in a single batch,
+		and only those missing from it are selected from the database. ids that no longer exist are omitted.
+		"""
+		if not post_ids :
+			return []
 
-			idk = {
-				'tags': tags,
-				'include_tags': include_tags,
-				'exclude_tags': exclude_tags,
-				'include_users': include_users,
-				'exclude_users': exclude_users,
-				'include_rating': include_rating,
-				'exclude_rating': exclude_rating,
-				'include_sets': include_sets,
-				'exclude_sets': exclude_sets,
-			}
+		keys: List[PostId] = list(map(PostId, post_ids))
+		posts: Dict[str, Optional[InternalPost]] = await PostKVS.get_many_async(keys)
+		misses: List[int] = [post_id for post_id, key in zip(post_ids, keys) if posts.get(key) is None]
 
-		else :
-			query = Query(
+		if misses :
+			query: Query = Query(
 				Table('kheina.public.posts')
-			).join(
-				Join(
-					JoinType.inner,
-					Table('kheina.public.users'),
-				).where(
-					Where(
-						Field('users', 'user_id'),
-						Operator.equal,
-						Field('posts', 'uploader'),
-					),
-				),
 			).where(
 				Where(
-					Field('posts', 'privacy_id'),
+					Field('posts', 'post_id'),
 					Operator.equal,
-					"privacy_to_id('public')",
+					Value(misses, 'any'),
 				),
 			)
 
-		if sort in { PostSort.new, PostSort.old } :
+			parser = self.internal_select(query)
 
-			if len(tags) == 1 and len(include_sets) == 1 :
-				# this is a very special case, we want to hijack the new/old sorts to instead sort by set index.
-				# there's really no reason anyone would want to sort by post age for a single set
-				query.order(
-					Field('set_post', 'index'),
-					Order.descending_nulls_first if sort == PostSort.new else Order.ascending_nulls_last,
-				).group(
-					Field('posts', 'post_id'),
-					Field('set_post', 'set_id'),
-					Field('set_post', 'index'),
-				)
+			for post in parser(await self.query_async(query, fetch_all=True)) :
+				posts[PostId(post.post_id)] = post
 
-			else :
-				query.order(
-					Field('posts', 'created_on'),
-					Order.descending_nulls_first if sort == PostSort.new else Order.ascending_nulls_last,
-				).group(
-					Field('posts', 'post_id'),
-					Field('users', 'user_id'),
-				)
+		return [posts[key] for key in keys if posts.get(key) is not None]
 
-		else :
-			query.order(
-				Field('post_scores', sort.name),
-				Order.descending_nulls_first,
-			).order(
-				Field('posts', 'created_on'),
-				Order.descending_nulls_first,
-			).join(
-				Join(
-					JoinType.inner,
-					Table('kheina.public.post_scores'),
-				).where(
-					Where(
-						Field('post_scores', 'post_id'),
-						Operator.equal,
-						Field('posts', 'post_id'),
-					),
-				),
-			).group(
-				Field('posts', 'post_id'),
-				Field('post_scores', 'post_id'),
-				Field('users', 'user_id'),
+
+	def _authorized(self, user: KhUser, post: InternalPost) -> bool :
+		# same rules as InternalPost.authorized, without the await per post
+		return post.privacy in { Privacy.public, Privacy.unlisted } or post.user_id == user.user_id
+
+
+	async def hydrate(self, user: KhUser, iposts: InternalPosts) -> List[Post] :
+		"""
+		converts a page of internal posts into public posts. rather than hydrating every post individually,
+		the uploaders, scores, votes, and tags for the entire page are each resolved with a single batch call.
+		"""
+		post_list: List[InternalPost] = list(filter(lambda x : self._authorized(user, x), iposts.post_list))
+
+		if not post_list :
+			return []
+
+		post_ids: List[PostId] = list(map(lambda x : PostId(x.post_id), post_list))
+		uploader_ids: List[int] = list(set(map(lambda x : x.user_id, post_list)))
+
+		# only posts that can actually have scores
+		scored_ids: List[PostId] = [
+			post_id
+			for post_id, post in zip(post_ids, post_list)
+			if post.privacy not in { Privacy.draft, Privacy.unpublished }
+		]
+
+		users_task: Task[Dict[int, InternalUser]] = ensure_future(client.users_many(uploader_ids))
+		scores_task: Task[Dict[PostId, Optional[InternalScore]]] = ensure_future(client.scores_many(scored_ids))
+		tags_task: Task[Dict[PostId, List[str]]] = ensure_future(client.tags_many(post_ids))
+		block_task: Task[Tuple[BlockTree, UserConfig]] = ensure_future(fetch_block_tree(client, user))
+
+		following: Dict[int, Optional[bool]] = defaultdict(lambda : None)
+		votes: Dict[PostId, int] = defaultdict(lambda : 0)
+
+		if await user.authenticated(False) :
+			following_task: Task[Dict[int, bool]] = ensure_future(client.following_many(user, uploader_ids))
+			votes = await client.votes_many(user, scored_ids)
+			following = await following_task
+
+		iusers: Dict[int, InternalUser] = await users_task
+		iscores: Dict[PostId, Optional[InternalScore]] = await scores_task
+		tags: Dict[PostId, List[str]] = await tags_task
+		block_tree, user_config = await block_task
+
+		uploaders: Dict[int, UserPortable] = {
+			user_id: UserPortable(
+				name=iuser.name,
+				handle=iuser.handle,
+				privacy=iuser.privacy,
+				icon=iuser.icon,
+				verified=iuser.verified,
+				following=following[user_id],
 			)
+			for user_id, iuser in iusers.items()
+		}
+
+		posts: List[Post] = []
+
+		for post_id, post in zip(post_ids, post_list) :
+			uploader: UserPortable = uploaders[post.user_id]
+			iscore: Optional[InternalScore] = iscores.get(post_id)
+			blocked: bool = bool(user_config.blocked_users and post.user_id in user_config.blocked_users)
+
+			if not blocked :
+				blocked = block_tree.blocked({ *tags[post_id], '@' + uploader.handle })
+
+			posts.append(Post(
+				post_id=post_id,
+				title=post.title,
+				description=post.description,
+				user=uploader,
+				score=Score(
+					up=iscore.up,
+					down=iscore.down,
+					total=iscore.total,
+					user_vote=votes[post_id],
+				) if iscore else None,
+				rating=post.rating,
+				parent=post.parent,
+				privacy=post.privacy,
+				created=post.created,
+				updated=post.updated,
+				filename=post.filename,
+				media_type=post.media_type,
+				size=post.size,
+				thumbhash=post.thumbhash,
+				blocked=blocked,
+			))
+
+		return posts
+
+
+	async def _load_user_ids(self, handles: List[str]) -> Dict[str, int] :
+		data: List[Tuple[str, int]] = await self.query_async("""
+			SELECT lower(users.handle), users.user_id
+			FROM kheina.public.users
+			WHERE lower(users.handle) = any(%s);
+			""",
+			(handles,),
+			fetch_all=True,
+		)
+
+		return dict(data)
+
+
+	async def _user_ids(self, handles: Iterable[str]) -> Dict[str, int] :
+		"""
+		maps lowercase handles to user ids, see HandleResolver. handles that don't exist are omitted.
+		"""
+		return await user_ids.resolve(handles, self._load_user_ids)
+
+
+	async def _search_query(self, search: SearchQuery) -> Tuple[Optional[Query], Dict[str, Any]] :
+		"""
+		builds the query for every public post matching the search's filters, without any sorting or paging, see search_filter.
+		returns the query along with the filters to be logged.
+		"""
+		uploaders: Dict[str, int] = await self._user_ids(search.include_users + search.exclude_users)
+		query: Optional[Query] = search_filter(search, self._rating_to_id(), uploaders)
+		idk: Dict[str, Any] = { }
+
+		if search.tags() :
+			idk = {
+				'tags': search.tags(),
+				'include_tags': search.include_tags,
+				'exclude_tags': search.exclude_tags,
+				'include_users': search.include_users,
+				'exclude_users': search.exclude_users,
+				'include_rating': search.include_rating,
+				'exclude_rating': search.exclude_rating,
+				'include_sets': search.include_sets,
+				'exclude_sets': search.exclude_sets,
+				'uploaders': uploaders,
+			}
+
+		return query, idk
+
 
-		parser = self.internal_select(query.limit(
+	@IndexedCache(600, index=_search_dependencies)
+	@SharedCache('fetch_posts', '{search}.{count}.{page}', TTL_seconds=600, index=_search_dependencies)
+	@replica_fill
+	async def _fetch_posts(self, search: SearchQuery, count: int, page: int) -> InternalPosts :
+		sort: PostSort = search.sort
+		query, idk = await self._search_query(search)
+
+		if query is None :
+			return InternalPosts(post_list=[])
+
+		search_order(query, search)
+
+		parser = self.listing_select(query.limit(
 				count,
 			).page(
 				page,
@@ -557,38 +567,243 @@ class Posts(Scoring) :
 		self.logger.info({
 			'query': sql,
 			'params': params,
+			'sort': sort.name,
+			'count': count,
+			'page': page,
 			**idk,
 		})
 
-		return InternalPosts(post_list=parser(await self.query_async(query, fetch_all=True)))
+		return InternalPosts(post_list=await parser(await self.query_async(query, fetch_all=True)))
 
 
-	@HttpErrorHandler('fetching posts')
-	async def fetchPosts(self, user: KhUser, sort: PostSort, tags: Optional[List[str]], count:int=64, page:int=1) -> SearchResults :
-		self._validatePageNumber(page)
-		self._validateCount(count)
+	async def _rising_ranking(self, cursor: Optional[str]) -> Tuple[str, List[int]] :
+		"""
+		returns the ranking stored under the given cursor, or the current ranking and a new cursor for it.
+		rankings are rebuilt every few seconds, and differ between workers, so later pages are read from the first page's ranking.
+		"""
+		if cursor :
+			ranking: Optional[List[int]] = (await rising_rankings.get_many_async([cursor])).get(cursor)
+
+			if ranking is not None :
+				return cursor, ranking
+
+		ranking: List[int] = rising.top()
+
+		# top returns the same list until it re-ranks, so each ranking is only stored once
+		if self._rising_cursor is None or self._rising_cursor[1] is not ranking :
+			self._rising_cursor = (token_urlsafe(12), ranking)
+			await rising_rankings.put_async(self._rising_cursor[0], ranking, Posts.RisingCursorTTL)
+
+		return self._rising_cursor
+
+
+	async def _fetch_rising(self, search: SearchQuery, count: int, page: int, cursor: Optional[str]) -> Tuple[InternalPosts, str] :
+		# the order comes from the vote counters, the database only filters the ranked posts down to those matching the search
+		cursor, ranking = await self._rising_ranking(cursor)
+		start: int = count * (page - 1)
+
+		if start >= len(ranking) :
+			return InternalPosts(post_list=[]), cursor
+
+		rank: Dict[int, int] = { post_id: i for i, post_id in enumerate(ranking) }
+		query, _ = await self._search_query(search)
+
+		if query is None :
+			return InternalPosts(post_list=[]), cursor
+
+		query.where(
+			Where(
+				Field('posts', 'post_id'),
+				Operator.equal,
+				Value(ranking, 'any'),
+			),
+		)
+
+		parser = self.listing_select(query)
+		post_list: List[InternalPost] = sorted(await parser(await self.query_async(query, fetch_all=True)), key=lambda x : rank[x.post_id])
+		return InternalPosts(post_list=post_list[start:start + count]), cursor
+
+
+	@IndexedCache(600, index=_set_dependencies, maxsize=4096)
+	@replica_fill
+	async def _set_post_ids(self, set_id: SetId) -> Tuple[int, ...] :
+		"""
+		returns the ids of every public post in the set, in set order
+		"""
+		data: List[Tuple[int]] = await self.query_async("""
+			SELECT set_post.post_id
+			FROM kheina.public.set_post
+				INNER JOIN kheina.public.posts
+					ON posts.post_id = set_post.post_id
+						AND posts.privacy_id = privacy_to_id('public')
+			WHERE set_post.set_id = %s
+			ORDER BY set_post.index ASC;
+			""",
+			(int(set_id),),
+			fetch_all=True,
+		)
+
+		return tuple([row[0] for row in data])
+
+
+	@IndexedCache(600, index=_set_page_dependencies, maxsize=4096)
+	@replica_fill
+	async def _fetch_set_page(self, set_id: SetId, sort: PostSort, count: int, page: int) -> InternalPosts :
+		# new lists the end of the set first, old the beginning
+		post_ids: Tuple[int, ...] = await self._set_post_ids(set_id)
 
+		if sort == PostSort.new :
+			post_ids = post_ids[::-1]
+
+		start: int = count * (page - 1)
+		return InternalPosts(post_list=await self.posts_many(list(post_ids[start:start + count])))
+
+
+	async def _prefetch_set_page(self, set_id: SetId, sort: PostSort, count: int, page: int) -> None :
+		try :
+			await self._fetch_set_page(set_id, sort, count, page)
+
+		except Exception as e :
+			self.logger.warning('failed to prefetch set page.', exc_info=e)
+
+
+	async def _browse_set(self, set_id: SetId, sort: PostSort, count: int, page: int) -> Tuple[InternalPosts, int] :
+		"""
+		returns a page of a single set, along with the number of public posts in it. pages are sliced from the set's
+		cached post list, rather than each being queried separately.
+		"""
+		post_ids: Tuple[int, ...] = await self._set_post_ids(set_id)
+		iposts: InternalPosts = await self._fetch_set_page(set_id, sort, count, page)
+
+		if count * page < len(post_ids) :
+			# sets are read in order, so the next page is loaded while this one is being read
+			ensure_future(self._prefetch_set_page(set_id, sort, count, page + 1))
+
+		return iposts, len(post_ids)
+
+
+	async def _search(self, user: KhUser, search: SearchQuery, count: int, page: int, cursor: Optional[str] = None) -> SearchResults :
+		if search.single_set() and search.sort in { PostSort.new, PostSort.old } :
+			# browsing a single set is ordered by set index, see _browse_set
+			iposts, set_total = await self._browse_set(search.include_sets[0], search.sort, count, page)
+			posts: List[Post] = await self.hydrate(user, iposts)
+
+			return SearchResults(
+				posts = posts,
+				count = len(posts),
+				page = page,
+				total = set_total,
+			)
+
+		tags: Tuple[str] = search.tags()
 		total: Task[int]
 
 		if tags :
-			tags: Tuple[str] = tuple(sorted(map(Posts._normalize_tag, filter(None, map(str.strip, filter(None, tags))))))
 			total = ensure_future(self.total_results(tags))
 
 		else :
-			tags = None
 			total = ensure_future(self.post_count('_'))
 
-		iposts: InternalPosts = await self._fetch_posts(sort, tags, count, page)
-		posts: List[Post] = await iposts.posts(client, user)
+		iposts: InternalPosts
+
+		if search.sort == VelocitySort.rising :
+			# rising changes minute to minute, so it's read straight from the vote counters rather than cached or precomputed
+			iposts, cursor = await self._fetch_rising(search, count, page, cursor)
+
+		else :
+			hot_queries.track(('search', search, count, page))
+			iposts = await self._fetch_posts(search, count, page)
+
+		posts: List[Post] = await self.hydrate(user, iposts)
 
 		return SearchResults(
 			posts = posts,
 			count = len(posts),
 			page = page,
 			total = await total,
+			cursor = cursor,
 		)
 
 
+	async def precompute(self, key: Tuple[Hashable, ...]) -> None :
+		"""
+		refreshes the cached result for a key tracked by hot_queries
+		"""
+		kind, *args = key
+
+		if kind == 'search' :
+			await self._fetch_posts.refresh(self, *args)
+
+		elif kind == 'count' :
+			# the aerospike tier never expires, so refreshing through it would only return the stored count. the count is
+			# recounted instead and written to aerospike, which replaces this worker's local copy as well
+			count: int = await self._count_posts(*args)
+			await CountCache.put_async(args[0], count, -1)
+			self.post_count.store(count, self, *args)
+
+
+	@HttpErrorHandler('fetching posts')
+	async def fetchPosts(self, user: KhUser, sort: SearchSort, tags: Optional[List[str]], count:int=64, page:int=1, cursor:Optional[str]=None) -> SearchResults :
+		self._validatePageNumber(page)
+		self._validateCount(count)
+
+		search: SearchQuery = SearchQuery.parse(sort, tags)
+		searched_tags.add(search.include_tags)
+
+		return await self._search(user, search, count, page, cursor)
+
+
+	# pages include each post's score, so vote events evict every page containing the voted post, see _invalidate_vote.
+	# post changes evict pages through the same index
+	@IndexedCache(600, index=_rendered_dependencies, maxsize=4096)
+	async def _rendered_search(self, search: SearchQuery, count: int, page: int, user: KhUser = None) -> RenderedPage :
+		# user is passed by keyword so that it isn't included in the cache key, all anonymous users receive identical pages
+		return self._render(await self._search(user, search, count, page))
+
+
+	def _render(self, results: SearchResults) -> RenderedPage :
+		return RenderedPage(
+			post_ids=tuple(map(lambda x : x.post_id, results.posts)),
+			body=compress(serialize(results), CompressionLevel),
+		)
+
+
+	@HttpErrorHandler('fetching posts')
+	async def fetchPostsRendered(self, user: KhUser, sort: SearchSort, tags: Optional[List[str]], count:int=64, page:int=1, cursor:Optional[str]=None) -> RenderedPage :
+		"""
+		same as fetchPosts, but returns the final gzipped response body. only to be used for anonymous users.
+		"""
+		self._validatePageNumber(page)
+		self._validateCount(count)
+
+		search: SearchQuery = SearchQuery.parse(sort, tags)
+		searched_tags.add(search.include_tags)
+
+		if search.sort == VelocitySort.rising :
+			# rising changes too quickly to be held in the page cache
+			return self._render(await self._search(user, search, count, page, cursor))
+
+		return await self._rendered_search(search, count, page, user=user)
+
+
+	def trendingTags(self) -> TrendingTags :
+		return TrendingTags(
+			searched=[TrendingTag(tag=tag, count=count) for tag, count in searched_tags.top()],
+			posted=[TrendingTag(tag=tag, count=count) for tag, count in posted_tags],
+		)
+
+
+	async def warm(self) -> None :
+		"""
+		loads reference data ahead of the first request, without blocking the event loop
+		"""
+		loop: AbstractEventLoop = get_event_loop()
+		await gather(*[
+			loop.run_in_executor(None, func)
+			for func in (self._get_rating_map, self._get_privacy_map, self._get_media_type_map)
+		])
+
+
 	@SimpleCache(float('inf'))
 	def _get_rating_map(self) :
 		data = self.query("""
@@ -639,7 +854,11 @@ class Posts(Scoring) :
 
 
 	@AerospikeCache('kheina', 'posts', '{post_id}', _kvs=PostKVS)
+	@replica_fill
 	async def _get_post(self, post_id: PostId) -> InternalPost :
+		if known_posts.missing(post_id.int()) :
+			raise NotFound(f'no data was found for the provided post id: {post_id}.')
+
 		data = await self.query_async("""
 			SELECT
 				posts.post_id,
@@ -664,8 +883,12 @@ class Posts(Scoring) :
 		)
 
 		if not data :
+			known_posts.not_found(post_id.int())
 			raise NotFound(f'no data was found for the provided post id: {post_id}.')
 
+		if known_posts.unconfirmed(post_id.int()) :
+			known_posts.add([post_id.int()])
+
 		return self.parse_response([data])[0]
 
 
@@ -679,25 +902,357 @@ class Posts(Scoring) :
 		raise NotFound(f'no data was found for the provided post id: {post_id}.')
 
 
-	@ArgsCache(5)
+	@HttpErrorHandler('retrieving related posts')
+	async def relatedPosts(self, user: KhUser, post_id: PostId, count: int) -> List[Post] :
+		self._validateCount(count)
+		post: InternalPost = await self._get_post(post_id)
+
+		if not await post.authorized(client, user) :
+			raise NotFound(f'no data was found for the provided post id: {post_id}.')
+
+		tags: Optional[List[str]] = None
+
+		if post_id.int() not in related_posts :
+			# unlisted posts, and posts published since the index was built, are looked up by their tags instead
+			tags = (await self.tags_many([post_id]))[post_id]
+
+		related: List[Tuple[int, float]] = related_posts.related(post_id.int(), count, tags)
+		return await self.hydrate(user, InternalPosts(post_list=await self.posts_many([i for i, _ in related])))
+
+
+	async def _poll_known_posts(self, since: datetime) -> datetime :
+		"""
+		adds every post created since the given time to the filter, and returns the time to poll from next
+		"""
+		# overlaps the previous poll, since posts inserted by transactions that were open during it may have earlier timestamps.
+		# misses are trusted once this returns, so it can't be read from a replica that's behind
+		with primary() :
+			data: Tuple[datetime, Optional[List[int]]] = await self.query_async("""
+				SELECT NOW(), array_agg(posts.post_id)
+				FROM kheina.public.posts
+				WHERE posts.created_on >= %s;
+				""",
+				(since - timedelta(seconds=Posts.KnownPostsInterval * 6),),
+				fetch_one=True,
+			)
+
+		known_posts.add(data[1] or [])
+		known_posts.synced()
+		return data[0]
+
+
+	def eventsMissed(self) -> None :
+		"""
+		called by the invalidation listener when events may have been missed, new posts may not have reached the filter
+		"""
+		known_posts.desynced()
+
+
+	async def _known_posts_filter(self) -> datetime :
+		"""
+		starts the known posts filter, and returns the time to poll from to catch it up. the filter is built from the
+		database by one worker per host, which saves it to KnownPostsSnapshot, and every other worker loads that snapshot.
+		"""
+		loop: AbstractEventLoop = get_event_loop()
+		fd: int = os_open(Posts.KnownPostsSnapshot + '.lock', O_RDWR | O_CREAT, 0o600)
+
+		try :
+			# blocks until the worker building the snapshot, if any, has finished
+			await loop.run_in_executor(None, flock, fd, LOCK_EX)
+
+			try :
+				if time() - stat(Posts.KnownPostsSnapshot).st_mtime < Posts.KnownPostsSnapshotTTL :
+					bloom, since = await loop.run_in_executor(None, BloomFilter.load, Posts.KnownPostsSnapshot)
+					known_posts.load(bloom)
+					self.logger.info('loaded known posts filter.')
+					return datetime.fromtimestamp(since, timezone.utc)
+
+			except FileNotFoundError :
+				pass
+
+			bloom, since = await self._index_known_posts()
+			await loop.run_in_executor(None, bloom.save, Posts.KnownPostsSnapshot, since.timestamp())
+			self.logger.info('built known posts filter.')
+			return since
+
+		finally :
+			close(fd)
+
+
+	async def _index_known_posts(self) -> Tuple[BloomFilter, datetime] :
+		data: Tuple[int, datetime] = await self.query_async("""
+			SELECT COUNT(1), NOW()
+			FROM kheina.public.posts;
+			""",
+			fetch_one=True,
+		)
+
+		bloom: BloomFilter = known_posts.build(data[0])
+		last: int = 0
+
+		while True :
+			post_ids: List[Tuple[int]] = await self.query_async("""
+				SELECT posts.post_id
+				FROM kheina.public.posts
+				WHERE posts.post_id > %s
+				ORDER BY posts.post_id
+				LIMIT %s;
+				""",
+				(last, Posts.KnownPostsBatchSize),
+				fetch_all=True,
+			)
+
+			if not post_ids :
+				return bloom, data[1]
+
+			for post_id, in post_ids :
+				bloom.add(post_id)
+
+			last = post_ids[-1][0]
+			await sleep(0)
+
+
+	async def trackKnownPosts(self) -> None :
+		"""
+		starts the filter of every existing post id, then keeps adding new posts to it. posts are normally added as their
+		invalidation events arrive, polling catches any post created without one.
+		"""
+		try :
+			since: datetime = await self._known_posts_filter()
+
+			# posts created since the filter was built, or saved, are added before it's used
+			since = await self._poll_known_posts(since)
+			known_posts.finish()
+
+		except CancelledError :
+			raise
+
+		except Exception as e :
+			# without a filter, every post id is assumed to exist
+			self.logger.warning('failed to build known posts filter.', exc_info=e)
+			return
+
+		while True :
+			await sleep(Posts.KnownPostsInterval)
+
+			try :
+				since = await self._poll_known_posts(since)
+
+			except CancelledError :
+				raise
+
+			except Exception as e :
+				self.logger.warning('failed to refresh known posts filter.', exc_info=e)
+
+
+	async def _count_posted_tags(self) -> List[Tuple[str, int]] :
+		data: List[Tuple[str, int]] = await self.query_async("""
+			SELECT tags.tag, COUNT(1)
+			FROM kheina.public.posts
+				INNER JOIN kheina.public.tag_post
+					ON tag_post.post_id = posts.post_id
+				INNER JOIN kheina.public.tags
+					ON tags.tag_id = tag_post.tag_id
+						AND tags.deprecated = false
+			WHERE posts.created_on >= NOW() - %s
+				AND posts.privacy_id = privacy_to_id('public')
+			GROUP BY tags.tag
+			ORDER BY COUNT(1) DESC, tags.tag
+			LIMIT %s;
+			""",
+			(timedelta(seconds=Trending.Windows * Trending.WindowLength), Trending.TopK),
+			fetch_all=True,
+		)
+
+		return [(tag, count) for tag, count in data]
+
+
+	async def trackPostedTags(self) -> None :
+		"""
+		reads the counts of tags on public posts created within the trending window from trending_tags, so every worker
+		reports the same tags. once the stored counts expire, the first worker to notice recounts them from the database.
+		"""
+		while True :
+			try :
+				counts: Optional[List[Tuple[str, int]]] = (await trending_tags.get_many_async(['posted'])).get('posted')
+
+				if counts is None :
+					counts = await self._count_posted_tags()
+					# stored as lists, which aerospike stores natively
+					await trending_tags.put_async('posted', [[tag, count] for tag, count in counts], ceil(Posts.PostedTagsInterval))
+
+				posted_tags[:] = [(tag, count) for tag, count in counts]
+
+			except CancelledError :
+				raise
+
+			except Exception as e :
+				self.logger.warning('failed to count posted tags.', exc_info=e)
+
+			# randomized, so that workers rarely find the counts expired at the same moment and recount them together
+			await sleep(Posts.PostedTagsInterval * (0.5 + random() / 2))
+
+
+	async def buildRelatedIndex(self) -> None :
+		"""
+		indexes the tags of the most recent public posts, up to RelatedIndex.MaxPosts. the index is built from the database
+		by one worker per host, which saves it to RelatedSnapshot, and every other worker loads that snapshot instead.
+		the index is kept up to date by invalidation events, which every worker receives.
+		"""
+		loop: AbstractEventLoop = get_event_loop()
+		fd: int = os_open(Posts.RelatedSnapshot + '.lock', O_RDWR | O_CREAT, 0o600)
+		entries: Optional[List[Tuple[int, bytes]]] = None
+
+		try :
+			# blocks until the worker building the snapshot, if any, has finished
+			await loop.run_in_executor(None, flock, fd, LOCK_EX)
+
+			try :
+				saved: float = stat(Posts.RelatedSnapshot).st_mtime
+
+				if time() - saved < Posts.RelatedSnapshotTTL :
+					# the file is only parsed off of the event loop, since requests and invalidation events use the index
+					entries = await loop.run_in_executor(None, RelatedIndex.read, Posts.RelatedSnapshot)
+
+			except FileNotFoundError :
+				pass
+
+			if entries is None :
+				await self._index_related_posts()
+				# copied on the event loop, and only written off of it
+				await loop.run_in_executor(None, RelatedIndex.write, Posts.RelatedSnapshot, related_posts.entries())
+				self.logger.info(f'built related posts index of {len(related_posts)} posts.')
+				return
+
+		finally :
+			close(fd)
+
+		# indexed all at once, so that invalidation events can't be applied between, and then overwritten by, snapshot entries
+		for post_id, signature in entries :
+			related_posts.insert(post_id, signature)
+
+		# posts published after the snapshot was saved are indexed from the database. this overlaps the save, since posts
+		# inserted by transactions that were open during it may have earlier timestamps
+		await self._index_related_posts((datetime.fromtimestamp(saved, timezone.utc) - timedelta(minutes=1), 0))
+		self.logger.info(f'loaded related posts index of {len(entries)} posts.')
+
+
+	async def _index_related_posts(self, after: Optional[Tuple[datetime, int]] = None) -> None :
+		"""
+		indexes posts created after the given (created_on, post_id), or every post that fits in the index, oldest first, in
+		batches, so that the newest posts are the last to be evicted from the index. signatures are computed off of the event loop.
+		"""
+		loop: AbstractEventLoop = get_event_loop()
+		last: Tuple[Any, int]
+
+		if after :
+			last = after
+
+		else :
+			# the oldest post that will fit in the index
+			data: Optional[Tuple[datetime, int]] = await self.query_async("""
+				SELECT posts.created_on, posts.post_id
+				FROM kheina.public.posts
+				WHERE posts.privacy_id = privacy_to_id('public')
+				ORDER BY posts.created_on DESC, posts.post_id DESC
+				OFFSET %s
+				LIMIT 1;
+				""",
+				(RelatedIndex.MaxPosts,),
+				fetch_one=True,
+			)
+			last = tuple(data) if data else ('-infinity', 0)
+
+		while True :
+			data: List[Tuple[int, datetime, List[str]]] = await self.query_async("""
+				SELECT posts.post_id, posts.created_on, array_agg(tags.tag)
+				FROM kheina.public.posts
+					INNER JOIN kheina.public.tag_post
+						ON tag_post.post_id = posts.post_id
+					INNER JOIN kheina.public.tags
+						ON tags.tag_id = tag_post.tag_id
+							AND tags.deprecated = false
+				WHERE posts.privacy_id = privacy_to_id('public')
+					AND (posts.created_on, posts.post_id) > (%s, %s)
+				GROUP BY posts.created_on, posts.post_id
+				ORDER BY posts.created_on, posts.post_id
+				LIMIT %s;
+				""",
+				(*last, Posts.RelatedBatchSize),
+				fetch_all=True,
+			)
+
+			if not data :
+				break
+
+			signatures: List[Tuple[int, Optional[bytes]]] = await loop.run_in_executor(
+				None,
+				lambda : [(post_id, related_posts.minhash.signature(tags)) for post_id, _, tags in data],
+			)
+
+			for post_id, signature in signatures :
+				related_posts.insert(post_id, signature)
+
+			last = (data[-1][1], data[-1][0])
+			# yield between batches so that requests aren't starved while the index is built
+			await sleep(0)
+
+
+	@HttpErrorHandler('retrieving scores')
+	async def scoresBatch(self, post_ids: List[PostId]) -> List[PostScore] :
+		"""
+		returns the score of every post id provided, in the order provided
+		"""
+		self._validateBatch(post_ids)
+		unique: List[PostId] = list(dict.fromkeys(post_ids))
+
+		scores: Dict[str, Optional[InternalScore]] = await ScoreCache.get_many_async(unique)
+		# values aerospike can't deserialize come back as bytearrays, those are misses too, as in fuzzly's scores_many callers
+		misses: List[PostId] = [post_id for post_id in unique if scores.get(post_id) is None or type(scores[post_id]) == bytearray]
+
+		if misses :
+			# scores_many caches everything it finds, so it reads from the primary
+			with primary() :
+				scores.update(await self.scores_many(misses))
+
+		return [PostScore(post_id=post_id, score=scores.get(post_id)) for post_id in post_ids]
+
+
+	@HttpErrorHandler('retrieving votes')
+	async def votesBatch(self, user_id: int, post_ids: List[PostId]) -> List[PostVote] :
+		"""
+		returns the given user's vote on every post id provided, in the order provided
+		"""
+		self._validateBatch(post_ids)
+		unique: List[PostId] = list(dict.fromkeys(post_ids))
+
+		cached: Dict[str, Optional[int]] = await VoteCache.get_many_async([f'{user_id}|{post_id}' for post_id in unique])
+		votes: Dict[PostId, Optional[int]] = { post_id: cached.get(f'{user_id}|{post_id}') for post_id in unique }
+		misses: List[PostId] = [post_id for post_id, vote in votes.items() if vote is None or type(vote) == bytearray]
+
+		if misses :
+			# votes_many caches everything it finds, so it reads from the primary
+			with primary() :
+				found: Dict[PostId, int] = await self.votes_many(user_id, misses)
+
+			votes.update(found)
+
+			for post_id, vote in found.items() :
+				if not vote :
+					# votes_many only caches the votes it finds, posts the user hasn't voted on would otherwise be queried every time
+					ensure_future(VoteCache.put_async(f'{user_id}|{post_id}', 0))
+
+		return [PostVote(post_id=post_id, vote=votes[post_id] or 0) for post_id in post_ids]
+
+
+	@IndexedCache(300, index=_comment_dependencies)
+	@SharedCache('comments', '{post_id}.{sort}.{count}.{page}', TTL_seconds=300, index=_comment_dependencies)
+	@replica_fill
 	async def _getComments(self, post_id: PostId, sort: PostSort, count: int, page: int) -> InternalPosts :
 		# TODO: fix new and old sorts
 		data = await self.query_async(f"""
 			SELECT
-				posts.post_id,
-				posts.title,
-				posts.description,
-				posts.rating,
-				posts.parent,
-				posts.created_on,
-				posts.updated_on,
-				posts.filename,
-				posts.media_type_id,
-				posts.width,
-				posts.height,
-				posts.uploader,
-				posts.privacy_id,
-				posts.thumbhash
+				posts.post_id
 			FROM kheina.public.posts
 				LEFT JOIN kheina.public.post_scores
 					ON post_scores.post_id = posts.post_id
@@ -715,7 +1270,7 @@ class Posts(Scoring) :
 			fetch_all=True,
 		)
 
-		return InternalPosts(post_list=self.parse_response(data))
+		return InternalPosts(post_list=await self.posts_many([row[0] for row in data]))
 
 
 	@HttpErrorHandler('retrieving comments')
@@ -723,13 +1278,25 @@ class Posts(Scoring) :
 		self._validatePageNumber(page)
 		self._validateCount(count)
 
+		if known_posts.missing(post_id.int()) :
+			# a post that doesn't exist has no comments
+			return []
+
+		if known_posts.unconfirmed(post_id.int()) :
+			try :
+				await self._get_post(post_id)
+
+			except NotFound :
+				return []
+
 		# TODO: if there ever comes a time when there are thousands of comments on posts, this may need to be revisited.
 		posts: InternalPosts = await self._getComments(post_id, sort, count, page)
-		return await posts.posts(client, user)
+		return await self.hydrate(user, posts)
 
 
 	@ArgsCache(10)
 	@HttpErrorHandler('retrieving timeline posts')
+	@reads_as_user
 	async def timelinePosts(self, user: KhUser, count: int, page: int) -> List[Post] :
 		self._validatePageNumber(page)
 		self._validateCount(count)
@@ -767,10 +1334,67 @@ class Posts(Scoring) :
 			page,
 		)
 
-		parser = self.internal_select(query)
-		posts: InternalPosts = InternalPosts(post_list=parser(await self.query_async(query, fetch_all=True)))
+		parser = self.listing_select(query)
+		posts: InternalPosts = InternalPosts(post_list=await parser(await self.query_async(query, fetch_all=True)))
+
+		return await self.hydrate(user, posts)
+
+
+	async def _timeline_since(self, user_id: int, post_id: PostId, created: datetime, count: int) -> List[int] :
+		# keyset predicate on (created_on, post_id), so only posts newer than the client's newest are ever read,
+		# rather than rebuilding the first page of the timeline on every poll
+		data: List[Tuple[int]] = await self.query_async("""
+			SELECT
+				posts.post_id
+			FROM kheina.public.following
+				INNER JOIN kheina.public.posts
+					ON posts.uploader = following.follows
+			WHERE following.user_id = %s
+				AND posts.privacy_id = privacy_to_id('public')
+				AND (posts.created_on, posts.post_id) > (%s, %s)
+			ORDER BY posts.created_on ASC, posts.post_id ASC
+			LIMIT %s;
+			""",
+			(
+				user_id,
+				created,
+				post_id.int(),
+				count,
+			),
+			fetch_all=True,
+		)
+
+		return [row[0] for row in data]
+
+
+	@HttpErrorHandler('retrieving new timeline posts')
+	@reads_as_user
+	async def timelineSince(self, user: KhUser, post_id: PostId, created: datetime, count: int) -> List[Post] :
+		"""
+		returns timeline posts newer than the given post, newest first. when there are more than count new posts, the
+		oldest of them are returned, so that polling again from the newest post returned never skips any.
+		"""
+		self._validateCount(count)
+
+		post_ids: List[int] = await self._timeline_since(user.user_id, post_id, created, count)
+		posts: InternalPosts = InternalPosts(post_list=await self.posts_many(post_ids[::-1]))
+
+		return await self.hydrate(user, posts)
 
-		return await posts.posts(client, user)
+
+	@ArgsCache(5)
+	@HttpErrorHandler('counting new timeline posts')
+	@reads_as_user
+	async def timelineNewCount(self, user: KhUser, post_id: PostId, created: datetime) -> TimelineCount :
+		"""
+		counts timeline posts newer than the given post, up to NewPostsLimit
+		"""
+		post_ids: List[int] = await self._timeline_since(user.user_id, post_id, created, Posts.NewPostsLimit + 1)
+
+		return TimelineCount(
+			count=min(len(post_ids), Posts.NewPostsLimit),
+			more=len(post_ids) > Posts.NewPostsLimit,
+		)
 
 
 	@ArgsCache(10)
@@ -810,10 +1434,10 @@ class Posts(Scoring) :
 			Order.descending_nulls_first,
 		)
 
-		parser = self.internal_select(query)
-		posts: InternalPosts = InternalPosts(post_list=parser(await self.query_async(query, fetch_all=True)))
+		parser = self.listing_select(query)
+		posts: InternalPosts = InternalPosts(post_list=await parser(await self.query_async(query, fetch_all=True)))
 
-		return now, await posts.posts(client, user)
+		return now, await self.hydrate(user, posts)
 
 
 	@HttpErrorHandler('retrieving user posts')
@@ -822,17 +1446,7 @@ class Posts(Scoring) :
 		self._validatePageNumber(page)
 		self._validateCount(count)
 
-		tags: Tuple[str] = (f'@{handle}',)
-		total: Task[int] = ensure_future(self.total_results(tags))
-		iposts: InternalPosts = await self._fetch_posts(PostSort.new, tags, count, page)
-		posts: List[Post] = await iposts.posts(client, user)
-
-		return SearchResults(
-			posts=posts,
-			count=len(posts),
-			page=page,
-			total=await total,
-		)
+		return await self._search(user, SearchQuery(sort=PostSort.new, include_users=(handle,)), count, page)
 
 
 	async def _fetch_own_posts(self, user_id: int, sort: PostSort, count: int, page: int) -> InternalPosts :
@@ -886,22 +1500,26 @@ class Posts(Scoring) :
 				Order.descending_nulls_first,
 			)
 
-		parser = self.internal_select(query)
-		return InternalPosts(post_list=parser(await self.query_async(query, fetch_all=True)))
+		parser = self.listing_select(query)
+		return InternalPosts(post_list=await parser(await self.query_async(query, fetch_all=True)))
 
 
 	@HttpErrorHandler("retrieving user's own posts")
-	@ArgsCache(5)
+	@IndexedCache(300, index=_user_dependencies)
+	@reads_as_user
+	@replica_fill
 	async def fetchOwnPosts(self, user: KhUser, sort: PostSort, count: int, page: int) -> List[Post] :
 		self._validatePageNumber(page)
 		self._validateCount(count)
 
 		posts: InternalPosts = await self._fetch_own_posts(user.user_id, sort, count, page)
-		return await posts.posts(client, user)
+		return await self.hydrate(user, posts)
 
 
 	@HttpErrorHandler("retrieving user's drafts")
-	@ArgsCache(5)
+	@IndexedCache(300, index=_user_dependencies)
+	@reads_as_user
+	@replica_fill
 	async def fetchDrafts(self, user: KhUser) -> List[Post] :
 		query = Query(
 			Table('kheina.public.posts')
@@ -932,7 +1550,223 @@ class Posts(Scoring) :
 			Order.descending_nulls_first,
 		)
 
-		parser = self.internal_select(query)
-		posts: InternalPosts = InternalPosts(post_list=parser(await self.query_async(query, fetch_all=True)))
+		parser = self.listing_select(query)
+		posts: InternalPosts = InternalPosts(post_list=await parser(await self.query_async(query, fetch_all=True)))
+
+		return await self.hydrate(user, posts)
+
+
+	async def _remove(self, kvs: KeyValueStore, key: str) -> None :
+		try :
+			await kvs.remove_async(key)
+
+		except RecordNotFound :
+			pass
+
+
+	async def _invalidate_post(self, event: InvalidationEvent) -> None :
+		post_id: PostId = event.post_id
+		# any event about a post means it exists, or did. this also clears it from the negative cache before it's reloaded below
+		known_posts.add([post_id.int()])
+
+		await self._remove(PostKVS, post_id)
+		dependencies: Set[Hashable] = { ('post', post_id), ('search', None) }
+
+		if event.event == InvalidationEventType.tag :
+			ensure_future(self._remove(TagKVS, f'post.{post_id}'))
+
+		# reload the post so that the uploader, parent, and current rating are known, even if the event omitted them
+		post: Optional[InternalPost] = None
+
+		try :
+			post = await self._get_post(post_id)
+
+		except NotFound :
+			pass
+
+		user_id: Optional[int] = event.user_id or (post.user_id if post else None)
+
+		if user_id :
+			self.fetchOwnPosts.invalidate(('user', user_id))
+			self.fetchDrafts.invalidate(('user', user_id))
+			dependencies.add(('search', '@' + (await client.user(user_id)).handle.lower()))
+
+		if post and post.parent :
+			self._getComments.invalidate(('parent', PostId(post.parent)))
+			self._getComments.shared.invalidate(('parent', PostId(post.parent)))
+
+		for rating in filter(None, (event.rating, post.rating if post else None)) :
+			dependencies.add(('search', rating.name))
+
+		tags: List[str] = event.tags
+
+		if tags is None :
+			tags = (await self.tags_many([post_id]))[post_id]
+
+		for tag in tags :
+			dependencies.add(('search', normalize_tag(tag)))
+
+		if post and post.privacy == Privacy.public :
+			related_posts.add(post_id.int(), map(normalize_tag, tags))
+
+		else :
+			related_posts.remove(post_id.int())
+
+		# the post may have entered or left the public lists of the sets containing it
+		for set_id in await self._post_sets(post_id) :
+			dependencies.add(('set', set_id))
+
+		self._fetch_posts.invalidate(*dependencies)
+		self._rendered_search.invalidate(*dependencies)
+		self._set_post_ids.invalidate(*dependencies)
+		self._fetch_set_page.invalidate(*dependencies)
+		self._getComments.invalidate(('post', post_id))
+		self._fetch_posts.shared.invalidate(*dependencies)
+		self._getComments.shared.invalidate(('post', post_id))
+
+
+	async def _post_sets(self, post_id: PostId) -> List[SetId] :
+		data: List[Tuple[int]] = await self.query_async("""
+			SELECT set_post.set_id
+			FROM kheina.public.set_post
+			WHERE set_post.post_id = %s;
+			""",
+			(post_id.int(),),
+			fetch_all=True,
+		)
+
+		return [SetId(row[0]) for row in data]
+
+
+	def _invalidate_set(self, event: InvalidationEvent) -> None :
+		# posts were added to, removed from, or reordered within the set
+		dependencies: Set[Hashable] = { ('set', event.set_id), ('search', 'set:' + event.set_id) }
+		self._set_post_ids.invalidate(*dependencies)
+		self._fetch_set_page.invalidate(*dependencies)
+		self._fetch_posts.invalidate(*dependencies)
+		self._rendered_search.invalidate(*dependencies)
+		self._fetch_posts.shared.invalidate(*dependencies)
+
+
+	async def _invalidate_handles(self, event: InvalidationEvent) -> None :
+		# both the old and new handle now resolve differently, along with every search filtering on either of them
+		handles: List[str] = [handle.lower() for handle in event.handles or []]
+		await user_ids.invalidate(handles)
+
+		dependencies: Set[Hashable] = { ('search', '@' + handle) for handle in handles }
+		self._fetch_posts.invalidate(*dependencies)
+		self._rendered_search.invalidate(*dependencies)
+		self._fetch_posts.shared.invalidate(*dependencies)
+
+
+	def _invalidate_vote(self, event: InvalidationEvent) -> None :
+		# the instance that processed the vote has already written fresh data to aerospike, so only local copies are stale
+		ScoreCache._cache.pop(event.post_id, None)
+
+		if event.user_id :
+			VoteCache._cache.pop(f'{event.user_id}|{event.post_id}', None)
+
+		# rendered pages include the post's score
+		self._rendered_search.invalidate(('post', event.post_id))
+
+
+	@HttpErrorHandler('invalidating caches')
+	async def invalidate(self, events: List[InvalidationEvent]) -> None :
+		"""
+		evicts the cached data affected by each of the given change events
+		"""
+		for event in events :
+			# each event is handled independently, so that one failure doesn't leave the rest of the batch cached
+			try :
+				await self._invalidate_event(event)
+
+			except Exception as e :
+				self.logger.warning({
+					'message': 'failed to invalidate event.',
+					'event': event.dict(),
+				}, exc_info=e)
+
+
+	async def _invalidate_event(self, event: InvalidationEvent) -> None :
+		if event.event == InvalidationEventType.vote :
+			self._invalidate_vote(event)
+			return
+
+		if self._replica :
+			# until the replica has caught up to this change, anything read from it could be cached in its stale form
+			self._replica.fence()
+
+		# the affected data is reloaded as part of invalidation, so it has to be read from the primary
+		with primary() :
+			if event.event == InvalidationEventType.handle :
+				await self._invalidate_handles(event)
+
+			elif event.event == InvalidationEventType.set :
+				self._invalidate_set(event)
+
+			else :
+				await self._invalidate_post(event)
+
+
+	async def export(self, after: Optional[PostId] = None) -> AsyncIterator[bytes] :
+		"""
+		streams every post, along with its score, in post id order as newline delimited json.
+		rows are read through a server-side cursor on a dedicated connection, so memory use is constant regardless of table size.
+		:param after: watermark to resume from, only posts with a greater post id are returned
+		"""
+		loop: AbstractEventLoop = get_event_loop()
+		conn: Connection = await loop.run_in_executor(None, partial(dbConnect, **db))
+
+		try :
+			cur: Cursor = conn.cursor(name='posts_export')
+			cur.itersize = Posts.ExportBatchSize
+
+			await loop.run_in_executor(None, cur.execute, """
+				SELECT
+					posts.post_id,
+					posts.title,
+					posts.description,
+					posts.rating,
+					posts.parent,
+					posts.created_on,
+					posts.updated_on,
+					posts.filename,
+					posts.media_type_id,
+					posts.width,
+					posts.height,
+					posts.uploader,
+					posts.privacy_id,
+					posts.thumbhash,
+					post_scores.upvotes,
+					post_scores.downvotes
+				FROM kheina.public.posts
+					LEFT JOIN kheina.public.post_scores
+						ON post_scores.post_id = posts.post_id
+				WHERE posts.post_id > %s
+				ORDER BY posts.post_id;
+				""",
+				(after.int() if after else -1,),
+			)
+
+			while True :
+				rows: List[List[Any]] = await loop.run_in_executor(None, cur.fetchmany, Posts.ExportBatchSize)
+
+				if not rows :
+					break
+
+				yield b''.join(
+					PostExport(
+						post=self._parse_row(row),
+						score=InternalScore(
+							up=row[14],
+							down=row[15],
+							total=row[14] + row[15],
+						) if row[14] is not None else None,
+					).json().encode() + b'\n'
+					for row in rows
+				)
+
+			cur.close()
 
-		return await posts.posts(client, user)
+		finally :
+			conn.close()
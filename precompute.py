@@ -0,0 +1,205 @@
+from asyncio import CancelledError, Task, ensure_future, sleep
+from fcntl import LOCK_EX, LOCK_NB, flock
+from os import O_CREAT, O_RDWR, close
+from os import open as os_open
+from random import random
+from time import time
+from typing import Awaitable, Callable, Dict, Hashable, Iterable, List, Optional, Tuple
+
+from kh_common.logging import Logger, getLogger
+from shared_cache import SharedMemoryCache
+
+
+class SpaceSaving :
+	"""
+	space-saving heavy hitter sketch. approximately tracks the most frequent keys seen using a fixed number of counters.
+	a key's count is overestimated by at most the count of the counter it replaced, which is tracked as its error.
+	"""
+
+	def __init__(self: 'SpaceSaving', capacity: int) -> None :
+		assert capacity > 0
+		self._capacity: int = capacity
+		self._counts: Dict[Hashable, int] = { }
+		self._errors: Dict[Hashable, int] = { }
+
+
+	def add(self: 'SpaceSaving', key: Hashable, count: int = 1) -> None :
+		if key in self._counts :
+			self._counts[key] += count
+			return
+
+		if len(self._counts) < self._capacity :
+			self._counts[key] = count
+			self._errors[key] = 0
+			return
+
+		# replace the least frequent key, the new key inherits its count as error
+		victim: Hashable = min(self._counts, key=self._counts.__getitem__)
+		floor: int = self._counts.pop(victim)
+		del self._errors[victim]
+
+		self._counts[key] = floor + count
+		self._errors[key] = floor
+
+
+	def top(self: 'SpaceSaving', n: int, minimum: int = 1) -> List[Tuple[Hashable, int]] :
+		"""
+		returns up to n of the most frequent keys, with their guaranteed counts, whose guaranteed count is at least minimum
+		"""
+		counts: List[Tuple[Hashable, int]] = [(key, count - self._errors[key]) for key, count in self._counts.items()]
+		counts = sorted(filter(lambda x : x[1] >= minimum, counts), key=lambda x : x[1], reverse=True)
+		return counts[:n]
+
+
+	def decay(self: 'SpaceSaving') -> None :
+		"""
+		halves every counter so that the sketch favors recent traffic
+		"""
+		for key in list(self._counts.keys()) :
+			count: int = self._counts[key] // 2
+
+			if count :
+				self._counts[key] = count
+				self._errors[key] //= 2
+
+			else :
+				del self._counts[key]
+				del self._errors[key]
+
+
+	def __len__(self: 'SpaceSaving') -> int :
+		return len(self._counts)
+
+
+class Precompute :
+	"""
+	refreshes the results of the most frequently requested keys in the background, so that they're never computed on the request path.
+	every interval, the hottest keys (plus any pinned keys) are refreshed once each, staggered evenly across the interval.
+	when the shared memory cache is enabled, only one worker per host refreshes, the one holding the lock on LockFile.
+	the others receive its results through the shared memory cache, see shared_cache.py. otherwise, each worker refreshes
+	its own caches.
+	"""
+
+	# each hot key is refreshed once per interval, this must be shorter than the TTL of the caches being refreshed
+	Interval: float = 60
+	SketchSize: int = 512
+	TopK: int = 32
+	# the minimum number of requests, per interval, for a key to be considered hot
+	MinHits: int = 3
+	# the fraction of each interval that may be spent running refreshes, once spent the rest of the interval's refreshes are skipped.
+	# when a single worker refreshes, this bounds the database time spent on refreshes by the whole host
+	TimeBudget: float = 0.05
+	LockFile: str = '/dev/shm/fuzzly-posts-precompute.lock'
+
+	def __init__(self: 'Precompute', pinned: Iterable[Hashable] = ()) -> None :
+		self.logger: Logger = getLogger()
+		self.sketch: SpaceSaving = SpaceSaving(Precompute.SketchSize)
+		self.pinned: Tuple[Hashable, ...] = tuple(pinned)
+		self._task: Optional[Task] = None
+		self._lock: Optional[int] = None
+
+
+	def leader(self: 'Precompute') -> bool :
+		"""
+		true if this worker is the host's refresher. the lock is released by the os when the worker exits, after which
+		another worker takes over on its next attempt.
+		"""
+		if self._lock is not None :
+			return True
+
+		fd: int = os_open(Precompute.LockFile, O_RDWR | O_CREAT, 0o600)
+
+		try :
+			flock(fd, LOCK_EX | LOCK_NB)
+
+		except OSError :
+			close(fd)
+			return False
+
+		self._lock = fd
+		return True
+
+
+	def refreshes(self: 'Precompute') -> bool :
+		"""
+		true if this worker should run refreshes. without the shared memory cache, other workers can't see this worker's
+		results, so every worker refreshes.
+		"""
+		return not SharedMemoryCache.Enabled or self.leader()
+
+
+	def track(self: 'Precompute', key: Hashable) -> None :
+		self.sketch.add(key)
+
+
+	def hot(self: 'Precompute') -> List[Hashable] :
+		hot: List[Hashable] = list(self.pinned)
+		pinned: set = set(self.pinned)
+
+		for key, _ in self.sketch.top(Precompute.TopK, Precompute.MinHits) :
+			if key not in pinned :
+				hot.append(key)
+
+		return hot
+
+
+	def start(self: 'Precompute', refresh: Callable[[Hashable], Awaitable[None]]) -> None :
+		if not self._task :
+			self._task = ensure_future(self._run(refresh))
+
+
+	def stop(self: 'Precompute') -> None :
+		if self._task :
+			self._task.cancel()
+			self._task = None
+
+		if self._lock is not None :
+			close(self._lock)
+			self._lock = None
+
+
+	async def _run(self: 'Precompute', refresh: Callable[[Hashable], Awaitable[None]]) -> None :
+		# offset each worker randomly so that they don't all refresh at the same moment
+		await sleep(random() * Precompute.Interval)
+
+		while True :
+			keys: List[Hashable] = self.hot()
+			self.sketch.decay()
+
+			try :
+				if not self.refreshes() :
+					keys = []
+
+			except OSError as e :
+				self.logger.warning('failed to open the precompute lock file.', exc_info=e)
+				keys = []
+
+			budget: float = Precompute.Interval * Precompute.TimeBudget
+			step: float = Precompute.Interval / max(len(keys), 1)
+			skipped: int = 0
+
+			for key in keys :
+				start: float = time()
+
+				if budget > 0 :
+					try :
+						await refresh(key)
+
+					except CancelledError :
+						raise
+
+					except Exception as e :
+						self.logger.warning(f'failed to precompute {key}.', exc_info=e)
+
+					budget -= time() - start
+
+				else :
+					skipped += 1
+
+				await sleep(max(step - (time() - start), 0))
+
+			if not keys :
+				await sleep(Precompute.Interval)
+
+			if skipped :
+				self.logger.info(f'precompute time budget exhausted, skipped {skipped} of {len(keys)} refreshes.')
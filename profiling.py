@@ -0,0 +1,174 @@
+from collections import defaultdict
+from contextvars import ContextVar
+from functools import wraps
+from inspect import iscoroutinefunction
+from itertools import count
+from os import getpid, makedirs, path
+from time import perf_counter
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from kh_common.auth import AuthToken, retrieveAuthToken
+from kh_common.logging import Logger, getLogger
+from kh_common.models.auth import Scope
+from pyinstrument import Profiler
+from serialization import serialize
+from starlette.requests import Request
+from starlette.types import ASGIApp, Message, Receive
+from starlette.types import Scope as request_scope
+from starlette.types import Send
+
+
+"""
+opt-in profiling of individual requests. an internal caller sends the ProfileHeader header with a value of either:
+	inline: the response body is replaced with the profile, the per-await timings, and the original status
+	store: the response is returned untouched and the profile is written to a bounded ring of files on disk,
+		the name of the file is returned in the ProfileHeader response header
+in both cases per-category totals are returned in the server-timing header.
+requests without the header pay for a single header scan, plus a context variable lookup per instrumented call.
+"""
+
+
+ProfileHeader: str = 'kh-profile'
+ProfileDirectory: str = '/tmp/fuzzly-posts-profiles'
+# the number of profiles each worker keeps on disk before overwriting the oldest
+ProfileRingSize: int = 64
+SampleInterval: float = 0.0005
+
+_timings: ContextVar[Optional[List[Tuple[str, str, float]]]] = ContextVar('timings', default=None)
+_ring: Iterator[int] = count()
+
+
+def _timed(category: str, name: str, func: Callable) -> Callable :
+	@wraps(func)
+	async def wrapper(*args: Tuple[Any], **kwargs: Dict[str, Any]) -> Any :
+		timings: Optional[List[Tuple[str, str, float]]] = _timings.get()
+
+		if timings is None :
+			return await func(*args, **kwargs)
+
+		start: float = perf_counter()
+
+		try :
+			return await func(*args, **kwargs)
+
+		finally :
+			timings.append((category, name, perf_counter() - start))
+
+	return wrapper
+
+
+def instrument(cls: type, category: str, methods: Optional[Iterable[str]] = None) -> None :
+	"""
+	records the time spent awaiting each of the given async methods of cls under category, while a request is being profiled.
+	if methods isn't provided, every public async method is instrumented.
+	"""
+	if methods is None :
+		methods = [name for name in dir(cls) if not name.startswith('_') and iscoroutinefunction(getattr(cls, name))]
+
+	for name in methods :
+		setattr(cls, name, _timed(category, f'{cls.__name__}.{name}', getattr(cls, name)))
+
+
+class ProfilerMiddleware :
+
+	def __init__(self, app: ASGIApp) -> None :
+		self.app: ASGIApp = app
+		self.logger: Logger = getLogger()
+
+
+	async def _authorized(self, request: Request) -> bool :
+		# this middleware sits outside of the auth middleware, so the token has to be checked here
+		try :
+			token: AuthToken = await retrieveAuthToken(request)
+
+		except Exception :
+			return False
+
+		return Scope.internal.name in token.data.get('scope', [])
+
+
+	async def __call__(self, scope: request_scope, receive: Receive, send: Send) -> None :
+		if scope['type'] != 'http' :
+			return await self.app(scope, receive, send)
+
+		mode: Optional[bytes] = None
+
+		for key, value in scope['headers'] :
+			if key == ProfileHeader.encode() :
+				mode = value
+				break
+
+		if mode is None or not await self._authorized(Request(scope, receive)) :
+			return await self.app(scope, receive, send)
+
+		messages: List[Message] = []
+
+		async def capture(message: Message) -> None :
+			messages.append(message)
+
+		timings: List[Tuple[str, str, float]] = []
+		token = _timings.set(timings)
+		profiler: Profiler = Profiler(interval=SampleInterval, async_mode='enabled')
+		start: float = perf_counter()
+		profiler.start()
+
+		try :
+			await self.app(scope, receive, capture)
+
+		finally :
+			profiler.stop()
+			elapsed: float = perf_counter() - start
+			_timings.reset(token)
+
+		totals: Dict[str, float] = defaultdict(float)
+
+		for category, _, duration in timings :
+			totals[category] += duration
+
+		server_timing: bytes = ', '.join(
+			[f'total;dur={elapsed * 1000:.3f}'] + [f'{category};dur={duration * 1000:.3f}' for category, duration in totals.items()]
+		).encode()
+
+		start_message: Message = messages[0]
+		body: bytes = b''.join([message.get('body', b'') for message in messages[1:]])
+		report: Dict[str, Any] = {
+			'path': scope['path'],
+			'status': start_message['status'],
+			'elapsed': elapsed,
+			'totals': dict(totals),
+			'timings': [{ 'category': category, 'name': name, 'duration': duration } for category, name, duration in timings],
+		}
+
+		if mode == b'store' :
+			headers: List[Tuple[bytes, bytes]] = list(start_message.get('headers', [])) + [(ProfileHeader.encode(), self._store(report, profiler).encode())]
+
+		else :
+			# the original headers describe the original body, so none of them can be kept
+			report['profile'] = profiler.output_text(unicode=True, color=False)
+			body = serialize(report)
+			start_message = { **start_message, 'status': 200 }
+			headers: List[Tuple[bytes, bytes]] = [
+				(b'content-type', b'application/json'),
+				(b'content-length', str(len(body)).encode()),
+			]
+
+		await send({ **start_message, 'headers': headers + [(b'server-timing', server_timing)] })
+		await send({ 'type': 'http.response.body', 'body': body })
+
+
+	def _store(self, report: Dict[str, Any], profiler: Profiler) -> str :
+		name: str = f'{getpid()}-{next(_ring) % ProfileRingSize:03}'
+
+		try :
+			makedirs(ProfileDirectory, exist_ok=True)
+
+			with open(path.join(ProfileDirectory, name + '.json'), 'wb') as file :
+				file.write(serialize(report))
+
+			with open(path.join(ProfileDirectory, name + '.html'), 'w') as file :
+				file.write(profiler.output_html())
+
+		except Exception as e :
+			self.logger.warning('failed to store request profile.', exc_info=e)
+
+		return name
@@ -0,0 +1,220 @@
+from array import array
+from hashlib import blake2b
+from heapq import nlargest
+from os import replace
+from random import Random
+from struct import Struct
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+
+# a mersenne prime larger than any 61 bit hash, so that every hash function is a permutation of the hash space
+_prime: int = (1 << 61) - 1
+# signatures are stored as packed u64s, so that they're compact and identical in every process
+Signature = bytes
+SnapshotHeader: Struct = Struct('<QQ')
+
+
+def _hash(element: str) -> int :
+	# hash() is randomized per process, so signatures built with it couldn't be shared between workers
+	return int.from_bytes(blake2b(element.encode(), digest_size=8).digest(), 'little') & _prime
+
+
+class MinHash :
+	"""
+	estimates the jaccard similarity of two sets from fixed size signatures. each element is hashed once, then
+	permuted by Permutations universal hash functions, and the signature is the minimum of each permutation.
+	the fraction of matching positions between two signatures estimates the similarity of their sets.
+	"""
+
+	Permutations: int = 64
+
+	def __init__(self: 'MinHash', seed: int = 0) -> None :
+		random: Random = Random(seed)
+		self._permutations: List[Tuple[int, int]] = [
+			(random.randrange(1, _prime), random.randrange(0, _prime))
+			for _ in range(MinHash.Permutations)
+		]
+
+
+	def signature(self: 'MinHash', elements: Iterable[str]) -> Optional[Signature] :
+		hashes: List[int] = [_hash(element) for element in set(elements)]
+
+		if not hashes :
+			return None
+
+		return array('Q', [min([(a * h + b) % _prime for h in hashes]) for a, b in self._permutations]).tobytes()
+
+
+	@staticmethod
+	def similarity(a: Signature, b: Signature) -> float :
+		matches: int = sum([x == y for x, y in zip(memoryview(a).cast('Q'), memoryview(b).cast('Q'))])
+		return matches / (len(a) // 8)
+
+
+class RelatedIndex :
+	"""
+	locality sensitive hashing index over minhash signatures. signatures are split into Bands bands, and posts whose
+	signatures are identical in any band share a bucket, so only posts likely to be similar are ever compared.
+	buckets are capped at BucketSize posts, dropping the oldest, so that very common tag sets don't make lookups linear.
+	the index is capped at MaxPosts posts, dropping the least recently inserted, so posts should be inserted oldest first.
+	"""
+
+	# Bands * rows per band must equal MinHash.Permutations. with 16 bands of 4 rows, posts with a similarity of 0.5
+	# are found ~64% of the time, and posts with a similarity of 0.8 more than 99% of the time
+	Bands: int = 16
+	BucketSize: int = 256
+	# each post costs roughly 1.5KB, between its signature and its bucket entries
+	MaxPosts: int = 50000
+
+	def __init__(self: 'RelatedIndex') -> None :
+		assert MinHash.Permutations % RelatedIndex.Bands == 0
+		self.minhash: MinHash = MinHash()
+		self._band_size: int = MinHash.Permutations // RelatedIndex.Bands * 8
+		self._signatures: Dict[int, Signature] = { }
+		self._buckets: Dict[int, Dict[int, None]] = { }
+
+
+	def _bands(self: 'RelatedIndex', signature: Signature) -> Iterable[int] :
+		for band in range(RelatedIndex.Bands) :
+			yield hash((band, signature[band * self._band_size:(band + 1) * self._band_size]))
+
+
+	def add(self: 'RelatedIndex', post_id: int, tags: Iterable[str]) -> None :
+		self.insert(post_id, self.minhash.signature(tags))
+
+
+	def insert(self: 'RelatedIndex', post_id: int, signature: Optional[Signature]) -> None :
+		"""
+		indexes a precomputed signature, so that signatures can be computed off of the event loop
+		"""
+		self.remove(post_id)
+
+		if signature is None :
+			return
+
+		self._signatures[post_id] = signature
+
+		for band in self._bands(signature) :
+			bucket: Dict[int, None] = self._buckets.setdefault(band, { })
+			bucket[post_id] = None
+
+			if len(bucket) > RelatedIndex.BucketSize :
+				del bucket[next(iter(bucket))]
+
+		while len(self._signatures) > RelatedIndex.MaxPosts :
+			self.remove(next(iter(self._signatures)))
+
+
+	def remove(self: 'RelatedIndex', post_id: int) -> None :
+		signature: Optional[Signature] = self._signatures.pop(post_id, None)
+
+		if signature is None :
+			return
+
+		for band in self._bands(signature) :
+			bucket: Optional[Dict[int, None]] = self._buckets.get(band)
+
+			if bucket is None :
+				continue
+
+			bucket.pop(post_id, None)
+
+			if not bucket :
+				del self._buckets[band]
+
+
+	def related(self: 'RelatedIndex', post_id: int, count: int, tags: Optional[Iterable[str]] = None) -> List[Tuple[int, float]] :
+		"""
+		returns up to count post ids most similar to the given post, with their estimated similarity, most similar first.
+		posts that aren't indexed, such as unlisted posts, can still be looked up by providing their tags.
+		"""
+		signature: Optional[Signature] = self._signatures.get(post_id)
+
+		if signature is None and tags is not None :
+			signature = self.minhash.signature(tags)
+
+		if signature is None :
+			return []
+
+		candidates: Set[int] = set()
+
+		for band in self._bands(signature) :
+			candidates.update(self._buckets.get(band, ()))
+
+		candidates.discard(post_id)
+		similarities: Dict[int, float] = { candidate: MinHash.similarity(signature, self._signatures[candidate]) for candidate in candidates }
+
+		return [
+			(candidate, similarities[candidate])
+			for candidate in nlargest(count, similarities, key=lambda x : (similarities[x], x))
+		]
+
+
+	def entries(self: 'RelatedIndex') -> List[Tuple[int, Signature]] :
+		"""
+		returns every indexed post and its signature, oldest first, to be written with write
+		"""
+		return list(self._signatures.items())
+
+
+	@staticmethod
+	def write(path: str, entries: List[Tuple[int, Signature]]) -> None :
+		"""
+		writes the given posts and signatures to the given file, replacing it atomically. doesn't touch any index, so it
+		can be run off of the event loop while the index is in use.
+		"""
+		post_ids: array = array('q', [post_id for post_id, _ in entries])
+
+		with open(path + '.tmp', 'wb') as file :
+			file.write(SnapshotHeader.pack(len(post_ids), MinHash.Permutations))
+			file.write(post_ids.tobytes())
+			file.write(b''.join([signature for _, signature in entries]))
+
+		replace(path + '.tmp', path)
+
+
+	def save(self: 'RelatedIndex', path: str) -> None :
+		"""
+		writes every indexed post and its signature to the given file, oldest first, replacing it atomically
+		"""
+		RelatedIndex.write(path, self.entries())
+
+
+	@staticmethod
+	def read(path: str) -> List[Tuple[int, Signature]] :
+		"""
+		returns every post and its signature from a file written by save, oldest first. doesn't touch any index, so it
+		can be run off of the event loop while the index is in use.
+		"""
+		with open(path, 'rb') as file :
+			data: bytes = file.read()
+
+		count, permutations = SnapshotHeader.unpack_from(data, 0)
+		assert permutations == MinHash.Permutations
+
+		post_ids: array = array('q')
+		post_ids.frombytes(data[SnapshotHeader.size:SnapshotHeader.size + count * 8])
+		offset: int = SnapshotHeader.size + count * 8
+		size: int = permutations * 8
+
+		return [(post_id, data[offset + i * size:offset + (i + 1) * size]) for i, post_id in enumerate(post_ids)]
+
+
+	def load(self: 'RelatedIndex', path: str) -> int :
+		"""
+		indexes every post in a file written by save, and returns the number of posts read
+		"""
+		entries: List[Tuple[int, Signature]] = RelatedIndex.read(path)
+
+		for post_id, signature in entries :
+			self.insert(post_id, signature)
+
+		return len(entries)
+
+
+	def __contains__(self: 'RelatedIndex', post_id: int) -> bool :
+		return post_id in self._signatures
+
+
+	def __len__(self: 'RelatedIndex') -> int :
+		return len(self._signatures)
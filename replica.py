@@ -0,0 +1,218 @@
+from asyncio import get_event_loop
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import partial, wraps
+from inspect import signature
+from math import ceil
+from time import time
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional, Tuple
+
+from kh_common.auth import KhUser
+from kh_common.caching.key_value_store import KeyValueStore
+from psycopg2.extensions import connection as Connection
+from psycopg2.pool import ThreadedConnectionPool
+
+
+"""
+reads can be served by a streaming replica, while writes always go to the primary. a read is sent to the primary instead when:
+	the replica's lag is unknown, or greater than MaxLag
+	the read is made on behalf of a user who wrote within the write window, see reads_as_user
+	the read is made within primary, which is used wherever fresh data is required
+	a change made elsewhere was announced within the write window, see fence
+	the read fills a cache that outlives the write window, and a change was announced while it ran, see replica_fill
+the write window is WriteWindow seconds, or twice the measured lag if that's longer.
+
+writes are recorded in aerospike, keyed by user id and expiring with the write window, so that every worker of every
+service sees them. any service that writes on a user's behalf can set the same key, see Replica.wrote.
+"""
+
+
+recent_writers: KeyValueStore = KeyValueStore('kheina', 'recent_writers')
+
+_primary: ContextVar[bool] = ContextVar('primary', default=False)
+
+
+class Replica :
+
+	MaxLag: float = 5
+	WriteWindow: float = 2
+	# seconds between lag measurements
+	LagInterval: float = 1
+	PoolSize: int = 16
+
+	def __init__(self: 'Replica', config: Dict[str, Any]) -> None :
+		self._config: Dict[str, Any] = config
+		self._pool: Optional[ThreadedConnectionPool] = None
+		self._samples: Deque[Tuple[float, int]] = deque(maxlen=ceil(Replica.MaxLag / Replica.LagInterval) + 2)
+		self._fence: float = 0
+		self._fenced_at: Optional[float] = None
+		self.lag: Optional[float] = None
+
+
+	def _window(self: 'Replica') -> float :
+		return max(Replica.WriteWindow, (self.lag or 0) * 2)
+
+
+	def sample(self: 'Replica', primary_lsn: int, replayed_lsn: Optional[int], now: Optional[float] = None) -> None :
+		"""
+		records the primary's current wal position, and the replica's replayed position, read immediately after.
+		the lag is the time since the primary was last at a position the replica has replayed, so an idle primary never
+		makes the replica appear to lag.
+		"""
+		now = time() if now is None else now
+		self._samples.append((now, primary_lsn))
+
+		if replayed_lsn is None :
+			# the replica isn't in recovery, so it can't be behind
+			self.lag = 0
+			return
+
+		caught_up: Optional[Tuple[float, int]] = None
+
+		while self._samples and self._samples[0][1] <= replayed_lsn :
+			caught_up = self._samples.popleft()
+
+		if caught_up is None :
+			self.lag = now - self._samples[0][0]
+
+		else :
+			# keep the newest replayed sample, so the lag can still be measured from it while the replica falls behind
+			self._samples.appendleft(caught_up)
+			self.lag = now - caught_up[0]
+
+
+	def failed(self: 'Replica') -> None :
+		# the replica isn't used again until its lag has been measured successfully
+		self.lag = None
+
+
+	async def wrote(self: 'Replica', user_id: int) -> None :
+		# aerospike expires records in whole seconds, and a TTL of 0 means the namespace default
+		await recent_writers.put_async(str(user_id), True, max(ceil(self._window()), 1))
+
+
+	async def writing(self: 'Replica', user_id: int) -> bool :
+		"""
+		true when the given user wrote within the write window, or when that can't be determined
+		"""
+		try :
+			return (await recent_writers.get_many_async([str(user_id)])).get(str(user_id)) is not None
+
+		except Exception :
+			return True
+
+
+	def fence(self: 'Replica') -> None :
+		now: float = time()
+		self._fence = now + self._window()
+		self._fenced_at = now
+
+
+	def fenced_since(self: 'Replica', since: float) -> bool :
+		"""
+		true if a change was announced at or after the given time
+		"""
+		return self._fenced_at is not None and self._fenced_at >= since
+
+
+	def usable(self: 'Replica') -> bool :
+		if self.lag is None or self.lag > Replica.MaxLag or _primary.get() :
+			return False
+
+		return self._fence <= time()
+
+
+	def _connections(self: 'Replica') -> ThreadedConnectionPool :
+		if not self._pool :
+			self._pool = ThreadedConnectionPool(1, Replica.PoolSize, **self._config)
+
+		return self._pool
+
+
+	def query(self: 'Replica', sql: str, params: Tuple[Any, ...] = (), fetch_one: bool = False, fetch_all: bool = False) -> Optional[List[Any]] :
+		pool: ThreadedConnectionPool = self._connections()
+		conn: Connection = pool.getconn()
+
+		try :
+			if not conn.autocommit :
+				# every replica query is a single read, so no transaction is ever left open
+				conn.set_session(readonly=True, autocommit=True)
+
+			with conn.cursor() as cur :
+				cur.execute(sql, params)
+
+				if fetch_one :
+					return cur.fetchone()
+
+				elif fetch_all :
+					return cur.fetchall()
+
+		finally :
+			pool.putconn(conn, close=bool(conn.closed))
+
+
+	async def query_async(self: 'Replica', sql: str, params: Tuple[Any, ...] = (), fetch_one: bool = False, fetch_all: bool = False) -> Optional[List[Any]] :
+		return await get_event_loop().run_in_executor(None, partial(self.query, sql, params, fetch_one, fetch_all))
+
+
+	def close(self: 'Replica') -> None :
+		if self._pool :
+			self._pool.closeall()
+			self._pool = None
+
+
+@contextmanager
+def primary() -> Iterator[None] :
+	"""
+	reads within this block, including those in tasks started within it, always go to the primary
+	"""
+	token = _primary.set(True)
+
+	try :
+		yield
+
+	finally :
+		_primary.reset(token)
+
+
+def reads_as_user(func: Callable) -> Callable :
+	"""
+	decorates an async method whose first argument is the requesting user, so that its reads go to the primary while the
+	user is within their write window. the method's class must have a _replica attribute, see Scoring.
+	"""
+	@wraps(func)
+	async def wrapper(self: Any, user: KhUser, *args: Any, **kwargs: Any) -> Any :
+		replica: Optional[Replica] = self._replica
+
+		if user and replica and replica.usable() and await replica.writing(user.user_id) :
+			with primary() :
+				return await func(self, user, *args, **kwargs)
+
+		return await func(self, user, *args, **kwargs)
+
+	return wrapper
+
+
+def replica_fill(func: Callable) -> Callable :
+	"""
+	decorates an async method whose result is cached for longer than the write window. its reads go to the replica when
+	it's usable, and reads made after a change is announced go to the primary until the window passes, see fence. a read
+	already running when a change is announced may have missed it, so it's made again on the primary rather than being
+	cached in its stale form. the method's class must have a _replica attribute, see Scoring.
+	"""
+	@wraps(func)
+	async def wrapper(self: Any, *args: Any, **kwargs: Any) -> Any :
+		replica: Optional[Replica] = self._replica
+		start: float = time()
+		data: Any = await func(self, *args, **kwargs)
+
+		if replica and not _primary.get() and replica.fenced_since(start) :
+			with primary() :
+				return await func(self, *args, **kwargs)
+
+		return data
+
+	# the caching decorators build their keys from the decorated method's arguments
+	wrapper.__signature__ = signature(func)
+	return wrapper
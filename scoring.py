@@ -1,11 +1,14 @@
-from asyncio import ensure_future
+from asyncio import CancelledError, ensure_future, sleep
 from math import log10, sqrt
-from typing import Optional, Union
+from typing import Any, List, Optional, Tuple, Union
 
 from kh_common.auth import KhUser
+from kh_common.config import credentials
 from kh_common.config.constants import epoch
 from kh_common.exceptions.http_error import BadRequest
-from scipy.stats import norm
+from kh_common.sql.query import Query
+from replica import Replica, primary
+from velocity import VoteVelocity
 
 from fuzzly.models._database import DBI, ScoreCache, VoteCache
 from fuzzly.models.internal import InternalScore
@@ -22,8 +25,13 @@ resources:
 """
 
 
-# this is the z-score of 0.8, z is calulated via: norm.ppf(1-(1-0.8)/2)
-z_score_08 = norm.ppf(0.9)
+# feeds the rising sort, every upvote cast through this process is counted
+rising: VoteVelocity = VoteVelocity()
+
+
+# this is the z-score of 0.8, z is calulated via: scipy.stats.norm.ppf(1-(1-0.8)/2)
+# precomputed, since importing scipy.stats just to calculate it dominated the service's startup time
+z_score_08 = 1.2815515655446004
 
 
 def _sign(x: Union[int, float]) -> int :
@@ -60,13 +68,130 @@ def best(up: int, total: int) -> float :
 
 class Scoring(DBI) :
 
+	# when non-zero, votes are counted in this many counter rows per post rather than directly in post_scores, so that concurrent
+	# votes on a single post don't all wait on the same row lock. sharded counts are folded back into post_scores by foldScores.
+	# requires the table:
+	#	CREATE TABLE kheina.public.post_score_shards (
+	#		post_id BIGINT NOT NULL REFERENCES kheina.public.posts (post_id),
+	#		shard SMALLINT NOT NULL,
+	#		upvotes INTEGER NOT NULL DEFAULT 0,
+	#		downvotes INTEGER NOT NULL DEFAULT 0,
+	#		CONSTRAINT post_score_shards_pkey PRIMARY KEY (post_id, shard)
+	#	);
+	ScoreShards: int = 0
+	FoldInterval: float = 30
+	FoldBatchSize: int = 1000
+
+	# created when db_replica credentials are configured, see replica.py
+	_replica: Optional[Replica] = None
+
+	def __init__(self, *args: Any, **kwargs: Any) -> None :
+		DBI.__init__(self, *args, **kwargs)
+		config: Optional[dict] = getattr(credentials, 'db_replica', None)
+
+		if config :
+			self._replica = Replica(config)
+
+
+	async def query_async(self, sql: Union[str, Query], params: Tuple[Any, ...] = (), commit: bool = False, fetch_one: bool = False, fetch_all: bool = False, maxretry: int = 2) -> Optional[List[Any]] :
+		# queries that aren't committed can't write anything, so they're all safe to send to the replica
+		if commit or not self._replica or not self._replica.usable() :
+			return await DBI.query_async(self, sql, params, commit=commit, fetch_one=fetch_one, fetch_all=fetch_all, maxretry=maxretry)
+
+		if isinstance(sql, Query) :
+			sql, params = sql.build()
+
+		try :
+			return await self._replica.query_async(sql, tuple(map(self._convert_item, params)), fetch_one, fetch_all)
+
+		except Exception as e :
+			self.logger.warning('replica query failed, retrying on the primary.', exc_info=e)
+			self._replica.failed()
+			return await DBI.query_async(self, sql, params, fetch_one=fetch_one, fetch_all=fetch_all, maxretry=maxretry)
+
+
+	async def monitorReplica(self) -> None :
+		"""
+		measures the replica's lag every Replica.LagInterval seconds
+		"""
+		while True :
+			try :
+				data = await DBI.query_async(self, """
+					SELECT pg_wal_lsn_diff(pg_current_wal_lsn(), '0/0');
+					""",
+					fetch_one=True,
+				)
+				replayed = await self._replica.query_async("""
+					SELECT pg_wal_lsn_diff(pg_last_wal_replay_lsn(), '0/0');
+					""",
+					fetch_one=True,
+				)
+				self._replica.sample(data[0], replayed[0])
+
+			except CancelledError :
+				raise
+
+			except Exception as e :
+				self.logger.warning('failed to measure replica lag.', exc_info=e)
+				self._replica.failed()
+
+			await sleep(Replica.LagInterval)
+
+
+	def close(self) -> int :
+		if self._replica :
+			self._replica.close()
+
+		return DBI.close(self)
+
+
 	def _validateVote(self, vote: Optional[bool]) -> None :
 		if not isinstance(vote, (bool, type(None))) :
 			raise BadRequest('the given vote is invalid (vote value must be integer. 1 = up, -1 = down, 0 or null to remove vote)')
 
 
+	def _scores(self, up: int, total: int, created: float) -> Tuple[int, int, int, float, float, float] :
+		"""
+		returns the post_scores columns for the given counts: upvotes, downvotes, top, hot, best, controversial
+		"""
+		down: int = total - up
+		return up, down, up - down, hot(up, down, created), confidence(up, total), controversial(up, down)
+
+
 	async def _vote(self, user: KhUser, post_id: PostId, upvote: Optional[bool]) -> Score :
 		self._validateVote(upvote)
+
+		if Scoring.ScoreShards :
+			up, total = await self._vote_sharded(user, post_id, upvote)
+
+		else :
+			up, total = await self._vote_direct(user, post_id, upvote)
+
+		if self._replica :
+			await self._replica.wrote(user.user_id)
+
+		if upvote :
+			rising.record(post_id.int())
+
+		score: InternalScore = InternalScore(
+			up = up,
+			down = total - up,
+			total = total,
+		)
+		ensure_future(ScoreCache.put_async(post_id, score))
+
+		user_vote = 0 if upvote is None else (1 if upvote else -1)
+		ensure_future(VoteCache.put_async(f'{user.user_id}|{post_id}', user_vote))
+
+		return Score(
+			up = score.up,
+			down = score.down,
+			total = score.total,
+			user_vote = user_vote,
+		)
+
+
+	async def _vote_direct(self, user: KhUser, post_id: PostId, upvote: Optional[bool]) -> Tuple[int, int] :
 		with self.transaction() as transaction :
 			data = await transaction.query_async("""
 				INSERT INTO kheina.public.post_votes
@@ -97,13 +222,7 @@ class Scoring(DBI) :
 
 			up: int = data[1] or 0
 			total: int = data[0] or 0
-			down: int = total - up
-			created: float = data[2].timestamp()
-
-			top: int = up - down
-			h: float = hot(up, down, created)
-			best: float = confidence(up, total)
-			cont: float = controversial(up, down)
+			scores: Tuple[int, int, int, float, float, float] = self._scores(up, total, data[2].timestamp())
 
 			await transaction.query_async("""
 				INSERT INTO kheina.public.post_scores
@@ -121,26 +240,169 @@ class Scoring(DBI) :
 					WHERE post_scores.post_id = %s;
 				""",
 				(
-					post_id.int(), up, down, top, h, best, cont,
-					up, down, top, h, best, cont, post_id.int(),
+					post_id.int(), *scores,
+					*scores, post_id.int(),
 				),
 			)
 
 			transaction.commit()
 
-		score: InternalScore = InternalScore(
-			up = up,
-			down = down,
-			total = total,
-		)
-		ensure_future(ScoreCache.put_async(post_id, score))
+		return up, total
 
-		user_vote = 0 if upvote is None else (1 if upvote else -1)
-		ensure_future(VoteCache.put_async(f'{user.user_id}|{post_id}', user_vote))
 
-		return Score(
-			up = score.up,
-			down = score.down,
-			total = score.total,
-			user_vote = user_vote,
-		)
+	async def _vote_sharded(self, user: KhUser, post_id: PostId, upvote: Optional[bool]) -> Tuple[int, int] :
+		with self.transaction() as transaction :
+			# the previous vote is locked first, so that the change applied to the counters is exact
+			data = await transaction.query_async("""
+				WITH previous AS (
+					SELECT post_votes.upvote
+					FROM kheina.public.post_votes
+					WHERE post_votes.user_id = %s
+						AND post_votes.post_id = %s
+					FOR UPDATE
+				), vote AS (
+					INSERT INTO kheina.public.post_votes
+					(user_id, post_id, upvote)
+					VALUES
+					(%s, %s, %s)
+					ON CONFLICT ON CONSTRAINT post_votes_pkey DO 
+						UPDATE SET
+							upvote = %s
+					RETURNING post_votes.upvote
+				)
+				SELECT (SELECT previous.upvote FROM previous)
+				FROM vote;
+				""",
+				(
+					user.user_id, post_id.int(),
+					user.user_id, post_id.int(), upvote,
+					upvote,
+				),
+				fetch_one=True,
+			)
+
+			previous: Optional[bool] = data[0] if data else None
+			up: int = (upvote is True) - (previous is True)
+			down: int = (upvote is False) - (previous is False)
+
+			if up or down :
+				await transaction.query_async("""
+					INSERT INTO kheina.public.post_score_shards
+					(post_id, shard, upvotes, downvotes)
+					VALUES
+					(%s, %s, %s, %s)
+					ON CONFLICT ON CONSTRAINT post_score_shards_pkey DO
+						UPDATE SET
+							upvotes = post_score_shards.upvotes + excluded.upvotes,
+							downvotes = post_score_shards.downvotes + excluded.downvotes;
+					""",
+					(post_id.int(), user.user_id % Scoring.ScoreShards, up, down),
+				)
+
+			transaction.commit()
+
+		# summed outside of the transaction, so no locks are held while reading. the sum has to include this vote, so it's read from the primary
+		with primary() :
+			data = await self.query_async("""
+				SELECT
+					COALESCE(post_scores.upvotes, 0) + COALESCE(shards.upvotes, 0),
+					COALESCE(post_scores.downvotes, 0) + COALESCE(shards.downvotes, 0)
+				FROM kheina.public.posts
+					LEFT JOIN kheina.public.post_scores
+						ON post_scores.post_id = posts.post_id
+					LEFT JOIN (
+						SELECT SUM(post_score_shards.upvotes) AS upvotes, SUM(post_score_shards.downvotes) AS downvotes
+						FROM kheina.public.post_score_shards
+						WHERE post_score_shards.post_id = %s
+					) AS shards
+						ON true
+				WHERE posts.post_id = %s;
+				""",
+				(post_id.int(), post_id.int()),
+				fetch_one=True,
+			)
+
+		up: int = data[0] if data else 0
+		down: int = data[1] if data else 0
+		return up, up + down
+
+
+	async def foldScores(self) -> int :
+		"""
+		folds sharded vote counters back into post_scores, recalculating each folded post's scores from the new totals.
+		returns the number of posts folded.
+		"""
+		with self.transaction() as transaction :
+			# the deleted shards are summed rather than recounting post_votes, since votes committed after this statement's
+			# snapshot can still have updated the shards it deletes. rows are deleted in their latest version, so every
+			# increment is either folded here or left in a shard for the next fold.
+			data = await transaction.query_async("""
+				WITH folded AS (
+					DELETE FROM kheina.public.post_score_shards
+					WHERE post_score_shards.post_id IN (
+						SELECT DISTINCT post_score_shards.post_id
+						FROM kheina.public.post_score_shards
+						LIMIT %s
+					)
+					RETURNING post_score_shards.post_id, post_score_shards.upvotes, post_score_shards.downvotes
+				)
+				SELECT folded.post_id, SUM(folded.upvotes), SUM(folded.downvotes), posts.created_on
+				FROM folded
+					INNER JOIN kheina.public.posts
+						ON posts.post_id = folded.post_id
+				GROUP BY folded.post_id, posts.created_on;
+				""",
+				(Scoring.FoldBatchSize,),
+				fetch_all=True,
+			)
+
+			for post_id, up, down, created in data :
+				# the counters are added to in place, which locks the row until commit, so folds running concurrently
+				# in other workers can't overwrite each other's totals
+				totals = await transaction.query_async("""
+					INSERT INTO kheina.public.post_scores
+					(post_id, upvotes, downvotes, top, hot, best, controversial)
+					VALUES
+					(%s, %s, %s, 0, 0, 0, 0)
+					ON CONFLICT ON CONSTRAINT post_scores_pkey DO
+						UPDATE SET
+							upvotes = post_scores.upvotes + excluded.upvotes,
+							downvotes = post_scores.downvotes + excluded.downvotes
+						WHERE post_scores.post_id = %s
+					RETURNING post_scores.upvotes, post_scores.downvotes;
+					""",
+					(post_id, up, down, post_id),
+					fetch_one=True,
+				)
+
+				scores: Tuple[int, int, int, float, float, float] = self._scores(totals[0], totals[0] + totals[1], created.timestamp())
+
+				await transaction.query_async("""
+					UPDATE kheina.public.post_scores
+						SET top = %s,
+							hot = %s,
+							best = %s,
+							controversial = %s
+					WHERE post_scores.post_id = %s;
+					""",
+					(*scores[2:], post_id),
+				)
+
+			transaction.commit()
+
+		return len(data)
+
+
+	async def foldScoresForever(self) -> None :
+		while True :
+			try :
+				# keep folding while there's a backlog, otherwise wait for more votes to accumulate
+				if await self.foldScores() < Scoring.FoldBatchSize :
+					await sleep(Scoring.FoldInterval)
+
+			except CancelledError :
+				raise
+
+			except Exception as e :
+				self.logger.warning('failed to fold sharded post scores.', exc_info=e)
+				await sleep(Scoring.FoldInterval)
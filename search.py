@@ -0,0 +1,138 @@
+from enum import Enum, unique
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple, Union
+
+from kh_common.exceptions.http_error import BadRequest
+
+from fuzzly.models.post import PostSort, Rating
+from fuzzly.models.set import SetId
+
+
+@unique
+class VelocitySort(Enum) :
+	"""
+	sorts served from the in-memory vote counters, rather than from post_scores
+	"""
+	rising: str = 'rising'
+
+
+SearchSort = Union[PostSort, VelocitySort]
+Sorts: Dict[str, SearchSort] = { **PostSort.__members__, **VelocitySort.__members__ }
+
+def normalize_tag(tag: str) -> str :
+	if tag.startswith('set:') or tag.startswith('-set:') :
+		return tag
+
+	return tag.lower()
+
+
+class SearchQuery(NamedTuple) :
+	"""
+	canonical form of a tag search. equivalent searches (duplicate tags, sort: tags vs the sort field,
+	differences in casing or ordering) always produce the same SearchQuery, so it can be used directly as a cache key.
+	"""
+
+	sort: SearchSort
+	include_tags: Tuple[str, ...] = ()
+	exclude_tags: Tuple[str, ...] = ()
+	include_users: Tuple[str, ...] = ()
+	exclude_users: Tuple[str, ...] = ()
+	include_rating: Tuple[str, ...] = ()
+	exclude_rating: Tuple[str, ...] = ()
+	include_sets: Tuple[SetId, ...] = ()
+	exclude_sets: Tuple[SetId, ...] = ()
+
+
+	@staticmethod
+	def parse(sort: SearchSort, tags: Optional[Iterable[str]]) -> 'SearchQuery' :
+		include_tags: List[str] = []
+		exclude_tags: List[str] = []
+
+		include_users: List[str] = []
+		exclude_users: List[str] = []
+
+		include_rating: List[str] = []
+		exclude_rating: List[str] = []
+
+		include_sets: List[SetId] = []
+		exclude_sets: List[SetId] = []
+
+		for tag in filter(None, map(str.strip, filter(None, tags or []))) :
+			tag = normalize_tag(tag)
+			exclude = tag.startswith('-')
+
+			if exclude :
+				tag = tag[1:]
+
+			if tag.startswith('@') :
+				tag = tag[1:]
+				(exclude_users if exclude else include_users).append(tag)
+				continue
+
+			if tag in Rating.__members__ :
+				(exclude_rating if exclude else include_rating).append(tag)
+				continue
+
+			if tag.startswith('set:') :
+				(exclude_sets if exclude else include_sets).append(SetId(tag[4:]))
+				continue
+
+			if tag.startswith('sort:') :
+				if tag[5:] not in Sorts :
+					raise BadRequest(f'{tag[5:]} is not a valid sort method. valid methods: {list(Sorts.keys())}')
+
+				sort = Sorts[tag[5:]]
+
+				continue
+
+			(exclude_tags if exclude else include_tags).append(tag)
+
+		query: SearchQuery = SearchQuery(
+			sort=sort,
+			include_tags=tuple(sorted(set(include_tags))),
+			exclude_tags=tuple(sorted(set(exclude_tags))),
+			include_users=tuple(sorted(set(include_users))),
+			exclude_users=tuple(sorted(set(exclude_users))),
+			include_rating=tuple(sorted(set(include_rating))),
+			exclude_rating=tuple(sorted(set(exclude_rating))),
+			include_sets=tuple(sorted(set(include_sets))),
+			exclude_sets=tuple(sorted(set(exclude_sets))),
+		)
+
+		if len(query.include_users) > 1 :
+			raise BadRequest('can only search for posts from, at most, one user at a time.')
+
+		if len(query.include_rating) > 1 :
+			raise BadRequest('can only search for posts from, at most, one rating at a time.')
+
+		return query
+
+
+	def filters(self: 'SearchQuery') -> Tuple[str, ...] :
+		"""
+		returns every positive filter in its tag form. a post must match all of them to appear in the results.
+		"""
+		return (
+			self.include_tags +
+			tuple(map(lambda x : '@' + x, self.include_users)) +
+			self.include_rating +
+			tuple(map(lambda x : 'set:' + x, self.include_sets))
+		)
+
+
+	def tags(self: 'SearchQuery') -> Tuple[str, ...] :
+		"""
+		returns the canonical tag form of every filter in the query, excluding sort.
+		"""
+		return self.filters() + tuple(map(lambda x : '-' + x, (
+			self.exclude_tags +
+			tuple(map(lambda x : '@' + x, self.exclude_users)) +
+			self.exclude_rating +
+			tuple(map(lambda x : 'set:' + x, self.exclude_sets))
+		)))
+
+
+	def single_set(self: 'SearchQuery') -> bool :
+		"""
+		true when the query is nothing more than browsing a single set
+		"""
+		return len(self.include_sets) == 1 and len(self.tags()) == 1
@@ -0,0 +1,241 @@
+from enum import Enum, unique
+from typing import Dict, List, Optional
+
+from kh_common.sql.query import Field, Join, JoinType, Operator, Order, Query, Table, Value, Where
+from search import SearchQuery
+
+from fuzzly.models.post import PostSort
+
+
+"""
+builds the sql for tag searches. every filter is applied to posts directly, so the outer query always returns exactly
+one row per post and never needs to be grouped:
+	included tags and sets are semijoins (EXISTS), one per tag or set
+	excluded tags and sets are anti-joins (NOT EXISTS)
+	users are resolved to uploader ids before the query is built, so users is never joined
+	browsing a single set is the only shape that joins set_post, since it's ordered by set_post.index
+"""
+
+
+@unique
+class Subquery(Enum) :
+	"""
+	operators for Where that test a correlated subquery. only the subquery is rendered, the field on the left hand side
+	just names the column it's correlated on.
+	"""
+	exists: str = 'EXISTS {1}'
+	not_exists: str = 'NOT EXISTS {1}'
+
+
+def _tag_posts(tags: List[str]) -> Query :
+	# tag_post rows of the current post carrying any of the given tags
+	return Query(
+		Table('kheina.public.tag_post')
+	).select(
+		Field('tag_post', 'post_id'),
+	).join(
+		Join(
+			JoinType.inner,
+			Table('kheina.public.tags'),
+		).where(
+			Where(
+				Field('tags', 'tag_id'),
+				Operator.equal,
+				Field('tag_post', 'tag_id'),
+			),
+		),
+	).where(
+		Where(
+			Field('tag_post', 'post_id'),
+			Operator.equal,
+			Field('posts', 'post_id'),
+		),
+		Where(
+			Field('tags', 'tag'),
+			Operator.equal,
+			Value(tags, 'any'),
+		),
+	)
+
+
+def _set_posts(set_ids: List[int]) -> Query :
+	# set_post rows of the current post in any of the given sets
+	return Query(
+		Table('kheina.public.set_post')
+	).select(
+		Field('set_post', 'post_id'),
+	).where(
+		Where(
+			Field('set_post', 'post_id'),
+			Operator.equal,
+			Field('posts', 'post_id'),
+		),
+		Where(
+			Field('set_post', 'set_id'),
+			Operator.equal,
+			Value(set_ids, 'any'),
+		),
+	)
+
+
+def search_filter(search: SearchQuery, ratings: Dict[str, int], uploaders: Dict[str, int]) -> Optional[Query] :
+	"""
+	builds the query for every public post matching the search's filters, without any sorting or paging.
+	uploaders maps the search's user handles to user ids, handles missing from it don't exist.
+	returns None when nothing can match the search.
+	"""
+	query: Query = Query(
+		Table('kheina.public.posts')
+	).where(
+		Where(
+			Field('posts', 'privacy_id'),
+			Operator.equal,
+			"privacy_to_id('public')",
+		),
+	)
+
+	for tag in search.include_tags :
+		query.where(
+			Where(
+				Field('posts', 'post_id'),
+				Subquery.exists,
+				_tag_posts([tag]).where(
+					Where(
+						Field('tags', 'deprecated'),
+						Operator.equal,
+						False,
+					),
+				),
+			),
+		)
+
+	if search.exclude_tags :
+		query.where(
+			Where(
+				Field('posts', 'post_id'),
+				Subquery.not_exists,
+				_tag_posts(list(search.exclude_tags)),
+			),
+		)
+
+	if search.include_users :
+		if search.include_users[0] not in uploaders :
+			return None
+
+		query.where(
+			Where(
+				Field('posts', 'uploader'),
+				Operator.equal,
+				Value(uploaders[search.include_users[0]]),
+			),
+		)
+
+	excluded_uploaders: List[int] = [uploaders[handle] for handle in search.exclude_users if handle in uploaders]
+
+	if excluded_uploaders :
+		query.where(
+			Where(
+				Field('posts', 'uploader'),
+				Operator.not_equal,
+				Value(excluded_uploaders, 'all'),
+			),
+		)
+
+	if search.include_rating :
+		query.where(
+			Where(
+				Field('posts', 'rating'),
+				Operator.equal,
+				Value(ratings[search.include_rating[0]]),
+			),
+		)
+
+	if search.exclude_rating :
+		query.where(
+			Where(
+				Field('posts', 'rating'),
+				Operator.not_equal,
+				Value(list(map(ratings.__getitem__, search.exclude_rating)), 'all'),
+			),
+		)
+
+	if search.single_set() :
+		query.join(
+			Join(
+				JoinType.inner,
+				Table('kheina.public.set_post'),
+			).where(
+				Where(
+					Field('set_post', 'post_id'),
+					Operator.equal,
+					Field('posts', 'post_id'),
+				),
+				Where(
+					Field('set_post', 'set_id'),
+					Operator.equal,
+					Value(int(search.include_sets[0])),
+				),
+			),
+		)
+
+	else :
+		for set_id in search.include_sets :
+			query.where(
+				Where(
+					Field('posts', 'post_id'),
+					Subquery.exists,
+					_set_posts([int(set_id)]),
+				),
+			)
+
+	if search.exclude_sets :
+		query.where(
+			Where(
+				Field('posts', 'post_id'),
+				Subquery.not_exists,
+				_set_posts(list(map(int, search.exclude_sets))),
+			),
+		)
+
+	return query
+
+
+def search_order(query: Query, search: SearchQuery) -> Query :
+	"""
+	orders a query built by search_filter by the search's sort
+	"""
+	sort: PostSort = search.sort
+
+	if sort in { PostSort.new, PostSort.old } :
+
+		if search.single_set() :
+			# this is a very special case, we want to hijack the new/old sorts to instead sort by set index.
+			# there's really no reason anyone would want to sort by post age for a single set
+			return query.order(
+				Field('set_post', 'index'),
+				Order.descending_nulls_first if sort == PostSort.new else Order.ascending_nulls_last,
+			)
+
+		return query.order(
+			Field('posts', 'created_on'),
+			Order.descending_nulls_first if sort == PostSort.new else Order.ascending_nulls_last,
+		)
+
+	return query.order(
+		Field('post_scores', sort.name),
+		Order.descending_nulls_first,
+	).order(
+		Field('posts', 'created_on'),
+		Order.descending_nulls_first,
+	).join(
+		Join(
+			JoinType.inner,
+			Table('kheina.public.post_scores'),
+		).where(
+			Where(
+				Field('post_scores', 'post_id'),
+				Operator.equal,
+				Field('posts', 'post_id'),
+			),
+		),
+	)
@@ -0,0 +1,59 @@
+from gzip import decompress
+from typing import Any, NamedTuple, Tuple
+
+from fastapi.responses import Response
+from orjson import dumps
+from pydantic import BaseModel
+
+from fuzzly.models.post import PostId
+
+
+CompressionLevel: int = 6
+
+
+def _default(obj: Any) -> Any :
+	# pydantic models keep their validated field values in __dict__, so no copy or re-validation is required
+	if isinstance(obj, BaseModel) :
+		return obj.__dict__
+
+	raise TypeError
+
+
+def serialize(content: Any) -> bytes :
+	return dumps(content, default=_default)
+
+
+class ListingResponse(Response) :
+	"""
+	serializes already validated models, or lists of them, directly to json bytes.
+	skips the response model validation and jsonable_encoder pass fastapi performs for returned objects.
+	"""
+
+	media_type: str = 'application/json'
+
+	def render(self: 'ListingResponse', content: Any) -> bytes :
+		return serialize(content)
+
+
+class RenderedPage(NamedTuple) :
+	"""
+	a fully rendered, gzipped response body along with the posts it contains, so that it can be invalidated
+	"""
+
+	post_ids: Tuple[PostId, ...]
+	body: bytes
+
+
+def rendered_response(page: RenderedPage, accept_encoding: str) -> Response :
+	if 'gzip' in accept_encoding :
+		return Response(
+			page.body,
+			media_type='application/json',
+			headers={ 'content-encoding': 'gzip', 'vary': 'accept-encoding' },
+		)
+
+	return Response(
+		decompress(page.body),
+		media_type='application/json',
+		headers={ 'vary': 'accept-encoding' },
+	)
@@ -1,19 +1,31 @@
-from asyncio import ensure_future
+from asyncio import AbstractEventLoop, Task, ensure_future, gather, get_event_loop
 from html import escape
-from typing import List
+from typing import Dict, List, Optional
 from urllib.parse import quote
 
+from admission import AdmissionMiddleware, controller
+from fastapi.responses import StreamingResponse
+from invalidation import InvalidationListener, event_source
 from kh_common.backblaze import B2Interface
+from kh_common.caching.key_value_store import KeyValueStore
 from kh_common.config.constants import environment, users_host
+from kh_common.datetime import datetime
 from kh_common.gateway import Gateway
 from kh_common.models.auth import Scope
 from kh_common.models.user import User
-from kh_common.server import Request, Response, ServerApp
-from models import BaseFetchRequest, FetchCommentsRequest, FetchPostsRequest, GetUserPostsRequest, RssDateFormat, RssDescription, RssFeed, RssItem, RssMedia, RssTitle, SearchResults, TimelineRequest, VoteRequest
+from kh_common.server import NoContentResponse, Request, Response, ServerApp
+from kh_common.server.middleware.cors import KhCorsMiddleware
+from kh_common.sql import SqlInterface, Transaction
+from models import BaseFetchRequest, FetchCommentsRequest, FetchPostsRequest, GetUserPostsRequest, InvalidationEvent, InvalidationEventType, InvalidationRequest, PostScore, PostVote, RssDateFormat, RssDescription, RssFeed, RssItem, RssMedia, RssTitle, ScoresRequest, SearchResults, TimelineCount, TimelineRequest, TimelineSinceRequest, TrendingTags, VoteRequest, VotesRequest
 
+from fuzzly.internal import InternalClient
+from fuzzly.models._database import InternalScore
 from fuzzly.models.internal import InternalPost
 from fuzzly.models.post import Post, PostId, Score
-from posts import Posts
+from posts import Posts, hot_queries
+from profiling import ProfilerMiddleware, instrument
+from replica import Replica
+from serialization import ListingResponse, RenderedPage, rendered_response
 
 
 app = ServerApp(
@@ -35,13 +47,79 @@ app = ServerApp(
 		'fuzz.ly',
 	],
 )
-b2 = B2Interface()
-posts = Posts()
-UsersService = Gateway(users_host + '/v1/fetch_self', User)
+app.add_middleware(ProfilerMiddleware)
+# added last so that it's the outermost middleware, and sheds requests before any other work is done.
+# it's outside of cors as well, so it's given the app's cors options to add cors headers to its own responses
+app.add_middleware(AdmissionMiddleware, cors=next(m.options for m in app.user_middleware if m.cls is KhCorsMiddleware))
+
+instrument(SqlInterface, 'db', ['query_async'])
+instrument(Replica, 'db', ['query_async'])
+instrument(Transaction, 'db', ['query_async'])
+instrument(KeyValueStore, 'cache', ['get_async', 'get_many_async', 'put_async', 'remove_async'])
+instrument(InternalClient, 'client')
+
+# clients are created in the startup hook, so that importing the server stays fast
+b2: Optional[B2Interface] = None
+posts: Optional[Posts] = None
+UsersService: Optional[Gateway] = None
+listener: Optional[InvalidationListener] = None
+fold: Optional[Task] = None
+related: Optional[Task] = None
+known: Optional[Task] = None
+posted: Optional[Task] = None
+replica_monitor: Optional[Task] = None
+
+
+@app.on_event('startup')
+async def startup() :
+	global b2, posts, UsersService, listener, fold, related, known, posted, replica_monitor
+
+	# both connect to their services on construction, so they're created concurrently and off of the event loop
+	loop: AbstractEventLoop = get_event_loop()
+	b2, posts = await gather(loop.run_in_executor(None, B2Interface), loop.run_in_executor(None, Posts))
+	UsersService = Gateway(users_host + '/v1/fetch_self', User)
+	ensure_future(posts.warm())
+	related = ensure_future(posts.buildRelatedIndex())
+	known = ensure_future(posts.trackKnownPosts())
+	posted = ensure_future(posts.trackPostedTags())
+
+	source = event_source()
+
+	if source :
+		listener = InvalidationListener(posts.invalidate, source, posts.eventsMissed)
+		listener.start()
+
+	hot_queries.start(posts.precompute)
+
+	if Posts.ScoreShards :
+		fold = ensure_future(posts.foldScoresForever())
+
+	if posts._replica :
+		replica_monitor = ensure_future(posts.monitorReplica())
 
 
 @app.on_event('shutdown')
 async def shutdown() :
+	if listener :
+		listener.stop()
+
+	hot_queries.stop()
+
+	if fold :
+		fold.cancel()
+
+	if related :
+		related.cancel()
+
+	if known :
+		known.cancel()
+
+	if posted :
+		posted.cancel()
+
+	if replica_monitor :
+		replica_monitor.cancel()
+
 	posts.close()
 
 
@@ -58,20 +136,60 @@ async def i1User(req: Request, user_id: int, body: BaseFetchRequest) -> List[Int
 	return await posts._fetch_own_posts(user_id, body.sort, body.count, body.page)
 
 
-@app.get('/i1/score/{post_id}', response_model=InternalPost)
-async def i1Score(req: Request, post_id: PostId, ) -> InternalPost :
+@app.get('/i1/score/{post_id}', response_model=Optional[InternalScore])
+async def i1Score(req: Request, post_id: PostId) -> Optional[InternalScore] :
 	await req.user.verify_scope(Scope.internal)
-	# TODO: this needs to be replaced with a model and updated above
 	return await posts._get_score(PostId(post_id))
 
 
-@app.get('/i1/vote/{post_id}/{user_id}', response_model=InternalPost)
-async def i1Vote(req: Request, post_id: PostId, user_id: int) -> InternalPost :
+@app.post('/i1/scores', response_model=List[PostScore])
+async def i1Scores(req: Request, body: ScoresRequest) -> List[PostScore] :
+	await req.user.verify_scope(Scope.internal)
+	return await posts.scoresBatch(body.post_ids)
+
+
+@app.get('/i1/vote/{post_id}/{user_id}', response_model=int)
+async def i1Vote(req: Request, post_id: PostId, user_id: int) -> int :
 	await req.user.verify_scope(Scope.internal)
-	# TODO: this needs to be replaced with a model and updated above
 	return await posts._get_vote(user_id, PostId(post_id))
 
 
+@app.post('/i1/votes', response_model=List[PostVote])
+async def i1Votes(req: Request, body: VotesRequest) -> List[PostVote] :
+	await req.user.verify_scope(Scope.internal)
+	return await posts.votesBatch(body.user_id, body.post_ids)
+
+
+@app.get('/i1/export')
+async def i1Export(req: Request, after: Optional[PostId] = None) -> StreamingResponse :
+	await req.user.verify_scope(Scope.internal)
+	# pass the last post id received as after to resume an interrupted export
+	return StreamingResponse(
+		posts.export(PostId(after) if after else None),
+		media_type='application/x-ndjson',
+	)
+
+
+@app.get('/i1/admission', response_model=Dict[str, Dict[str, int]])
+async def i1Admission(req: Request) -> Dict[str, Dict[str, int]] :
+	await req.user.verify_scope(Scope.internal)
+	return controller.stats()
+
+
+@app.post('/i1/invalidate', status_code=204)
+async def i1Invalidate(req: Request, body: InvalidationRequest) -> Response :
+	await req.user.verify_scope(Scope.internal)
+
+	if listener :
+		# every process, including this one, receives the events through the listener
+		await listener.publish(body.events)
+
+	else :
+		await posts.invalidate(body.events)
+
+	return NoContentResponse
+
+
 ##################################################  PUBLIC  ##################################################
 @app.get('/v1/post/{post_id}', responses={ 200: { 'model': Post } })
 async def v1Post(req: Request, post_id: PostId) -> Post :
@@ -79,50 +197,83 @@ async def v1Post(req: Request, post_id: PostId) -> Post :
 	return await posts.getPost(req.user, PostId(post_id))
 
 
+@app.get('/v1/post/{post_id}/related', responses={ 200: { 'model': List[Post] } })
+async def v1RelatedPosts(req: Request, post_id: PostId, count: int = 16) -> ListingResponse :
+	return ListingResponse(await posts.relatedPosts(req.user, PostId(post_id), count))
+
+
 @app.post('/v1/vote', responses={ 200: { 'model': Score } })
 async def v1Vote(req: Request, body: VoteRequest) -> Score :
 	await req.user.authenticated(Scope.user)
 	vote = True if body.vote > 0 else False if body.vote < 0 else None
-	return await posts.vote(req.user, body.post_id, vote)
+	score: Score = await posts.vote(req.user, body.post_id, vote)
+
+	if listener :
+		# every worker's rendered pages, and local copies of the score, are evicted without waiting on the publish
+		listener.announce([InvalidationEvent(event=InvalidationEventType.vote, post_id=body.post_id, user_id=req.user.user_id)])
+
+	return score
 
 
 @app.post('/v1/fetch_posts', responses={ 200: { 'model': SearchResults } })
 @app.post('/v1/posts', responses={ 200: { 'model': SearchResults } })
-async def v1FetchPosts(req: Request, body: FetchPostsRequest) -> SearchResults :
-	return await posts.fetchPosts(req.user, body.sort, body.tags, body.count, body.page)
+async def v1FetchPosts(req: Request, body: FetchPostsRequest) -> Response :
+	if not req.user.token :
+		# anonymous users all receive the same page, so the fully rendered response can be cached
+		page: RenderedPage = await posts.fetchPostsRendered(req.user, body.sort, body.tags, body.count, body.page, body.cursor)
+		return rendered_response(page, req.headers.get('accept-encoding', ''))
+
+	return ListingResponse(await posts.fetchPosts(req.user, body.sort, body.tags, body.count, body.page, body.cursor))
 
 
 @app.post('/v1/fetch_comments', responses={ 200: { 'model': List[Post] } })
 @app.post('/v1/comments', responses={ 200: { 'model': List[Post] } })
-async def v1FetchComments(req: Request, body: FetchCommentsRequest) -> List[Post] :
-	return await posts.fetchComments(req.user, body.post_id, body.sort, body.count, body.page)
+async def v1FetchComments(req: Request, body: FetchCommentsRequest) -> ListingResponse :
+	return ListingResponse(await posts.fetchComments(req.user, body.post_id, body.sort, body.count, body.page))
 
 
 @app.post('/v1/fetch_user_posts', responses={ 200: { 'model': List[Post] } })
 @app.post('/v1/user_posts', responses={ 200: { 'model': List[Post] } })
-async def v1FetchUserPosts(req: Request, body: GetUserPostsRequest) -> SearchResults :
-	return await posts.fetchUserPosts(req.user, body.handle, body.count, body.page)
+async def v1FetchUserPosts(req: Request, body: GetUserPostsRequest) -> ListingResponse :
+	return ListingResponse(await posts.fetchUserPosts(req.user, body.handle, body.count, body.page))
 
 
 @app.post('/v1/fetch_my_posts', responses={ 200: { 'model': List[Post] } })
 @app.post('/v1/my_posts', responses={ 200: { 'model': List[Post] } })
-async def v1FetchMyPosts(req: Request, body: BaseFetchRequest) -> List[Post] :
+async def v1FetchMyPosts(req: Request, body: BaseFetchRequest) -> ListingResponse :
 	await req.user.authenticated()
-	return await posts.fetchOwnPosts(req.user, body.sort, body.count, body.page)
+	return ListingResponse(await posts.fetchOwnPosts(req.user, body.sort, body.count, body.page))
 
 
 @app.get('/v1/fetch_drafts', responses={ 200: { 'model': List[Post] } })
 @app.get('/v1/drafts', responses={ 200: { 'model': List[Post] } })
-async def v1FetchDrafts(req: Request) -> List[Post] :
+async def v1FetchDrafts(req: Request) -> ListingResponse :
 	await req.user.authenticated()
-	return await posts.fetchDrafts(req.user)
+	return ListingResponse(await posts.fetchDrafts(req.user))
 
 
 @app.post('/v1/timeline_posts', responses={ 200: { 'model': List[Post] } })
 @app.post('/v1/timeline', responses={ 200: { 'model': List[Post] } })
-async def v1TimelinePosts(req: Request, body: TimelineRequest) -> List[Post] :
+async def v1TimelinePosts(req: Request, body: TimelineRequest) -> ListingResponse :
 	await req.user.authenticated()
-	return await posts.timelinePosts(req.user, body.count, body.page)
+	return ListingResponse(await posts.timelinePosts(req.user, body.count, body.page))
+
+
+@app.post('/v1/timeline/since', responses={ 200: { 'model': List[Post] } })
+async def v1TimelineSince(req: Request, body: TimelineSinceRequest) -> ListingResponse :
+	await req.user.authenticated()
+	return ListingResponse(await posts.timelineSince(req.user, body.post_id, body.created, body.count))
+
+
+@app.post('/v1/timeline/new_count', response_model=TimelineCount)
+async def v1TimelineNewCount(req: Request, body: TimelineSinceRequest) -> TimelineCount :
+	await req.user.authenticated()
+	return await posts.timelineNewCount(req.user, body.post_id, body.created)
+
+
+@app.get('/v1/trending_tags', response_model=TrendingTags)
+async def v1TrendingTags() -> TrendingTags :
+	return posts.trendingTags()
 
 
 async def get_post_media(post: Post) -> str :
@@ -135,6 +286,28 @@ async def get_post_media(post: Post) -> str :
 	)
 
 
+def rss_feed(handle: str, retrieved: datetime, timeline: List[Post], media: Dict[PostId, str]) -> str :
+	return RssFeed.format(
+		description=f'RSS feed timeline for @{handle}',
+		pub_date=(
+			max(map(lambda post : post.updated, timeline))
+			if timeline else retrieved
+		).strftime(RssDateFormat),
+		last_build_date=retrieved.strftime(RssDateFormat),
+		items='\n'.join([
+			RssItem.format(
+				title=RssTitle.format(escape(post.title)) if post.title else '',
+				link=f'https://fuzz.ly/p/{post.post_id}' if environment.is_prod() else f'https://dev.fuzz.ly/p/{post.post_id}',
+				description=RssDescription.format(escape(post.description)) if post.description else '',
+				user=f'https://fuzz.ly/{post.user.handle}' if environment.is_prod() else f'https://dev.fuzz.ly/{post.user.handle}',
+				created=post.created.strftime(RssDateFormat),
+				media=media[post.post_id] if post.filename else '',
+				post_id=post.post_id,
+			) for post in timeline
+		]),
+	)
+
+
 @app.get('/v1/feed.rss', response_model=str)
 async def v1Rss(req: Request) -> Response :
 	await req.user.authenticated(Scope.user)
@@ -150,28 +323,11 @@ async def v1Rss(req: Request) -> Response :
 			media[post.post_id] = ensure_future(get_post_media(post))
 
 	user = await user
+	media = { post_id: await item for post_id, item in media.items() }
 
 	return Response(
 		media_type='application/xml',
-		content=RssFeed.format(
-			description=f'RSS feed timeline for @{user.handle}',
-			pub_date=(
-				max(map(lambda post : post.updated, timeline))
-				if timeline else retrieved
-			).strftime(RssDateFormat),
-			last_build_date=retrieved.strftime(RssDateFormat),
-			items='\n'.join([
-				RssItem.format(
-					title=RssTitle.format(escape(post.title)) if post.title else '',
-					link=f'https://fuzz.ly/p/{post.post_id}' if environment.is_prod() else f'https://dev.fuzz.ly/p/{post.post_id}',
-					description=RssDescription.format(escape(post.description)) if post.description else '',
-					user=f'https://fuzz.ly/{post.user.handle}' if environment.is_prod() else f'https://dev.fuzz.ly/{post.user.handle}',
-					created=post.created.strftime(RssDateFormat),
-					media=await media[post.post_id] if post.filename else '',
-					post_id=post.post_id,
-				) for post in timeline
-			]),
-		),
+		content=rss_feed(user.handle, retrieved, timeline, media),
 	)
 
 
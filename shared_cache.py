@@ -0,0 +1,337 @@
+from fcntl import LOCK_EX, LOCK_UN, lockf
+from functools import wraps
+from hashlib import blake2b
+from inspect import Parameter, signature
+from mmap import mmap
+from os import O_CREAT, O_RDWR, close, fstat, ftruncate, path
+from os import open as os_open
+from pickle import HIGHEST_PROTOCOL, dumps, loads
+from struct import Struct
+from time import time
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Optional, Tuple
+
+from kh_common.logging import Logger, getLogger
+
+
+"""
+layout of the backing file:
+	file header: magic (u64), generation (u64), padded to HeaderSize
+	dependency counters: DependencySlots u64 counters, each incremented when a dependency hashed to it is invalidated
+	slots: slot header (seq, key hash, expires, accessed, length), followed by up to slot_size bytes of pickled data
+
+slots are grouped into buckets of Ways slots, a key can only ever be stored within its own bucket.
+readers never lock, instead each slot is guarded by a sequence number (seqlock) that writers make odd while writing.
+a reader that observes an odd or changed sequence number treats the read as a miss.
+writers take an exclusive lock over the byte range of the bucket they're writing to.
+
+each value is stored along with the counters of its dependencies at the time it was computed, and is stale once any of
+them has changed. dependencies that share a counter only cause extra misses, never stale hits. the generation is
+incremented by every invalidation, so that results computed while one was made are never stored.
+
+the layout is part of the file name, so a file is never remapped with a different layout while other workers still map it.
+"""
+
+
+Magic: int = 0x6b68_7368_6d30_0002
+FileHeader: Struct = Struct('<QQ')
+HeaderSize: int = 64
+Counter: Struct = Struct('<Q')
+DependencySlots: int = 4096
+SlotHeader: Struct = Struct('<QQddI')
+SlotHeaderSize: int = 48
+Sequence: Struct = Struct('<Q')
+Accessed: Struct = Struct('<d')
+AccessedOffset: int = 24
+Ways: int = 8
+SlotsOffset: int = HeaderSize + DependencySlots * Counter.size
+
+
+def _hash(key: str) -> int :
+	# hash() is randomized per process, so it can't be shared between workers
+	return int.from_bytes(blake2b(key.encode(), digest_size=8).digest(), 'little') or 1
+
+
+def _dependency(dependency: Hashable) -> int :
+	# dependencies are tuples of strings and ints, whose reprs are the same in every worker
+	return HeaderSize + _hash(repr(dependency)) % DependencySlots * Counter.size
+
+
+class SharedMemoryCache :
+
+	Directory: str = '/dev/shm'
+	# opt-in, since every worker on the host has to agree on it, and Directory has to be memory backed (tmpfs)
+	Enabled: bool = False
+
+	def __init__(self: 'SharedMemoryCache', name: str, slots: int = 1024, slot_size: int = 65536) -> None :
+		assert slots >= Ways and slots % Ways == 0
+		self.logger: Logger = getLogger()
+		self._name: str = name
+		self._buckets: int = slots // Ways
+		self._slot_size: int = slot_size
+		self._stride: int = SlotHeaderSize + slot_size
+		self._size: int = SlotsOffset + slots * self._stride
+		self._file: str = f'fuzzly-posts-{name}-{Magic:x}-{slots}x{slot_size}'
+		self._fd: Optional[int] = None
+		self._mm: Optional[mmap] = None
+
+
+	def _open(self: 'SharedMemoryCache') -> mmap :
+		# opened lazily so that each worker maps the file after it has been forked
+		if self._mm is None :
+			fd: int = os_open(path.join(SharedMemoryCache.Directory, self._file), O_RDWR | O_CREAT, 0o600)
+			lockf(fd, LOCK_EX, HeaderSize, 0)
+
+			try :
+				if fstat(fd).st_size < self._size :
+					# the file is new, since its layout is part of its name. it's only ever grown, never shrunk, since
+					# shrinking a file that's mapped elsewhere crashes the other workers (SIGBUS) on their next access
+					ftruncate(fd, self._size)
+
+				mm: mmap = mmap(fd, self._size)
+
+				if FileHeader.unpack_from(mm, 0)[0] != Magic :
+					FileHeader.pack_into(mm, 0, Magic, 0)
+
+			finally :
+				lockf(fd, LOCK_UN, HeaderSize, 0)
+
+			self._fd = fd
+			self._mm = mm
+
+		return self._mm
+
+
+	def generation(self: 'SharedMemoryCache') -> int :
+		"""
+		returns a value that changes whenever anything is invalidated. pass it to put to discard results that may have
+		been computed from data invalidated while they were computed.
+		"""
+		return FileHeader.unpack_from(self._open(), 0)[1]
+
+
+	def _bucket(self: 'SharedMemoryCache', key_hash: int) -> int :
+		return SlotsOffset + (key_hash % self._buckets) * Ways * self._stride
+
+
+	def get(self: 'SharedMemoryCache', key: str) -> Tuple[bool, Any] :
+		"""
+		returns (True, value) if the key exists in the cache, otherwise (False, None)
+		"""
+		mm: mmap = self._open()
+		key_hash: int = _hash(key)
+		now: float = time()
+		bucket: int = self._bucket(key_hash)
+
+		for offset in range(bucket, bucket + Ways * self._stride, self._stride) :
+			seq, slot_hash, expires, _, length = SlotHeader.unpack_from(mm, offset)
+
+			if seq & 1 or slot_hash != key_hash :
+				continue
+
+			if expires < now :
+				return False, None
+
+			data: bytes = mm[offset + SlotHeaderSize : offset + SlotHeaderSize + length]
+
+			if Sequence.unpack_from(mm, offset)[0] != seq :
+				# a writer modified the slot during the read
+				return False, None
+
+			try :
+				dependencies, value = loads(data)
+
+			except Exception :
+				return False, None
+
+			for dependency, counter in dependencies :
+				if Counter.unpack_from(mm, dependency)[0] != counter :
+					return False, None
+
+			# this write is racy, but it's only used as an approximation for lru eviction
+			Accessed.pack_into(mm, offset + AccessedOffset, now)
+			return True, value
+
+		return False, None
+
+
+	def put(self: 'SharedMemoryCache', key: str, value: Any, TTL: float, dependencies: Iterable[Hashable] = (), generation: Optional[int] = None) -> bool :
+		"""
+		stores the value until TTL seconds have passed, or any of the given dependencies is invalidated.
+		returns False if the value wasn't stored, because it's too large or an invalidation was made since generation.
+		"""
+		mm: mmap = self._open()
+		counters: List[Tuple[int, int]] = [(offset, Counter.unpack_from(mm, offset)[0]) for offset in set(map(_dependency, dependencies))]
+
+		# read after the counters, so if it's unchanged the counters were read before any invalidation made since generation
+		if generation is not None and generation != self.generation() :
+			return False
+
+		data: bytes = dumps((counters, value), protocol=HIGHEST_PROTOCOL)
+
+		if len(data) > self._slot_size :
+			return False
+
+		key_hash: int = _hash(key)
+		now: float = time()
+		bucket: int = self._bucket(key_hash)
+		lockf(self._fd, LOCK_EX, Ways * self._stride, bucket)
+
+		try :
+			target: Optional[int] = None
+			oldest: float = float('inf')
+
+			for offset in range(bucket, bucket + Ways * self._stride, self._stride) :
+				_, slot_hash, expires, accessed, _ = SlotHeader.unpack_from(mm, offset)
+
+				if slot_hash == key_hash :
+					target = offset
+					break
+
+				if not slot_hash or expires < now :
+					# empty or stale slots are always reused first
+					accessed = -1
+
+				if accessed < oldest :
+					oldest = accessed
+					target = offset
+
+			seq: int = Sequence.unpack_from(mm, target)[0]
+			Sequence.pack_into(mm, target, seq + 1)
+			mm[target + SlotHeaderSize : target + SlotHeaderSize + len(data)] = data
+			SlotHeader.pack_into(mm, target, seq + 1, key_hash, now + TTL, now, len(data))
+			Sequence.pack_into(mm, target, seq + 2)
+
+		finally :
+			lockf(self._fd, LOCK_UN, Ways * self._stride, bucket)
+
+		return True
+
+
+	def invalidate(self: 'SharedMemoryCache', *dependencies: Hashable) -> None :
+		"""
+		marks every entry stored with any of the given dependencies as stale, for all workers
+		"""
+		if not SharedMemoryCache.Enabled :
+			return
+
+		mm: mmap = self._open()
+		lockf(self._fd, LOCK_EX, SlotsOffset, 0)
+
+		try :
+			for offset in set(map(_dependency, dependencies)) :
+				Counter.pack_into(mm, offset, Counter.unpack_from(mm, offset)[0] + 1)
+
+			FileHeader.pack_into(mm, 0, Magic, self.generation() + 1)
+
+		finally :
+			lockf(self._fd, LOCK_UN, SlotsOffset, 0)
+
+
+	def close(self: 'SharedMemoryCache') -> None :
+		if self._mm is not None :
+			self._mm.close()
+			close(self._fd)
+			self._mm = None
+			self._fd = None
+
+
+def SharedCache(name: str, key_format: str, TTL_seconds:float=0, TTL_minutes:float=0, TTL_hours:float=0, TTL_days:float=0, slots:int=1024, slot_size:int=65536, index:Callable[..., Iterable[Hashable]]=lambda *_ : ()) -> Callable :
+	"""
+	checks a host-wide shared memory cache before running the function, so results computed by one worker are visible to all workers.
+	key is created from function arguments, the same way as kh_common.caching.AerospikeCache.
+	results are stored under the dependency keys returned by index(*args, result), the same way as invalidation.IndexedCache,
+	so that they can be evicted from every worker before their TTL via wrapper.shared.invalidate(*keys).
+	ex:
+	@SharedCache('test', '{a}.{b}')
+	def example(a, b=1, c=2) :
+		...
+	yields a key in the format: '{a}.{b}'.format(a=a, b=b) within the shared memory cache named 'test'
+
+	NOTE: values are pickled, results too large to fit in slot_size bytes are never shared.
+	the underlying SharedMemoryCache is available as wrapper.shared, wrapper.refresh(*args) always runs the function and stores its result.
+	wrapper.store(data, *args) stores a result computed elsewhere, for example by bypassing a cache tier below this one.
+	"""
+	TTL: float = TTL_seconds + TTL_minutes * 60 + TTL_hours * 3600 + TTL_days * 86400
+	del TTL_seconds, TTL_minutes, TTL_hours, TTL_days
+
+	def decorator(func: Callable) -> Callable :
+
+		# signature is used rather than getfullargspec since it follows __wrapped__, so this can be stacked on top of other caches
+		params: List[Parameter] = [p for p in signature(func).parameters.values() if p.kind in { Parameter.POSITIONAL_ONLY, Parameter.POSITIONAL_OR_KEYWORD }]
+		kw: Dict[str, Hashable] = { p.name: p.default for p in params if p.default is not Parameter.empty }
+		arg_spec: Tuple[str] = tuple(map(lambda p : p.name, params))
+		shared: SharedMemoryCache = SharedMemoryCache(name, slots, slot_size)
+
+		@wraps(func)
+		async def wrapper(*args: Tuple[Hashable], **kwargs: Dict[str, Hashable]) -> Any :
+			if not SharedMemoryCache.Enabled :
+				return await func(*args, **kwargs)
+
+			key: str = key_format.format(**{ **kw, **dict(zip(arg_spec, args)), **kwargs })
+
+			try :
+				hit, data = shared.get(key)
+
+			except Exception as e :
+				shared.logger.warning(f'failed to read from shared memory cache {name}.', exc_info=e)
+				hit, data = False, None
+
+			if hit :
+				return data
+
+			generation: Optional[int] = None
+
+			try :
+				generation = shared.generation()
+
+			except Exception as e :
+				shared.logger.warning(f'failed to read from shared memory cache {name}.', exc_info=e)
+
+			data = await func(*args, **kwargs)
+
+			try :
+				if generation is not None :
+					shared.put(key, data, TTL, index(*args, data), generation)
+
+			except Exception as e :
+				shared.logger.warning(f'failed to write to shared memory cache {name}.', exc_info=e)
+
+			return data
+
+		def store(data: Any, *args: Tuple[Hashable], **kwargs: Dict[str, Hashable]) -> None :
+			if not SharedMemoryCache.Enabled :
+				return
+
+			try :
+				shared.put(key_format.format(**{ **kw, **dict(zip(arg_spec, args)), **kwargs }), data, TTL, index(*args, data))
+
+			except Exception as e :
+				shared.logger.warning(f'failed to write to shared memory cache {name}.', exc_info=e)
+
+		async def refresh(*args: Tuple[Hashable], **kwargs: Dict[str, Hashable]) -> Any :
+			generation: Optional[int] = None
+
+			if SharedMemoryCache.Enabled :
+				try :
+					generation = shared.generation()
+
+				except Exception as e :
+					shared.logger.warning(f'failed to read from shared memory cache {name}.', exc_info=e)
+
+			data = await func(*args, **kwargs)
+
+			if generation is not None :
+				try :
+					shared.put(key_format.format(**{ **kw, **dict(zip(arg_spec, args)), **kwargs }), data, TTL, index(*args, data), generation)
+
+				except Exception as e :
+					shared.logger.warning(f'failed to write to shared memory cache {name}.', exc_info=e)
+
+			return data
+
+		wrapper.shared = shared
+		wrapper.refresh = refresh
+		wrapper.store = store
+		return wrapper
+
+	return decorator
@@ -0,0 +1,151 @@
+from asyncio import Future, ensure_future, run, sleep
+
+import admission
+import pytest
+from admission import AdmissionController, AdmissionMiddleware, Internal, Listing, RouteClass, Shed, SinglePost, Unverified, route_class
+
+
+High: RouteClass = RouteClass('high', limit=2, queue=4, deadline=1, priority=0)
+Low: RouteClass = RouteClass('low', limit=2, queue=1, deadline=0.01, priority=1)
+
+
+def test_AdmissionController_ShedsOnceQueueIsFull() :
+	async def test() :
+		admission: AdmissionController = AdmissionController([High, Low])
+		await admission.acquire(Low)
+		await admission.acquire(Low)
+
+		waiter: Future = ensure_future(admission.acquire(Low))
+		await sleep(0)
+
+		# the queue only fits a single waiter
+		with pytest.raises(Shed) :
+			await admission.acquire(Low)
+
+		# and the waiter is shed once its deadline passes
+		with pytest.raises(Shed) :
+			await waiter
+
+		assert admission.stats()['low'] == { 'active': 2, 'queued': 0, 'shed': 2, 'limit': 2 }
+
+	run(test())
+
+
+def test_AdmissionController_HigherPriorityAdmittedFirst() :
+	async def test() :
+		AdmissionController.TotalLimit = 2
+		admission: AdmissionController = AdmissionController([High, Low])
+		await admission.acquire(Low)
+		await admission.acquire(Low)
+
+		order = []
+
+		async def request(route: RouteClass) :
+			await admission.acquire(route)
+			order.append(route.name)
+
+		low: Future = ensure_future(request(RouteClass('low', limit=2, queue=1, deadline=1, priority=1)))
+		await sleep(0)
+		high: Future = ensure_future(request(High))
+		await sleep(0)
+
+		admission.release(Low)
+		await sleep(0)
+		admission.release(Low)
+		await sleep(0)
+		await high
+		await low
+
+		assert order == ['high', 'low']
+
+	try :
+		run(test())
+
+	finally :
+		AdmissionController.TotalLimit = 192
+
+
+def test_route_class_RelatedPostsAreListings() :
+	assert route_class('/v1/post/AAAAAAAB') == SinglePost
+	assert route_class('/v1/post/AAAAAAAB/related') == Listing
+
+
+class Saturated(AdmissionController) :
+
+	async def acquire(self, route: RouteClass) -> None :
+		raise Shed()
+
+
+def test_AdmissionMiddleware_ShedResponsesHaveCorsHeaders() :
+	messages = []
+
+	async def app(scope, receive, send) :
+		raise AssertionError('shed requests never reach the app')
+
+	async def receive() :
+		return { 'type': 'http.request', 'body': b'' }
+
+	async def send(message) :
+		messages.append(message)
+
+	middleware: AdmissionMiddleware = AdmissionMiddleware(app, Saturated([]), cors={ 'allowed_origins': { 'fuzz.ly' } })
+	run(middleware({
+		'type': 'http',
+		'method': 'GET',
+		'path': '/v1/posts',
+		'query_string': b'',
+		'headers': [(b'origin', b'https://fuzz.ly')],
+	}, receive, send))
+
+	headers = dict(messages[0]['headers'])
+	assert messages[0]['status'] == 503
+	assert headers[b'access-control-allow-origin'] == b'https://fuzz.ly'
+	assert headers[b'retry-after'] == b'1'
+
+
+class Recording(AdmissionController) :
+
+	def __init__(self) -> None :
+		AdmissionController.__init__(self, [Internal, Unverified])
+		self.routes = []
+
+
+	async def acquire(self, route: RouteClass) -> None :
+		self.routes.append(route)
+
+
+	def release(self, route: RouteClass) -> None :
+		pass
+
+
+def test_AdmissionMiddleware_UnverifiedInternalRequestsAdmittedLast(monkeypatch) :
+	class Token :
+		def __init__(self, scope) -> None :
+			self.data = { 'scope': scope }
+
+	async def retrieveAuthToken(request) :
+		if 'authorization' not in request.headers :
+			raise ValueError('no token')
+
+		return Token(['internal'] if request.headers['authorization'] == 'internal' else ['user'])
+
+	async def app(scope, receive, send) :
+		pass
+
+	async def receive() :
+		return { 'type': 'http.request', 'body': b'' }
+
+	monkeypatch.setattr(admission, 'retrieveAuthToken', retrieveAuthToken)
+	recording: Recording = Recording()
+	middleware: AdmissionMiddleware = AdmissionMiddleware(app, recording)
+
+	for headers in [[], [(b'authorization', b'user')], [(b'authorization', b'internal')]] :
+		run(middleware({
+			'type': 'http',
+			'method': 'GET',
+			'path': '/i1/post/AAAAAAAB',
+			'query_string': b'',
+			'headers': headers,
+		}, receive, None))
+
+	assert recording.routes == [Unverified, Unverified, Internal]
@@ -0,0 +1,104 @@
+import bloom
+from bloom import BloomFilter, KnownPosts
+
+
+class Clock :
+
+	def __init__(self: 'Clock', now: float) -> None :
+		self.now: float = now
+
+
+	def __call__(self: 'Clock') -> float :
+		return self.now
+
+
+def test_BloomFilter_NoFalseNegatives() :
+	bloom_filter: BloomFilter = BloomFilter(10000, 0.01)
+
+	for i in range(10000) :
+		bloom_filter.add(i * 7919)
+
+	assert all([i * 7919 in bloom_filter for i in range(10000)])
+	# 1% expected, with plenty of room for variance
+	assert sum([i * 7919 + 1 in bloom_filter for i in range(10000)]) < 300
+
+
+def test_KnownPosts_OnlyNegativeCacheBeforeBuild(monkeypatch) :
+	clock: Clock = Clock(0)
+	monkeypatch.setattr(bloom, 'time', clock)
+	known: KnownPosts = KnownPosts()
+
+	assert not known.missing(1)
+
+	known.not_found(1)
+	assert known.missing(1)
+
+	clock.now += KnownPosts.NegativeTTL + 1
+	assert not known.missing(1)
+
+
+def test_KnownPosts_AddedDuringBuildAreKept(monkeypatch) :
+	monkeypatch.setattr(KnownPosts, 'MinCapacity', 100)
+	known: KnownPosts = KnownPosts()
+
+	known.build(10).add(1)
+	known.add([2])
+	assert not known.unconfirmed(3)
+
+	known.finish()
+
+	assert not known.unconfirmed(1)
+	assert not known.unconfirmed(2)
+	assert known.unconfirmed(3)
+
+	# a filter miss is only a hint, until the database confirms it
+	assert not known.missing(3)
+
+
+def test_KnownPosts_MissesTrustedWhileSynced(monkeypatch) :
+	clock: Clock = Clock(0)
+	monkeypatch.setattr(bloom, 'time', clock)
+	monkeypatch.setattr(KnownPosts, 'MinCapacity', 100)
+	known: KnownPosts = KnownPosts()
+
+	known.build(10).add(1)
+	known.synced()
+	known.finish()
+
+	assert known.missing(2)
+	assert not known.missing(1)
+	assert not known.unconfirmed(2)
+
+	# events may have been missed, so misses are hints again until the next poll
+	known.desynced()
+	assert not known.missing(2)
+	assert known.unconfirmed(2)
+
+	known.synced()
+	assert known.missing(2)
+
+	clock.now += KnownPosts.SyncedTTL + 1
+	assert not known.missing(2)
+	assert known.unconfirmed(2)
+
+
+def test_BloomFilter_SnapshotRoundTrip(tmp_path) :
+	bloom_filter: BloomFilter = BloomFilter(1000, 0.01)
+
+	for i in range(1000) :
+		bloom_filter.add(i)
+
+	bloom_filter.save(str(tmp_path / 'known'), 123.5)
+	loaded, since = BloomFilter.load(str(tmp_path / 'known'))
+
+	assert since == 123.5
+	assert all([i in loaded for i in range(1000)])
+	assert [i in loaded for i in range(1000, 2000)] == [i in bloom_filter for i in range(1000, 2000)]
+
+
+def test_KnownPosts_AddClearsNegativeCache() :
+	known: KnownPosts = KnownPosts()
+	known.not_found(1)
+	known.add([1])
+
+	assert not known.missing(1)
@@ -0,0 +1,115 @@
+from asyncio import run, sleep
+from typing import Any, Dict, Iterable, List, Optional
+
+from handles import HandleResolver
+
+
+class FakeKVS :
+
+	def __init__(self: 'FakeKVS') -> None :
+		self.data: Dict[str, Any] = { }
+		self.batches: List[List[str]] = []
+
+
+	async def get_many_async(self: 'FakeKVS', keys: Iterable[str]) -> Dict[str, Optional[Any]] :
+		keys = list(keys)
+		self.batches.append(keys)
+		return { key: self.data.get(key) for key in keys }
+
+
+	async def put_async(self: 'FakeKVS', key: str, data: Any, TTL: int = 0) -> None :
+		self.data[key] = data
+
+
+	async def remove_async(self: 'FakeKVS', key: str) -> None :
+		self.data.pop(key, None)
+
+
+class Loader :
+
+	def __init__(self: 'Loader', users: Dict[str, int]) -> None :
+		self.users: Dict[str, int] = users
+		self.batches: List[List[str]] = []
+
+
+	async def __call__(self: 'Loader', handles: List[str]) -> Dict[str, int] :
+		self.batches.append(handles)
+		return { handle: self.users[handle] for handle in handles if handle in self.users }
+
+
+def test_HandleResolver_LooksUpEachTierInOneBatch() :
+	kvs: FakeKVS = FakeKVS()
+	kvs.data['bob'] = 2
+	loader: Loader = Loader({ 'alice': 1, 'bob': 2 })
+	resolver: HandleResolver = HandleResolver(kvs)
+
+	async def test() :
+		assert await resolver.resolve(['alice', 'bob', 'nobody', 'alice'], loader) == { 'alice': 1, 'bob': 2 }
+		assert kvs.batches == [['alice', 'bob', 'nobody']]
+		assert loader.batches == [['alice', 'nobody']]
+
+		# let the writes to aerospike finish
+		await sleep(0)
+		assert kvs.data == { 'alice': 1, 'bob': 2 }
+
+		# found handles are now cached locally, missing handles are looked up again
+		assert await resolver.resolve(['alice', 'bob', 'nobody'], loader) == { 'alice': 1, 'bob': 2 }
+		assert kvs.batches[-1] == ['nobody']
+		assert loader.batches[-1] == ['nobody']
+
+	run(test())
+
+
+def test_HandleResolver_InvalidateForgetsBothTiers() :
+	kvs: FakeKVS = FakeKVS()
+	loader: Loader = Loader({ 'alice': 1 })
+	resolver: HandleResolver = HandleResolver(kvs)
+
+	async def test() :
+		assert await resolver.resolve(['alice'], loader) == { 'alice': 1 }
+		await sleep(0)
+
+		# alice is renamed to carol
+		loader.users = { 'carol': 1 }
+		await resolver.invalidate(['alice', 'carol'])
+
+		assert 'alice' not in kvs.data
+		assert await resolver.resolve(['alice', 'carol'], loader) == { 'carol': 1 }
+
+	run(test())
+
+
+def test_HandleResolver_StaleLookupsAreNotCached() :
+	kvs: FakeKVS = FakeKVS()
+	resolver: HandleResolver = HandleResolver(kvs)
+
+	async def load(handles: List[str]) -> Dict[str, int] :
+		# the handle changes while it's being looked up
+		await resolver.invalidate(handles)
+		return { 'alice': 1 }
+
+	async def test() :
+		assert await resolver.resolve(['alice'], load) == { 'alice': 1 }
+		await sleep(0)
+
+		assert 'alice' not in kvs.data
+		assert await resolver.resolve(['alice'], Loader({ })) == { }
+
+	run(test())
+
+
+def test_HandleResolver_EvictsLeastRecentlyUsed(monkeypatch) :
+	monkeypatch.setattr(HandleResolver, 'CacheSize', 2)
+	kvs: FakeKVS = FakeKVS()
+	loader: Loader = Loader({ 'a': 1, 'b': 2, 'c': 3 })
+	resolver: HandleResolver = HandleResolver(kvs)
+
+	async def test() :
+		await resolver.resolve(['a'], loader)
+		await resolver.resolve(['b'], loader)
+		await resolver.resolve(['a'], loader)
+		await resolver.resolve(['c'], loader)
+
+		assert list(resolver._cache) == ['a', 'c']
+
+	run(test())
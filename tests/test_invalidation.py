@@ -0,0 +1,67 @@
+from asyncio import run, sleep
+from typing import List, Tuple
+
+from invalidation import IndexedCache, InvalidationListener, LocalEventSource
+from models import InvalidationEvent
+
+
+def test_IndexedCache_InvalidateEvictsOnlyDependents() :
+	calls: List[Tuple[int, int]] = []
+
+	@IndexedCache(60, index=lambda a, b, _ : [('a', a), ('b', b)])
+	async def func(a: int, b: int) -> Tuple[int, int] :
+		calls.append((a, b))
+		return a, b
+
+	async def test() :
+		await func(1, 2)
+		await func(1, 3)
+		await func(1, 2)
+		assert len(calls) == 2
+
+		assert func.invalidate(('b', 2)) == 1
+		await func(1, 3)
+		assert len(calls) == 2
+
+		await func(1, 2)
+		assert len(calls) == 3
+
+		assert func.invalidate(('a', 1)) == 2
+		assert not func.cache
+
+	run(test())
+
+
+def test_InvalidationListener_ClearsCachesAfterGap() :
+	calls: List[int] = []
+
+	@IndexedCache(60)
+	async def func(a: int) -> int :
+		calls.append(a)
+		return a
+
+	async def handler(events: List[InvalidationEvent]) -> None :
+		pass
+
+	async def test() :
+		source: LocalEventSource = LocalEventSource()
+		missed: List[bool] = []
+		listener: InvalidationListener = InvalidationListener(handler, source, lambda : missed.append(True))
+		listener.Interval = 0
+
+		await func(1)
+		listener.start()
+		await sleep(0.01)
+		assert func.cache
+
+		# the source had to reconnect, so events may have been missed
+		source.gaps += 1
+		await sleep(0.01)
+		listener.stop()
+
+		assert not func.cache
+		assert missed == [True]
+		await func(1)
+		assert calls == [1, 1]
+
+	run(test())
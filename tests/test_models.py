@@ -1,7 +1,8 @@
 from typing import Any
 
 import pytest
-from models import PostId
+from models import InvalidationEvent, InvalidationEventType, PostId, ScoresRequest, TimelineSinceRequest
+from pydantic import ValidationError
 
 
 @pytest.mark.parametrize(
@@ -15,3 +16,39 @@ from models import PostId
 )
 def test_PostId(value: Any, expected: str) :
 	assert PostId(value) == expected
+
+
+def test_ScoresRequest_ConvertsPostIds() :
+	request: ScoresRequest = ScoresRequest(post_ids=[0, 'JPIlC520'])
+	assert request.post_ids == ['AAAAAAAA', 'JPIlC520']
+	assert all(map(lambda x : type(x) == PostId, request.post_ids))
+
+
+def test_TimelineSinceRequest_ConvertsPostId() :
+	request: TimelineSinceRequest = TimelineSinceRequest(post_id=0, created='2022-01-01T00:00:00Z')
+	assert request.post_id == 'AAAAAAAA'
+	assert type(request.post_id) == PostId
+	assert request.count == 64
+
+
+def test_InvalidationEvent_SetEventsOmitPostId() :
+	event: InvalidationEvent = InvalidationEvent(event='set', set_id='AAAAAAAB')
+	assert event.event == InvalidationEventType.set
+	assert event.post_id is None
+	assert event.set_id == 'AAAAAAAB'
+
+
+@pytest.mark.parametrize(
+	'event',
+	[
+		{ 'event': 'post' },
+		{ 'event': 'tag', 'tags': ['a'] },
+		{ 'event': 'privacy', 'privacy': 'public' },
+		{ 'event': 'vote', 'user_id': 1 },
+		{ 'event': 'handle', 'user_id': 1 },
+		{ 'event': 'set', 'post_id': 'AAAAAAAB' },
+	]
+)
+def test_InvalidationEvent_RequiresFieldForEventType(event: dict) :
+	with pytest.raises(ValidationError) :
+		InvalidationEvent(**event)
@@ -0,0 +1,54 @@
+from precompute import Precompute, SpaceSaving
+from shared_cache import SharedMemoryCache
+
+
+def test_SpaceSaving_TopReturnsHeavyHitters() :
+	sketch: SpaceSaving = SpaceSaving(4)
+
+	for i in range(100) :
+		sketch.add('hot')
+		sketch.add(i)
+
+		if i % 2 :
+			sketch.add('warm')
+
+	assert [key for key, _ in sketch.top(2)] == ['hot', 'warm']
+	assert len(sketch) == 4
+
+
+def test_SpaceSaving_DecayDropsColdKeys() :
+	sketch: SpaceSaving = SpaceSaving(4)
+	sketch.add('hot', 8)
+	sketch.add('cold')
+
+	sketch.decay()
+
+	assert sketch.top(4) == [('hot', 4)]
+
+
+def test_Precompute_OneLeaderPerHost(tmp_path, monkeypatch) :
+	monkeypatch.setattr(Precompute, 'LockFile', str(tmp_path / 'precompute.lock'))
+	first: Precompute = Precompute()
+	second: Precompute = Precompute()
+
+	assert first.leader()
+	assert not second.leader()
+
+	# another worker takes over once the leader stops
+	first.stop()
+	assert second.leader()
+
+	second.stop()
+
+
+def test_Precompute_EveryWorkerRefreshesWithoutSharedMemory(tmp_path, monkeypatch) :
+	monkeypatch.setattr(Precompute, 'LockFile', str(tmp_path / 'precompute.lock'))
+	monkeypatch.setattr(SharedMemoryCache, 'Enabled', False)
+	first: Precompute = Precompute()
+	second: Precompute = Precompute()
+
+	assert first.refreshes()
+	assert second.refreshes()
+
+	# no lock is taken, since no worker's results can be shared
+	assert not (tmp_path / 'precompute.lock').exists()
@@ -0,0 +1,62 @@
+from related import MinHash, RelatedIndex
+
+
+def test_MinHash_EstimatesJaccardSimilarity() :
+	minhash: MinHash = MinHash()
+	a = minhash.signature([f'tag_{i}' for i in range(0, 100)])
+	b = minhash.signature([f'tag_{i}' for i in range(50, 150)])
+
+	assert MinHash.similarity(a, a) == 1
+	# the true similarity is 50 / 150
+	assert abs(MinHash.similarity(a, b) - 1 / 3) < 0.25
+	assert minhash.signature([]) is None
+
+
+def test_RelatedIndex_ReturnsMostSimilarFirst() :
+	index: RelatedIndex = RelatedIndex()
+	tags = [f'tag_{i}' for i in range(20)]
+	index.add(1, tags)
+	index.add(2, tags[:-1] + ['blue'])
+	index.add(3, ['landscape', 'mountain', 'lake'])
+
+	related = index.related(1, 3)
+
+	assert related[0][0] == 2
+	assert related[0][1] > 0.7
+	assert 3 not in [post_id for post_id, _ in related]
+
+
+def test_RelatedIndex_RemovedPostsAreNotReturned() :
+	index: RelatedIndex = RelatedIndex()
+	index.add(1, ['cat', 'dog'])
+	index.add(2, ['cat', 'dog'])
+	index.remove(2)
+
+	assert index.related(1, 10) == []
+	assert 2 not in index
+	assert index.related(3, 10, tags=['cat', 'dog']) == [(1, 1.0)]
+
+
+def test_RelatedIndex_EvictsLeastRecentlyInserted(monkeypatch) :
+	monkeypatch.setattr(RelatedIndex, 'MaxPosts', 2)
+	index: RelatedIndex = RelatedIndex()
+	index.add(1, ['cat', 'dog'])
+	index.add(2, ['cat', 'dog'])
+	index.add(3, ['cat', 'dog'])
+
+	assert 1 not in index
+	assert len(index) == 2
+	assert index.related(3, 10) == [(2, 1.0)]
+
+
+def test_RelatedIndex_SnapshotsAreSharedBetweenIndexes(tmp_path) :
+	index: RelatedIndex = RelatedIndex()
+	index.add(1, ['cat', 'dog'])
+	index.add(2, ['cat', 'dog', 'bird'])
+	index.save(str(tmp_path / 'related'))
+
+	# signatures don't depend on the process, so an index loaded elsewhere finds the same posts
+	loaded: RelatedIndex = RelatedIndex()
+	assert loaded.load(str(tmp_path / 'related')) == 2
+	assert loaded.related(1, 10) == index.related(1, 10)
+	assert loaded.related(3, 10, tags=['cat', 'dog'])[0] == (1, 1.0)
@@ -0,0 +1,254 @@
+from asyncio import ensure_future, run, sleep
+from os import environ
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import pytest
+import replica
+from replica import Replica, primary, reads_as_user, replica_fill
+
+
+class Clock :
+
+	def __init__(self: 'Clock', now: float) -> None :
+		self.now: float = now
+
+
+	def __call__(self: 'Clock') -> float :
+		return self.now
+
+
+class FakeKVS :
+
+	def __init__(self: 'FakeKVS', clock: Clock) -> None :
+		self.clock: Clock = clock
+		self.data: Dict[str, Tuple[float, Any]] = { }
+
+
+	async def put_async(self: 'FakeKVS', key: str, data: Any, TTL: int = 0) -> None :
+		self.data[key] = (self.clock() + TTL, data)
+
+
+	async def get_many_async(self: 'FakeKVS', keys: Iterable[str]) -> Dict[str, Optional[Any]] :
+		return { key: self.data[key][1] if self.data.get(key, (0,))[0] > self.clock() else None for key in keys }
+
+
+class User :
+
+	def __init__(self: 'User', user_id: int) -> None :
+		self.user_id: int = user_id
+
+
+class Reader :
+
+	def __init__(self: 'Reader', replica: Replica) -> None :
+		self._replica: Replica = replica
+
+
+	@reads_as_user
+	async def usable(self: 'Reader', user: User) -> bool :
+		return self._replica.usable()
+
+
+class Filler :
+
+	def __init__(self: 'Filler', replica: Replica) -> None :
+		self._replica: Replica = replica
+		self.reads: List[bool] = []
+
+
+	@replica_fill
+	async def fill(self: 'Filler', announce: bool) -> bool :
+		# records whether each read could have gone to the replica, optionally announcing a change while reading
+		self.reads.append(self._replica.usable())
+
+		if announce and len(self.reads) == 1 :
+			self._replica.fence()
+
+		return self.reads[-1]
+
+
+def test_Replica_LagMeasuredFromLastReplayedPosition() :
+	r: Replica = Replica({ })
+
+	r.sample(100, 100, now=0)
+	assert r.lag == 0
+
+	# the primary moves on, the replica doesn't
+	r.sample(200, 100, now=1)
+	r.sample(300, 100, now=2)
+	assert r.lag == 2
+
+	# the replica catches up to the second sample
+	r.sample(300, 200, now=3)
+	assert r.lag == 2
+
+	r.sample(300, 300, now=4)
+	assert r.lag == 0
+
+
+def test_Replica_IdlePrimaryIsNotLag() :
+	r: Replica = Replica({ })
+
+	for now in range(10) :
+		r.sample(100, 100, now=now)
+
+	assert r.lag == 0
+
+
+def test_Replica_UnusableUntilLagIsKnown() :
+	r: Replica = Replica({ })
+	assert not r.usable()
+
+	r.sample(100, None)
+	assert r.usable()
+
+	r.failed()
+	assert not r.usable()
+
+
+def test_Replica_WritersReadFromPrimary(monkeypatch) :
+	clock: Clock = Clock(0)
+	monkeypatch.setattr(replica, 'time', clock)
+	monkeypatch.setattr(replica, 'recent_writers', FakeKVS(clock))
+	r: Replica = Replica({ })
+	r.sample(100, 100)
+
+	async def test() :
+		# the write is recorded in aerospike, so it's seen by every worker, not just this replica instance
+		await r.wrote(1)
+		reader: Reader = Reader(Replica({ }))
+		reader._replica.sample(100, 100)
+
+		assert not await reader.usable(User(1))
+		assert await reader.usable(User(2))
+
+		clock.now += Replica.WriteWindow + 1
+		assert await reader.usable(User(1))
+
+	run(test())
+
+
+def test_Replica_WritingWhenUnknown(monkeypatch) :
+	class BrokenKVS :
+		async def get_many_async(self, keys: Iterable[str]) -> Dict[str, Optional[Any]] :
+			raise ConnectionError()
+
+	monkeypatch.setattr(replica, 'recent_writers', BrokenKVS())
+	assert run(Replica({ }).writing(1))
+
+
+def test_Replica_PrimaryAndFenceOverride(monkeypatch) :
+	clock: Clock = Clock(0)
+	monkeypatch.setattr(replica, 'time', clock)
+	r: Replica = Replica({ })
+	r.sample(100, 100)
+
+	with primary() :
+		assert not r.usable()
+
+	r.fence()
+	assert not r.usable()
+
+	clock.now += Replica.WriteWindow + 1
+	assert r.usable()
+
+
+def test_Replica_FillsRereadFromPrimaryWhenFenced(monkeypatch) :
+	clock: Clock = Clock(0)
+	monkeypatch.setattr(replica, 'time', clock)
+	r: Replica = Replica({ })
+	r.sample(100, 100)
+
+	# fills read from the replica, unless a change is announced while they run
+	filler: Filler = Filler(r)
+	assert run(filler.fill(False))
+	assert filler.reads == [True]
+
+	filler = Filler(r)
+	assert not run(filler.fill(True))
+	assert filler.reads == [True, False]
+
+	clock.now += Replica.WriteWindow + 1
+	filler = Filler(r)
+	assert run(filler.fill(False))
+	assert filler.reads == [True]
+
+
+# the remaining tests run against two local postgres instances, given as libpq connection strings, for example:
+#	TEST_PRIMARY_DB='host=localhost port=5432 user=postgres' TEST_REPLICA_DB='host=localhost port=5433 user=postgres' pytest tests/test_replica.py
+requires_postgres = pytest.mark.skipif(
+	not (environ.get('TEST_PRIMARY_DB') and environ.get('TEST_REPLICA_DB')),
+	reason='TEST_PRIMARY_DB and TEST_REPLICA_DB are not set',
+)
+
+
+@pytest.fixture
+def scoring(monkeypatch) :
+	import kh_common.sql
+	from kh_common.config import credentials
+	from kh_common.sql import SqlInterface
+	from scoring import Scoring
+
+	monkeypatch.setattr(kh_common.sql, 'db', { 'dsn': environ['TEST_PRIMARY_DB'] })
+	monkeypatch.setattr(credentials, 'db_replica', { 'dsn': environ['TEST_REPLICA_DB'] }, raising=False)
+	monkeypatch.setattr(SqlInterface, '_conn', None)
+	monkeypatch.setattr(replica, 'recent_writers', FakeKVS(Clock(0)))
+
+	instance: Scoring = Scoring()
+	yield instance
+	instance.close()
+
+
+async def port(scoring, **kwargs) -> str :
+	return (await scoring.query_async("SELECT current_setting('port');", fetch_one=True, **kwargs))[0]
+
+
+@requires_postgres
+def test_Scoring_RoutesReadsToReplica(scoring) :
+	async def test() :
+		# nothing is sent to the replica until its lag has been measured
+		primary_port: str = await port(scoring)
+
+		monitor = ensure_future(scoring.monitorReplica())
+		await sleep(0.5)
+		monitor.cancel()
+
+		# two independent instances, the "replica" isn't in recovery so it's never behind
+		assert scoring._replica.lag == 0
+
+		replica_port: str = await port(scoring)
+		assert replica_port != primary_port
+
+		# committed queries always go to the primary
+		assert await port(scoring, commit=True) == primary_port
+
+		with primary() :
+			assert await port(scoring) == primary_port
+
+		await scoring._replica.wrote(1)
+
+		@reads_as_user
+		async def user_port(self, user: User) -> str :
+			return await port(self)
+
+		assert await user_port(scoring, User(1)) == primary_port
+		assert await user_port(scoring, User(2)) == replica_port
+
+		scoring._replica.lag = Replica.MaxLag + 1
+		assert await port(scoring) == primary_port
+
+	run(test())
+
+
+@requires_postgres
+def test_Scoring_FallsBackToPrimary(scoring) :
+	async def test() :
+		primary_port: str = await port(scoring)
+		scoring._replica.sample(0, None)
+
+		# a query the replica can't answer is retried on the primary, and the replica is taken out of rotation
+		scoring._replica._config = { 'dsn': 'host=localhost port=1 connect_timeout=1' }
+		assert await port(scoring) == primary_port
+		assert scoring._replica.lag is None
+
+	run(test())
@@ -0,0 +1,41 @@
+from typing import List
+
+import pytest
+from kh_common.exceptions.http_error import BadRequest
+from search import SearchQuery, VelocitySort
+
+from fuzzly.models.post import PostSort
+
+
+@pytest.mark.parametrize(
+	'sort, tags',
+	[
+		(PostSort.hot, ['cat', 'dog']),
+		(PostSort.hot, ['dog', 'cat', 'cat']),
+		(PostSort.hot, [' Dog', 'CAT ', '']),
+		(PostSort.new, ['cat', 'dog', 'sort:hot']),
+	]
+)
+def test_SearchQuery_EquivalentQueriesAreEqual(sort: PostSort, tags: List[str]) :
+	assert SearchQuery.parse(sort, tags) == SearchQuery(sort=PostSort.hot, include_tags=('cat', 'dog'))
+
+
+def test_SearchQuery_FiltersArePulledOut() :
+	query: SearchQuery = SearchQuery.parse(PostSort.new, ['cat', '-dog', '@User', '-@other', 'general', '-explicit'])
+
+	assert query.include_tags == ('cat',)
+	assert query.exclude_tags == ('dog',)
+	assert query.include_users == ('user',)
+	assert query.exclude_users == ('other',)
+	assert query.include_rating == ('general',)
+	assert query.exclude_rating == ('explicit',)
+	assert query.filters() == ('cat', '@user', 'general')
+
+
+def test_SearchQuery_InvalidSortRaisesBadRequest() :
+	with pytest.raises(BadRequest) :
+		SearchQuery.parse(PostSort.new, ['sort:nope'])
+
+
+def test_SearchQuery_RisingSortTag() :
+	assert SearchQuery.parse(PostSort.new, ['cat', 'sort:rising']).sort == VelocitySort.rising
@@ -0,0 +1,183 @@
+from json import loads
+from os import environ
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import pytest
+from kh_common.sql.query import Field, Query
+from search import SearchQuery
+from search_sql import search_filter, search_order
+
+from fuzzly.models.post import PostSort
+
+
+Ratings: Dict[str, int] = { 'general': 1, 'mature': 2, 'explicit': 3 }
+Uploaders: Dict[str, int] = { 'alice': 1001, 'bob': 1002 }
+
+# every query shape search_filter produces, as the tags that produce it
+Shapes: Dict[str, List[str]] = {
+	'front_page': [],
+	'include_tag': ['tag_1'],
+	'include_tags': ['tag_1', 'tag_2'],
+	'exclude_tags': ['-tag_1', '-tag_2'],
+	'include_and_exclude_tags': ['tag_1', '-tag_2'],
+	'include_user': ['@alice'],
+	'exclude_users': ['-@alice', '-@bob'],
+	'rating': ['general', '-explicit'],
+	'include_sets': ['set:AAAAAAAB', 'set:AAAAAAAC'],
+	'exclude_set': ['tag_1', '-set:AAAAAAAB'],
+	'single_set': ['set:AAAAAAAB'],
+}
+
+
+def build(tags: List[str], sort: PostSort = PostSort.new) -> Tuple[str, List[Any]] :
+	search: SearchQuery = SearchQuery.parse(sort, tags)
+	query: Optional[Query] = search_filter(search, Ratings, Uploaders)
+	assert query is not None
+	return search_order(query, search).select(Field('posts', 'post_id')).limit(64).page(1).build()
+
+
+@pytest.mark.parametrize('shape', Shapes.keys())
+@pytest.mark.parametrize('sort', [PostSort.new, PostSort.hot])
+def test_search_filter_NeverJoinsUsersOrGroups(shape: str, sort: PostSort) :
+	sql, params = build(Shapes[shape], sort)
+
+	assert 'kheina.public.users' not in sql
+	assert 'GROUP BY' not in sql
+	assert ' NOT IN ' not in sql
+	assert sql.count('%s') == len(params)
+
+
+def test_search_filter_ExclusionsAreAntiJoins() :
+	sql, params = build(['-tag_1', '-tag_2', '-set:AAAAAAAB'])
+
+	assert sql.count('NOT EXISTS') == 2
+	assert ['tag_1', 'tag_2'] in params
+
+
+def test_search_filter_EachIncludedSetIsASemiJoin() :
+	sql, params = build(['set:AAAAAAAB', 'set:AAAAAAAC'])
+
+	assert sql.count('EXISTS') == 2
+	assert 'set_post.index' not in sql
+	assert [1] in params and [2] in params
+
+
+def test_search_filter_UsersAreResolvedToUploaders() :
+	sql, params = build(['@alice', '-@bob', '-@nobody'])
+
+	assert 'posts.uploader = %s' in sql
+	assert 'posts.uploader != all(%s)' in sql
+	assert 1001 in params and [1002] in params
+
+
+def test_search_filter_UnknownUserMatchesNothing() :
+	assert search_filter(SearchQuery.parse(PostSort.new, ['@nobody']), Ratings, Uploaders) is None
+
+
+# the plan tests run against a local postgres database named kheina, given as a libpq connection string, for example:
+#	TEST_DB='host=localhost dbname=kheina user=postgres' pytest tests/test_search_sql.py
+# the schema is seeded inside a transaction that's rolled back afterwards, so the database must not already contain it.
+requires_postgres = pytest.mark.skipif(not environ.get('TEST_DB'), reason='TEST_DB is not set')
+
+Seed: str = """
+CREATE FUNCTION public.privacy_to_id(text) RETURNS smallint AS $$ SELECT 1::smallint $$ LANGUAGE sql IMMUTABLE;
+
+CREATE TABLE public.users (user_id bigint PRIMARY KEY, handle text NOT NULL);
+CREATE UNIQUE INDEX users_handle ON public.users (lower(handle));
+
+CREATE TABLE public.posts (
+	post_id bigint PRIMARY KEY,
+	uploader bigint NOT NULL REFERENCES public.users,
+	rating smallint NOT NULL,
+	privacy_id smallint NOT NULL,
+	created_on timestamptz NOT NULL
+);
+CREATE INDEX posts_created_on ON public.posts (created_on, post_id);
+CREATE INDEX posts_uploader ON public.posts (uploader, created_on, post_id);
+
+CREATE TABLE public.tags (tag_id bigint PRIMARY KEY, tag text NOT NULL UNIQUE, deprecated boolean NOT NULL DEFAULT false);
+CREATE TABLE public.tag_post (tag_id bigint NOT NULL, post_id bigint NOT NULL, PRIMARY KEY (tag_id, post_id));
+CREATE INDEX tag_post_post_id ON public.tag_post (post_id, tag_id);
+
+CREATE TABLE public.set_post (set_id bigint NOT NULL, post_id bigint NOT NULL, index integer NOT NULL, PRIMARY KEY (set_id, post_id));
+CREATE INDEX set_post_post_id ON public.set_post (post_id, set_id);
+
+CREATE TABLE public.post_scores (post_id bigint PRIMARY KEY, hot double precision, top integer, best double precision, controversial double precision);
+
+INSERT INTO public.users SELECT i, 'user_' || i FROM generate_series(1, 1000) i;
+INSERT INTO public.users VALUES (1001, 'alice'), (1002, 'bob');
+INSERT INTO public.posts SELECT i, i % 1002 + 1, i % 3 + 1, CASE WHEN i % 10 = 0 THEN 2 ELSE 1 END, now() - i * interval '1 minute' FROM generate_series(1, 100000) i;
+INSERT INTO public.tags SELECT i, 'tag_' || i FROM generate_series(1, 1000) i;
+INSERT INTO public.tag_post SELECT t, p FROM generate_series(1, 100000) p, LATERAL (SELECT DISTINCT (p * k) % 1000 + 1 t FROM generate_series(1, 5) k) tags;
+INSERT INTO public.set_post SELECT p % 100 + 1, p, p / 100 FROM generate_series(1, 100000, 7) p;
+INSERT INTO public.post_scores SELECT post_id, random(), (random() * 100)::int, random(), random() FROM public.posts;
+
+ANALYZE;
+"""
+
+
+@pytest.fixture(scope='module')
+def cursor() -> Iterator[Any] :
+	from psycopg2 import connect
+
+	conn = connect(environ['TEST_DB'])
+
+	try :
+		with conn.cursor() as cur :
+			cur.execute(Seed)
+			yield cur
+
+	finally :
+		conn.rollback()
+		conn.close()
+
+
+def plan_nodes(node: Dict[str, Any]) -> Iterator[Dict[str, Any]] :
+	yield node
+
+	for child in node.get('Plans', []) :
+		yield from plan_nodes(child)
+
+
+def explain(cursor: Any, tags: List[str], sort: PostSort = PostSort.new) -> List[Dict[str, Any]] :
+	sql, params = build(tags, sort)
+	cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+	plan: Any = cursor.fetchone()[0]
+
+	if isinstance(plan, str) :
+		plan = loads(plan)
+
+	return list(plan_nodes(plan[0]['Plan']))
+
+
+@requires_postgres
+@pytest.mark.parametrize('shape', Shapes.keys())
+@pytest.mark.parametrize('sort', [PostSort.new, PostSort.hot])
+def test_SearchPlan_SubqueriesBecomeJoins(cursor: Any, shape: str, sort: PostSort) :
+	nodes: List[Dict[str, Any]] = explain(cursor, Shapes[shape], sort)
+
+	# a SubPlan is evaluated once per candidate post (or hashed in full), rather than planned as a join
+	assert not [node for node in nodes if node.get('Parent Relationship') == 'SubPlan']
+	assert 'users' not in { node.get('Relation Name') for node in nodes }
+
+
+@requires_postgres
+@pytest.mark.parametrize('shape', ['exclude_tags', 'include_and_exclude_tags', 'exclude_set'])
+def test_SearchPlan_ExclusionsAreAntiJoins(cursor: Any, shape: str) :
+	nodes: List[Dict[str, Any]] = explain(cursor, Shapes[shape])
+	assert 'Anti' in { node.get('Join Type') for node in nodes }
+
+
+@requires_postgres
+def test_SearchPlan_FrontPageWalksCreatedOnIndex(cursor: Any) :
+	nodes: List[Dict[str, Any]] = explain(cursor, Shapes['front_page'])
+
+	# newest posts are read straight off of the index, rather than sorting every public post
+	assert 'Sort' not in { node['Node Type'] for node in nodes }
+	assert 'posts_created_on' in { node.get('Index Name') for node in nodes }
+
+
+@requires_postgres
+def test_SearchPlan_UserListingUsesUploaderIndex(cursor: Any) :
+	nodes: List[Dict[str, Any]] = explain(cursor, Shapes['include_user'])
+	assert 'posts_uploader' in { node.get('Index Name') for node in nodes }
@@ -0,0 +1,59 @@
+from os import listdir
+
+from shared_cache import SharedMemoryCache
+
+
+def test_SharedMemoryCache_InvalidateMarksDependentEntriesStale(tmp_path, monkeypatch) :
+	monkeypatch.setattr(SharedMemoryCache, 'Directory', str(tmp_path))
+	monkeypatch.setattr(SharedMemoryCache, 'Enabled', True)
+	cache: SharedMemoryCache = SharedMemoryCache('test', slots=16, slot_size=256)
+	other: SharedMemoryCache = SharedMemoryCache('test', slots=16, slot_size=256)
+
+	assert cache.get('a') == (False, None)
+	assert cache.put('a', { 'b': 1 }, 60, [('post', 'x')])
+	assert cache.put('c', { 'd': 2 }, 60, [('post', 'y')])
+
+	# a separately mapped cache with the same name sees the same entries
+	assert other.get('a') == (True, { 'b': 1 })
+
+	# only entries stored with the invalidated dependency are affected
+	other.invalidate(('post', 'x'))
+	assert cache.get('a') == (False, None)
+	assert cache.get('c') == (True, { 'd': 2 })
+
+	# values larger than a slot are never stored
+	assert not cache.put('e', b'0' * 512, 60)
+
+	cache.close()
+	other.close()
+
+
+def test_SharedMemoryCache_StaleResultsAreNotStored(tmp_path, monkeypatch) :
+	monkeypatch.setattr(SharedMemoryCache, 'Directory', str(tmp_path))
+	monkeypatch.setattr(SharedMemoryCache, 'Enabled', True)
+	cache: SharedMemoryCache = SharedMemoryCache('test', slots=16, slot_size=256)
+
+	# an invalidation is made while the value is being computed
+	generation: int = cache.generation()
+	cache.invalidate(('post', 'x'))
+
+	assert not cache.put('a', 1, 60, [('post', 'x')], generation)
+	assert cache.get('a') == (False, None)
+
+	cache.close()
+
+
+def test_SharedMemoryCache_LayoutIsPartOfFileName(tmp_path, monkeypatch) :
+	monkeypatch.setattr(SharedMemoryCache, 'Directory', str(tmp_path))
+	cache: SharedMemoryCache = SharedMemoryCache('test', slots=16, slot_size=256)
+	resized: SharedMemoryCache = SharedMemoryCache('test', slots=32, slot_size=256)
+
+	assert cache.put('a', 1, 60)
+	assert resized.put('a', 2, 60)
+
+	# a different layout never remaps, or truncates, a file that's already mapped
+	assert len(listdir(tmp_path)) == 2
+	assert cache.get('a') == (True, 1)
+
+	cache.close()
+	resized.close()
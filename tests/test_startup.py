@@ -0,0 +1,78 @@
+from json import loads
+from statistics import NormalDist
+from subprocess import run
+from sys import executable
+
+from scoring import z_score_08
+
+
+# seconds, measured in a fresh interpreter
+ImportBudget: float = 3
+FirstRequestBudget: float = 2
+
+
+def test_ZScore_MatchesNormalDistribution() :
+	assert abs(z_score_08 - NormalDist().inv_cdf(0.9)) < 1e-12
+
+
+def test_Startup_WithinBudget() :
+	# importing and starting the server has to happen in a new process, otherwise the modules are already loaded
+	result = run([executable, '-c', """
+from json import dumps
+from time import perf_counter
+
+start = perf_counter()
+import server
+imported = perf_counter()
+
+from fastapi.testclient import TestClient
+from posts import Posts
+
+
+# the services startup connects to are stubbed out, so only the server's own startup work is timed
+class StubB2 :
+	pass
+
+
+class StubPosts :
+	ScoreShards = 0
+	_replica = None
+	trendingTags = Posts.trendingTags
+
+	async def warm(self) :
+		pass
+
+	async def buildRelatedIndex(self) :
+		pass
+
+	async def trackKnownPosts(self) :
+		pass
+
+	async def trackPostedTags(self) :
+		pass
+
+	async def precompute(self, key) :
+		pass
+
+	def close(self) :
+		pass
+
+
+server.B2Interface = StubB2
+server.Posts = StubPosts
+server.event_source = lambda : None
+
+entered = perf_counter()
+with TestClient(server.app) as client :
+	response = client.get('/v1/trending_tags')
+	responded = perf_counter()
+
+assert response.status_code == 200, response.text
+print(dumps({ 'import': imported - start, 'first_request': responded - entered }))
+"""], capture_output=True, text=True)
+
+	assert result.returncode == 0, result.stderr
+	timings = loads(result.stdout.strip().splitlines()[-1])
+
+	assert timings['import'] < ImportBudget
+	assert timings['first_request'] < FirstRequestBudget
@@ -0,0 +1,52 @@
+import trending
+from trending import CountMinSketch, Trending
+
+
+class Clock :
+
+	def __init__(self: 'Clock', now: float) -> None :
+		self.now: float = now
+
+
+	def __call__(self: 'Clock') -> float :
+		return self.now
+
+
+def test_CountMinSketch_NeverUnderestimates() :
+	sketch: CountMinSketch = CountMinSketch(64, 4)
+
+	for i in range(1000) :
+		sketch.add(f'tag_{i % 100}', i % 7)
+
+	for i in range(100) :
+		assert sketch.estimate(f'tag_{i}') >= sum([j % 7 for j in range(i, 1000, 100)])
+
+
+def test_Trending_TopReturnsMostFrequent(monkeypatch) :
+	monkeypatch.setattr(trending, 'time', Clock(0))
+	monkeypatch.setattr(Trending, 'TopK', 2)
+	tags: Trending = Trending()
+
+	for i in range(100) :
+		tags.add(['cat', f'tag_{i}'])
+
+		if i % 2 :
+			tags.add(['dog'])
+
+	assert [tag for tag, _ in tags.top()] == ['cat', 'dog']
+
+
+def test_Trending_ExpiredWindowsAreForgotten(monkeypatch) :
+	clock: Clock = Clock(0)
+	monkeypatch.setattr(trending, 'time', clock)
+	tags: Trending = Trending()
+
+	tags.add(['cat'] * 10)
+	clock.now += Trending.WindowLength
+	tags.add(['dog'])
+
+	assert tags.top() == [('cat', 10), ('dog', 1)]
+
+	clock.now += Trending.WindowLength * (Trending.Windows - 1)
+
+	assert tags.top() == [('dog', 1)]
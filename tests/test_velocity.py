@@ -0,0 +1,57 @@
+import velocity
+from velocity import VoteVelocity
+
+
+class Clock :
+
+	def __init__(self: 'Clock', now: float) -> None :
+		self.now: float = now
+
+
+	def __call__(self: 'Clock') -> float :
+		return self.now
+
+
+def test_VoteVelocity_RanksRecentVotesHighest(monkeypatch) :
+	clock: Clock = Clock(60 * 1000)
+	monkeypatch.setattr(velocity, 'time', clock)
+	counters: VoteVelocity = VoteVelocity()
+
+	for _ in range(10) :
+		counters.record(1)
+
+	clock.now += 60 * 30
+
+	for _ in range(10) :
+		counters.record(2)
+
+	counters.record(3)
+
+	assert counters.top() == [2, 1, 3]
+	assert counters.velocity(2) > counters.velocity(1)
+
+
+def test_VoteVelocity_DropsColdPosts(monkeypatch) :
+	clock: Clock = Clock(60 * 1000)
+	monkeypatch.setattr(velocity, 'time', clock)
+	counters: VoteVelocity = VoteVelocity()
+
+	counters.record(1)
+	clock.now += 60 * VoteVelocity.Window
+	counters.record(2)
+
+	assert counters.top() == [2]
+	assert len(counters) == 1
+
+
+def test_VoteVelocity_BoundedByMaxPosts(monkeypatch) :
+	monkeypatch.setattr(velocity, 'time', Clock(60 * 1000))
+	monkeypatch.setattr(VoteVelocity, 'MaxPosts', 8)
+	counters: VoteVelocity = VoteVelocity()
+
+	for post_id in range(100) :
+		for _ in range(post_id) :
+			counters.record(post_id)
+
+	assert len(counters) <= 8
+	assert counters.top()[0] == 99
@@ -0,0 +1,108 @@
+from array import array
+from time import time
+from typing import Dict, Iterable, List, Tuple
+
+
+class CountMinSketch :
+	"""
+	approximate counter for an unbounded set of keys in fixed memory. a key's count is never underestimated, and is
+	overestimated by more than total / width with probability at most e^-depth.
+	"""
+
+	def __init__(self: 'CountMinSketch', width: int, depth: int) -> None :
+		assert width > 0 and depth > 0
+		self._width: int = width
+		self._rows: List[array] = [array('L', [0]) * width for _ in range(depth)]
+
+
+	def _indices(self: 'CountMinSketch', key: str) -> Iterable[Tuple[array, int]] :
+		for i, row in enumerate(self._rows) :
+			yield row, hash((i, key)) % self._width
+
+
+	def add(self: 'CountMinSketch', key: str, count: int = 1) -> None :
+		for row, i in self._indices(key) :
+			row[i] += count
+
+
+	def estimate(self: 'CountMinSketch', key: str) -> int :
+		return min([row[i] for row, i in self._indices(key)])
+
+
+	def clear(self: 'CountMinSketch') -> None :
+		for row in self._rows :
+			row[:] = array('L', [0]) * self._width
+
+
+class Trending :
+	"""
+	tracks the most frequent keys over a sliding window, using a ring of count-min sketches, one per sub-window.
+	the TopK keys with the highest estimates are kept as candidates, so the current top keys are read without
+	scanning anything. memory is fixed regardless of how many distinct keys are added.
+	"""
+
+	Width: int = 2048
+	Depth: int = 4
+	# the window slides in steps of WindowLength seconds, and covers Windows of those steps
+	Windows: int = 6
+	WindowLength: float = 600
+	TopK: int = 32
+
+	def __init__(self: 'Trending') -> None :
+		self._sketches: List[CountMinSketch] = [CountMinSketch(Trending.Width, Trending.Depth) for _ in range(Trending.Windows)]
+		self._window: int = int(time() // Trending.WindowLength)
+		self._top: Dict[str, int] = { }
+
+
+	def _slide(self: 'Trending') -> None :
+		window: int = int(time() // Trending.WindowLength)
+
+		if window <= self._window :
+			return
+
+		for w in range(max(self._window + 1, window - Trending.Windows + 1), window + 1) :
+			self._sketches[w % Trending.Windows].clear()
+
+		self._window = window
+
+		# candidates lose whatever they were counted in the expired windows
+		top: Dict[str, int] = { }
+
+		for key in self._top :
+			count: int = self.estimate(key)
+
+			if count :
+				top[key] = count
+
+		self._top = top
+
+
+	def estimate(self: 'Trending', key: str) -> int :
+		return sum([sketch.estimate(key) for sketch in self._sketches])
+
+
+	def add(self: 'Trending', keys: Iterable[str]) -> None :
+		self._slide()
+		sketch: CountMinSketch = self._sketches[self._window % Trending.Windows]
+
+		for key in keys :
+			sketch.add(key)
+			count: int = self.estimate(key)
+
+			if key in self._top or len(self._top) < Trending.TopK :
+				self._top[key] = count
+				continue
+
+			floor: str = min(self._top, key=self._top.__getitem__)
+
+			if count > self._top[floor] :
+				del self._top[floor]
+				self._top[key] = count
+
+
+	def top(self: 'Trending') -> List[Tuple[str, int]] :
+		"""
+		returns the most frequent keys within the window, with their estimated counts, most frequent first
+		"""
+		self._slide()
+		return sorted(self._top.items(), key=lambda x : x[1], reverse=True)
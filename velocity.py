@@ -0,0 +1,109 @@
+from heapq import nlargest
+from time import time
+from typing import Dict, List, Optional
+
+
+class VoteVelocity :
+	"""
+	tracks how quickly posts are receiving upvotes, entirely in memory. each post gets a ring buffer of per-minute
+	upvote counts covering the last Window minutes, and the fastest posts are periodically ranked with a top-k heap.
+	posts whose window empties are dropped, and the total number of posts tracked is capped at MaxPosts.
+	counts are per process, so with several workers each one ranks the sample of votes it received.
+	"""
+
+	# minutes covered by each post's ring buffer
+	Window: int = 60
+	MaxPosts: int = 10000
+	TopK: int = 1000
+	# seconds a ranking is served for before it's rebuilt
+	RankInterval: float = 10
+
+	def __init__(self: 'VoteVelocity') -> None :
+		self._buckets: Dict[int, List[int]] = { }
+		# the most recent minute written to each post's buckets
+		self._last: Dict[int, int] = { }
+		self._ranking: List[int] = []
+		self._ranked_at: float = 0
+
+
+	def _advance(self: 'VoteVelocity', post_id: int, minute: int) -> List[int] :
+		buckets: List[int] = self._buckets[post_id]
+		last: int = self._last[post_id]
+
+		# zero every bucket that's been passed since the post was last written to
+		for m in range(max(last + 1, minute - VoteVelocity.Window + 1), minute + 1) :
+			buckets[m % VoteVelocity.Window] = 0
+
+		self._last[post_id] = max(last, minute)
+		return buckets
+
+
+	def record(self: 'VoteVelocity', post_id: int, count: int = 1) -> None :
+		minute: int = int(time() // 60)
+
+		if post_id not in self._buckets :
+			if len(self._buckets) >= VoteVelocity.MaxPosts :
+				self._evict(minute)
+
+			self._buckets[post_id] = [0] * VoteVelocity.Window
+			self._last[post_id] = minute
+
+		self._advance(post_id, minute)[minute % VoteVelocity.Window] += count
+
+
+	def velocity(self: 'VoteVelocity', post_id: int, minute: Optional[int] = None) -> float :
+		"""
+		upvotes per minute over the window, with each minute weighted by how recent it is
+		"""
+		if post_id not in self._buckets :
+			return 0
+
+		minute = int(time() // 60) if minute is None else minute
+		buckets: List[int] = self._buckets[post_id]
+		last: int = self._last[post_id]
+		total: float = 0
+
+		for age in range(max(minute - last, 0), VoteVelocity.Window) :
+			total += buckets[(minute - age) % VoteVelocity.Window] * (VoteVelocity.Window - age)
+
+		return total / VoteVelocity.Window / VoteVelocity.Window
+
+
+	def _evict(self: 'VoteVelocity', minute: int) -> None :
+		# drops every cold post, then the slowest half of what's left if that wasn't enough
+		velocities: Dict[int, float] = { post_id: self.velocity(post_id, minute) for post_id in self._buckets }
+		keep: List[int] = [post_id for post_id, velocity in velocities.items() if velocity]
+
+		if len(keep) >= VoteVelocity.MaxPosts :
+			keep = nlargest(VoteVelocity.MaxPosts // 2, keep, key=velocities.__getitem__)
+
+		self._buckets = { post_id: self._buckets[post_id] for post_id in keep }
+		self._last = { post_id: self._last[post_id] for post_id in keep }
+
+
+	def _rank(self: 'VoteVelocity') -> None :
+		minute: int = int(time() // 60)
+		velocities: Dict[int, float] = { post_id: self.velocity(post_id, minute) for post_id in self._buckets }
+
+		for post_id, velocity in list(velocities.items()) :
+			if not velocity :
+				del self._buckets[post_id]
+				del self._last[post_id]
+				del velocities[post_id]
+
+		self._ranking = nlargest(VoteVelocity.TopK, velocities, key=velocities.__getitem__)
+		self._ranked_at = time()
+
+
+	def top(self: 'VoteVelocity') -> List[int] :
+		"""
+		returns the ids of the fastest rising posts, fastest first
+		"""
+		if time() - self._ranked_at >= VoteVelocity.RankInterval :
+			self._rank()
+
+		return self._ranking
+
+
+	def __len__(self: 'VoteVelocity') -> int :
+		return len(self._buckets)